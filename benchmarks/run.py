@@ -0,0 +1,372 @@
+"""
+Benchmarks for Mamo's hot paths, run against a synthetic library.
+
+    python -m benchmarks [--artists N --albums N --tracks N] [--repeat N]
+                         [--output results.json] [--compare baseline.json]
+
+Results are written as JSON (timings in seconds, min/median/mean/stdev over
+the repeats) together with the library size and environment, so two runs
+can be compared with --compare. Everything runs headless: benchmarks whose
+dependencies (GStreamer, GTK) are missing are reported as skipped.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import contextlib
+import concurrent.futures
+import platform
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gi.repository import GLib
+
+from benchmarks import synthlib
+from mamo.artstore import ArtStore
+from mamo.library import LibraryManager
+from mamo.librarydb import LibraryDatabase
+from mamo.playlist import PlaylistJournal, song_entry, write_playlist_file
+from mamo.playlistmodel import PlaylistModel, PlaylistIndex, SongRecord
+from mamo.waveformcache import WaveformCache
+
+RESULTS_VERSION = 1
+
+# Longest a single main loop wait may take before the run is abandoned
+LOOP_TIMEOUT_SECONDS = 600
+
+
+class Skipped(Exception):
+    pass
+
+
+class NoThumbnails:
+    """Stands in for ThumbnailCache where GdkPixbuf is not installed."""
+    def generate(self, art_hash):
+        pass
+
+
+def run_until(instance, signal):
+    """Runs the main loop until instance emits signal."""
+    loop = GLib.MainLoop()
+    handler = instance.connect(signal, lambda *args: loop.quit())
+    timeout = GLib.timeout_add_seconds(LOOP_TIMEOUT_SECONDS, loop.quit)
+    loop.run()
+    GLib.source_remove(timeout)
+    instance.disconnect(handler)
+
+
+class Bench:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def measure(self, name, func, setup=None, repeat=None):
+        """Times func() repeat times, calling setup() untimed before each run."""
+        timings = []
+        try:
+            for _ in range(repeat or self.repeat):
+                state = setup() if setup else None
+                start = time.perf_counter()
+                func(state) if setup else func()
+                timings.append(time.perf_counter() - start)
+        except Skipped as e:
+            self.results[name] = {'skipped': str(e)}
+            self._report(name)
+            return
+        self.results[name] = {
+            'runs': len(timings),
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.fmean(timings),
+            'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        }
+        self._report(name)
+
+    def skip(self, name, reason):
+        self.results[name] = {'skipped': reason}
+        self._report(name)
+
+    def _report(self, name):
+        result = self.results[name]
+        if 'skipped' in result:
+            line = f"{name:<36} skipped ({result['skipped']})"
+        else:
+            line = f"{name:<36} {result['median'] * 1000:10.2f} ms (min {result['min'] * 1000:.2f}, n={result['runs']})"
+        print(line, file=sys.stderr)
+
+
+class MamoBenchmarks:
+    def __init__(self, bench, library_root, work_dir, scan_workers):
+        self.bench = bench
+        self.library_root = library_root
+        self.work_dir = work_dir
+        self.scan_workers = scan_workers
+        self.art_store = ArtStore(os.path.join(work_dir, 'art'))
+        try:
+            from mamo.thumbnails import ThumbnailCache
+            self.thumbnails = ThumbnailCache(self.art_store, os.path.join(work_dir, 'thumbnails'))
+        except (ImportError, ValueError):
+            self.thumbnails = NoThumbnails()
+        self._n_dbs = 0
+
+    def _new_db_path(self):
+        self._n_dbs += 1
+        return os.path.join(self.work_dir, f"library-{self._n_dbs}.db")
+
+    def _manager(self, db_path):
+        return LibraryManager(self.library_root, db_path, self.art_store, self.thumbnails,
+                              scan_workers=self.scan_workers, watch=False)
+
+    def run_library(self):
+        bench = self.bench
+
+        # A scan makes thumbnails after 'scan-finished'; they are waited for
+        # (untimed) so they don't run into the next measurement
+        scanned = []
+
+        def drain_scans():
+            while scanned:
+                scanned.pop().wait_for_scan()
+
+        def full_scan(state):
+            # A manager on an empty database starts the initial scan by itself
+            scanned.append(self._manager(self._new_db_path()))
+            run_until(scanned[-1], 'scan-finished')
+        bench.measure('library.scan.full', full_scan, setup=drain_scans)
+        drain_scans()
+
+        self.db_path = self._new_db_path()
+        manager = self._manager(self.db_path)
+        run_until(manager, 'scan-finished')
+        manager.wait_for_scan()
+
+        def rescan(state):
+            manager.start_scan()
+            run_until(manager, 'scan-finished')
+        bench.measure('library.scan.incremental', rescan, setup=manager.wait_for_scan)
+        manager.wait_for_scan()
+
+        bench.measure('library.cache.load',
+                      lambda: run_until(self._manager(self.db_path), 'library-updated'))
+
+        def load_and_index():
+            loaded = self._manager(self.db_path)
+            run_until(loaded, 'tracks-indexed')
+        bench.measure('library.track_index.build', load_and_index)
+
+        db = LibraryDatabase(self.db_path, self.art_store)
+        folders = db.load_folders()
+        albums = [(t, a, f, h) for t, a, f, h in db.load_albums()]
+        tracks = dict(db.load_all_tracks())
+        bench.measure('library.cache.save',
+                      lambda: LibraryDatabase(self._new_db_path(), self.art_store)
+                      .commit_scan_batch(folders, albums, tracks))
+
+        manager = self._manager(self.db_path)
+        run_until(manager, 'tracks-indexed')
+        self.manager = manager
+
+        def album_songs():
+            for album in manager.albums:
+                manager.get_album_songs(album)
+        bench.measure('library.get_album_songs.indexed', album_songs)
+
+        bench.measure('library.get_album_songs.untagged', lambda state: album_songs(),
+                      setup=manager.db.clear_tracks)
+        bench.measure('library.get_all_songs', manager.get_all_songs)
+        # What "play all albums" waits for before the first song plays
+        bench.measure('library.play_all.first_album',
+                      lambda: manager.get_album_songs(random.choice(manager.albums)))
+        # ... and what it streams into the playlist after that
+        bench.measure('library.play_all.stream',
+                      lambda: sum(len(records) for _album, records in manager.iter_album_records(manager.albums)))
+
+        queries = ['a', 'art', 'track 1', 'album 01', 'artist 00 track']
+        bench.measure('library.search_albums', lambda: [manager.search_albums(q) for q in queries])
+        bench.measure('library.search_songs', lambda: [manager.search_songs(q, 200) for q in queries])
+
+        if isinstance(self.thumbnails, NoThumbnails):
+            bench.skip('thumbnails.generate', "GdkPixbuf not available")
+        else:
+            hashes = sorted({album.art_hash for album in manager.albums if album.art_hash})
+
+            def clear_thumbnails():
+                shutil.rmtree(self.thumbnails.root, ignore_errors=True)
+            bench.measure('thumbnails.generate',
+                          lambda state: [self.thumbnails.generate(h) for h in hashes],
+                          setup=clear_thumbnails)
+
+    def _waveform_module(self):
+        try:
+            import gi
+            gi.require_version('Gst', '1.0')
+            from gi.repository import Gst
+            from mamo import waveform
+        except (ImportError, ValueError) as e:
+            raise Skipped(f"GStreamer not available: {e}")
+        Gst.init(None)
+        return waveform
+
+    def run_playlist(self):
+        bench = self.bench
+        songs = self.manager.get_all_songs()
+        random.Random(0).shuffle(songs)
+
+        path = os.path.join(self.work_dir, 'playlist.json')
+        entries = [song_entry(song) for song in songs]
+        bench.measure('playlist.snapshot.write', lambda: write_playlist_file(path, entries))
+
+        def fill_model():
+            # What loading the playlist does on the main thread
+            model = PlaylistModel()
+            PlaylistIndex(model)
+            model.splice_records(0, 0, [SongRecord(e['uri'], e['title'], e['artist'],
+                                                   duration=e['duration_ns']) for e in entries])
+        bench.measure('playlist.model.fill', fill_model)
+
+        store = PlaylistModel()
+        store.splice(0, 0, songs)
+        journal = PlaylistJournal(path)
+        journal.load()
+        journal.attach(store)
+
+        def reorder():
+            # 100 drag and drops, each one journal line
+            rng = random.Random(1)
+            for _ in range(100):
+                source = rng.randrange(store.get_n_items())
+                song = store.get_item(source)
+                store.remove(source)
+                store.insert(rng.randrange(store.get_n_items() + 1), song)
+            journal.flush()
+        bench.measure('playlist.journal.100_moves', reorder)
+        journal.close()
+
+        bench.measure('playlist.load', lambda: PlaylistJournal(path).load())
+
+        # A four minute waveform for every song
+        waveform_dir = os.path.join(self.work_dir, 'waveforms')
+        shutil.rmtree(waveform_dir, ignore_errors=True)
+        rng = random.Random(2)
+        waveform = [rng.random() for _ in range(4800)]
+        cache = WaveformCache(waveform_dir)
+        for song in songs:
+            cache.put(song.uri, waveform)
+        uris = [song.uri for song in songs]
+        # What restoring the playlist does: open the cache, find the missing ones
+        def open_and_check():
+            opened = WaveformCache(waveform_dir)
+            return [uri for uri in uris if uri not in opened]
+        bench.measure('waveform.cache.open_and_check', open_and_check)
+        bench.measure('waveform.cache.get', lambda: [cache.get(uri) for uri in uris[:100]])
+
+        try:
+            waveform = self._waveform_module()
+        except Skipped as e:
+            bench.skip('waveform.analyze', str(e))
+            return
+
+        # Decodable formats only, see synthlib
+        candidates = [s.uri for s in songs if s.uri.endswith(('.mp3', '.flac'))][:8]
+        if not candidates:
+            bench.skip('waveform.analyze', "no MP3/FLAC tracks in the library")
+            return
+
+        bench.measure('waveform.analyze', lambda: [waveform.analyze_waveform(uri) for uri in candidates])
+        bench.measure('waveform.analyze.level', lambda: [waveform.analyze_with_level(uri) for uri in candidates])
+
+        def analyze_parallel():
+            # What the WaveformAnalyzer's workers do, without a main loop
+            with concurrent.futures.ThreadPoolExecutor(max_workers=waveform.default_workers()) as executor:
+                list(executor.map(waveform.analyze_waveform, candidates))
+        bench.measure('waveform.analyze.parallel', analyze_parallel)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, current):
+    """Prints the median of each benchmark relative to a previous run."""
+    print(f"{'benchmark':<36} {'baseline':>12} {'current':>12} {'ratio':>8}", file=sys.stderr)
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or 'median' not in old or 'median' not in result:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else float('inf')
+        print(f"{name:<36} {old['median'] * 1000:10.2f}ms {result['median'] * 1000:10.2f}ms {ratio:7.2f}x",
+              file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Mamo on a synthetic library")
+    parser.add_argument('--artists', type=int, default=20)
+    parser.add_argument('--albums', type=int, default=5, help="albums per artist")
+    parser.add_argument('--tracks', type=int, default=10, help="tracks per album")
+    parser.add_argument('--seconds', type=float, default=5.0, help="length of each track")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scan-workers', type=int, default=0)
+    parser.add_argument('--library', help="use (and keep) this library folder, generating it if empty")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--skip-playlist', action='store_true', help="skip the playlist and waveform benchmarks")
+    parser.add_argument('--quiet', action='store_true', help="silence Mamo's own output (written to stderr otherwise)")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='mamo-bench-')
+    library_root = os.path.abspath(args.library) if args.library else os.path.join(work_dir, 'library')
+    try:
+        if not os.path.isdir(library_root) or not os.listdir(library_root):
+            summary = synthlib.generate(library_root, args.artists, args.albums, args.tracks, args.seconds)
+        else:
+            summary = {'root': library_root}
+        print(f"Benchmarking on {library_root}", file=sys.stderr)
+
+        # Mamo's own prints never mix with the JSON on stdout
+        with open(os.devnull, 'w') if args.quiet else contextlib.nullcontext(sys.stderr) as app_output, \
+                contextlib.redirect_stdout(app_output):
+            bench = Bench(args.repeat)
+            benchmarks = MamoBenchmarks(bench, library_root, os.path.join(work_dir, 'cache'),
+                                        args.scan_workers or None)
+            benchmarks.run_library()
+            if not args.skip_playlist:
+                benchmarks.run_playlist()
+
+        results = {
+            'version': RESULTS_VERSION,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'library': summary,
+            'repeat': args.repeat,
+            'results': bench.results,
+        }
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+
+        if args.compare:
+            with open(args.compare) as f:
+                compare(json.load(f), results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Synthetic music library generator for the benchmarks.
+
+Writes a tree of <Artist>/<Album>/<NN Title>.<ext> files that are small but
+valid enough for mutagen and the scanner: MP3 files are MPEG-1 Layer III
+silence with ID3v2 tags, FLAC files hold silent constant-subframe frames
+with Vorbis comments. Ogg files carry proper Vorbis identification and
+comment headers (enough for tag and length reading) but no decodable audio,
+so waveform benchmarks stick to MP3 and FLAC. Half of the albums get a
+cover.png, the other half embedded art, each album with its own image.
+
+Usage: python -m benchmarks.synthlib DEST [--artists N] [--albums N] [--tracks N]
+"""
+import os
+import sys
+import zlib
+import base64
+import struct
+import argparse
+
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TRCK, TPOS, APIC
+from mutagen.flac import FLAC, Picture
+from mutagen.oggvorbis import OggVorbis
+from mutagen.ogg import OggPage
+
+FORMATS = ('mp3', 'flac', 'ogg')
+
+SAMPLE_RATE = 44100
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no CRC, joint stereo; all-zero side
+# info and main data decode to silence. 1152 samples per 417 byte frame.
+MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+MP3_FRAME_SAMPLES = 1152
+
+FLAC_BLOCK_SIZE = 4096
+
+
+def make_png(rgb, size=64):
+    """Returns a solid colour RGB PNG."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body))
+    row = b'\x00' + bytes(rgb) * size
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * size))
+            + chunk(b'IEND', b''))
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xff if crc & 0x80 else (crc << 1) & 0xff
+    return crc
+
+
+def _crc16(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xffff if crc & 0x8000 else (crc << 1) & 0xffff
+    return crc
+
+
+def _flac_frame(number):
+    # Fixed blocking, 4096 samples, 44.1 kHz, left/right, 16 bit
+    header = b'\xff\xf8\xc9\x18' + chr(number).encode('utf-8')
+    header += bytes([_crc8(header)])
+    # Two constant subframes holding sample value 0
+    frame = header + b'\x00\x00\x00' * 2
+    return frame + struct.pack('>H', _crc16(frame))
+
+
+def write_mp3(path, seconds, tags, art=None):
+    n_frames = max(1, int(seconds * SAMPLE_RATE / MP3_FRAME_SAMPLES))
+    with open(path, 'wb') as f:
+        f.write(MP3_FRAME * n_frames)
+    id3 = ID3()
+    id3.add(TIT2(encoding=3, text=tags['title']))
+    id3.add(TPE1(encoding=3, text=tags['artist']))
+    id3.add(TALB(encoding=3, text=tags['album']))
+    id3.add(TRCK(encoding=3, text=f"{tags['tracknumber']}/{tags['tracktotal']}"))
+    id3.add(TPOS(encoding=3, text=str(tags['discnumber'])))
+    if art:
+        id3.add(APIC(encoding=3, mime='image/png', type=3, desc='Cover', data=art))
+    id3.save(path)
+
+
+def write_flac(path, seconds, tags, art=None):
+    n_frames = max(1, int(seconds * SAMPLE_RATE / FLAC_BLOCK_SIZE))
+    total_samples = n_frames * FLAC_BLOCK_SIZE
+    streaminfo = struct.pack('>HH', FLAC_BLOCK_SIZE, FLAC_BLOCK_SIZE) + b'\x00' * 6
+    # 20 bit sample rate, 3 bit channels - 1, 5 bit bits per sample - 1, 36 bit total samples
+    packed = (SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | total_samples
+    streaminfo += packed.to_bytes(8, 'big') + b'\x00' * 16
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + b'\x80' + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+        for number in range(n_frames):
+            f.write(_flac_frame(number))
+    audio = FLAC(path)
+    _set_vorbis_tags(audio, tags)
+    if art:
+        audio.add_picture(_picture(art))
+    audio.save()
+
+
+def write_ogg(path, seconds, tags, art=None):
+    serial = 0x4d414d4f
+    ident = (b'\x01vorbis' + struct.pack('<IBIiii', 0, 2, SAMPLE_RATE, 0, 128000, 0)
+             + b'\xb8\x01')
+    comment = b'\x03vorbis' + struct.pack('<I', 0) + struct.pack('<I', 0) + b'\x01'
+    setup = b'\x05vorbis' + b'\x00' * 8
+
+    pages = []
+    for sequence, (packets, position) in enumerate(
+            [([ident], 0), ([comment, setup], 0), ([b'\x00'], int(seconds * SAMPLE_RATE))]):
+        page = OggPage()
+        page.serial = serial
+        page.sequence = sequence
+        page.packets = packets
+        page.position = position
+        page.first = sequence == 0
+        page.last = sequence == 2
+        pages.append(page)
+    with open(path, 'wb') as f:
+        for page in pages:
+            f.write(page.write())
+
+    audio = OggVorbis(path)
+    _set_vorbis_tags(audio, tags)
+    if art:
+        audio['metadata_block_picture'] = [base64.b64encode(_picture(art).write()).decode('ascii')]
+    audio.save()
+
+
+def _set_vorbis_tags(audio, tags):
+    audio['title'] = tags['title']
+    audio['artist'] = tags['artist']
+    audio['album'] = tags['album']
+    audio['tracknumber'] = str(tags['tracknumber'])
+    audio['discnumber'] = str(tags['discnumber'])
+
+
+def _picture(art):
+    picture = Picture()
+    picture.type = 3
+    picture.mime = 'image/png'
+    picture.width = picture.height = 64
+    picture.depth = 24
+    picture.data = art
+    return picture
+
+
+WRITERS = {'mp3': write_mp3, 'flac': write_flac, 'ogg': write_ogg}
+
+
+def generate(root, artists=10, albums=3, tracks=10, seconds=2.0, formats=FORMATS):
+    """
+    Creates the library below root and returns a summary dict. Albums cycle
+    through the given formats; even albums get a cover.png, odd ones embed
+    their art in every track.
+    """
+    n_tracks = 0
+    n_albums = 0
+    for a in range(artists):
+        artist = f"Artist {a:03d}"
+        for b in range(albums):
+            album = f"Album {b:02d}"
+            folder = os.path.join(root, artist, album)
+            os.makedirs(folder, exist_ok=True)
+            ext = formats[n_albums % len(formats)]
+            art = make_png(((a * 37) % 256, (b * 91) % 256, (n_albums * 53) % 256))
+            embedded = n_albums % 2 == 1
+            if not embedded:
+                with open(os.path.join(folder, 'cover.png'), 'wb') as f:
+                    f.write(art)
+            for t in range(tracks):
+                tags = {
+                    'title': f"Track {t + 1} of {album} by {artist}",
+                    'artist': artist,
+                    'album': album,
+                    'tracknumber': t + 1,
+                    'tracktotal': tracks,
+                    'discnumber': 1,
+                }
+                path = os.path.join(folder, f"{t + 1:02d} Track.{ext}")
+                WRITERS[ext](path, seconds, tags, art if embedded else None)
+                n_tracks += 1
+            n_albums += 1
+    return {'root': root, 'artists': artists, 'albums': n_albums, 'tracks': n_tracks,
+            'seconds': seconds, 'formats': list(formats)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic music library")
+    parser.add_argument('dest')
+    parser.add_argument('--artists', type=int, default=10)
+    parser.add_argument('--albums', type=int, default=3, help="albums per artist")
+    parser.add_argument('--tracks', type=int, default=10, help="tracks per album")
+    parser.add_argument('--seconds', type=float, default=2.0, help="length of each track")
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    args = parser.parse_args(argv)
+    summary = generate(args.dest, args.artists, args.albums, args.tracks, args.seconds,
+                       tuple(args.formats.split(',')))
+    print(f"Generated {summary['tracks']} tracks in {summary['albums']} albums below {args.dest}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -82,9 +82,10 @@ class MamoApplication(Adw.Application):
              self.window._save_playlist()
 
         
-        if self.window and hasattr(self.window, 'discoverer') and self.window.discoverer:
-            print("Stopping discoverer...")
-            self.window.discoverer.stop()
+        if self.window:
+            print("Stopping discovery and waveform analysis...")
+            self.window.metadata.discovery.stop()
+            self.window.waveform_analyzer.cancel_all()
         if self.window and hasattr(self.window, 'player') and self.window.player:
              print("Setting player to NULL state...")
              self.window.player.set_state(Gst.State.NULL)
@@ -0,0 +1,177 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import collections
+from gi.repository import GLib
+
+# Decoded GLib.Bytes kept in memory, enough for a screenful of albums
+MEMORY_CACHE_SIZE = 32
+# Images younger than this survive a sweep, they may be about to be referenced
+SWEEP_GRACE_SECONDS = 60 * 60
+
+
+class ArtStore:
+    """
+    Content-addressed cover art store (at ~/.cache/mamo/art). Each image is
+    stored once, under the SHA-1 of its bytes, and everything else (library,
+    playlists, MPRIS) refers to it by that hash. Safe to use from any thread.
+
+    Whatever refers to images registers a source with add_references();
+    sweep() deletes the images none of them refers to.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict() # hash -> GLib.Bytes
+        self._sources = [] # Callables returning referenced hashes
+
+    @staticmethod
+    def hash_bytes(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def path(self, art_hash):
+        """Returns the file path for a hash (it may not exist)."""
+        return os.path.join(self.root, art_hash[:2], art_hash)
+
+    def contains(self, art_hash):
+        return bool(art_hash) and os.path.exists(self.path(art_hash))
+
+    def put(self, data):
+        """Stores raw image bytes and returns their hash."""
+        if not data:
+            return None
+        art_hash = self.hash_bytes(data)
+        path = self.path(art_hash)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write then rename so readers never see a partial image
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"ArtStore: Error storing {art_hash}: {e}")
+                return None
+        else:
+            # Stored again: it is about to be referenced, keep sweep() off it
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return art_hash
+
+    def get(self, art_hash):
+        """Returns the image for a hash as GLib.Bytes, or None."""
+        if not art_hash:
+            return None
+        with self._lock:
+            data = self._memory.get(art_hash)
+            if data is not None:
+                self._memory.move_to_end(art_hash)
+                return data
+        try:
+            with open(self.path(art_hash), "rb") as f:
+                data = GLib.Bytes.new(f.read())
+        except OSError:
+            return None
+        with self._lock:
+            self._memory[art_hash] = data
+            while len(self._memory) > MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+        return data
+
+    def add_references(self, source):
+        """
+        Registers source() -> iterable of referenced hashes, called from a
+        background thread. It returns None while it can't tell yet (e.g.
+        the playlist is still loading), which postpones sweeps.
+        """
+        self._sources.append(source)
+
+    def referenced(self):
+        """Returns the hashes referenced by any source, or None if one can't tell yet."""
+        hashes = set()
+        for source in list(self._sources):
+            found = source()
+            if found is None:
+                return None
+            hashes.update(found)
+        hashes.discard(None)
+        return hashes
+
+    def entries(self):
+        """Returns (hash, bytes, last access) of every stored image."""
+        entries = []
+        try:
+            folders = os.listdir(self.root)
+        except OSError:
+            return entries
+        for folder in folders:
+            try:
+                names = os.listdir(os.path.join(self.root, folder))
+            except OSError:
+                continue
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.root, folder, name))
+                except OSError:
+                    continue
+                entries.append((name, st.st_size, max(st.st_atime, st.st_mtime)))
+        return entries
+
+    def delete(self, art_hashes):
+        for art_hash in art_hashes:
+            with self._lock:
+                self._memory.pop(art_hash, None)
+            try:
+                os.unlink(self.path(art_hash))
+            except OSError:
+                pass
+
+    def sweep(self):
+        """
+        Deletes the images no source refers to, except recently stored ones.
+        Returns the deleted hashes. Any thread, slow.
+        """
+        unused = [art_hash for art_hash, _size, _accessed in self.unused_entries()]
+        self.delete(unused)
+        if unused:
+            print(f"ArtStore: Deleted {len(unused)} unused images")
+        return unused
+
+    def unused_entries(self):
+        """Like entries(), for the images no source refers to, except recently stored ones."""
+        referenced = self.referenced()
+        if referenced is None:
+            return []
+        cutoff = time.time() - SWEEP_GRACE_SECONDS
+        return [entry for entry in self.entries() if entry[0] not in referenced and entry[2] < cutoff]
+
+
+class ArtCache:
+    """
+    The ArtStore as CacheManager sees it: every image counts towards the
+    quota, but only ones nothing refers to can be evicted (they would not
+    come back, the rest would be stored again by the next scan).
+    """
+    def __init__(self, art_store):
+        self.art_store = art_store
+
+    def entries(self):
+        return self.art_store.unused_entries()
+
+    def evict(self, art_hashes):
+        # Referenced since entries(), e.g. a song added to the playlist
+        referenced = self.art_store.referenced()
+        if referenced is None:
+            return
+        self.art_store.delete([h for h in art_hashes if h not in referenced])
+
+    def usage(self):
+        return sum(size for _hash, size, _accessed in self.art_store.entries())
@@ -0,0 +1,105 @@
+import threading
+import collections
+
+from gi.repository import GLib
+
+# Bytes Mamo's caches may take together
+DEFAULT_QUOTA = 512 * 1024 * 1024
+# Eviction goes down to this fraction of the quota, so it doesn't run
+# again for every waveform added after it
+LOW_WATER = 0.9
+# The first check waits for startup to settle, later ones run this often (seconds)
+FIRST_CHECK_DELAY = 60
+CHECK_INTERVAL = 30 * 60
+
+
+class CacheManager:
+    """
+    Keeps Mamo's caches (waveforms, thumbnails, cover art, metadata) under
+    one byte quota. Entries whose source changed are dropped first, then the
+    least recently used ones across all caches until the bytes on disk are
+    back under the quota. Checks run in a background thread, once shortly
+    after startup and then every CHECK_INTERVAL.
+
+    A cache offers entries() -> [(key, bytes, last access)] of what it can
+    evict, evict(keys) and usage() -> bytes on disk, and may offer
+    stale() -> [keys] and compact(force=False).
+    """
+    def __init__(self, caches, quota=DEFAULT_QUOTA):
+        self.caches = list(caches)
+        self.quota = quota
+        self._running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        def first_check():
+            self.check()
+            GLib.timeout_add_seconds(CHECK_INTERVAL, self._on_interval)
+            return False
+        GLib.timeout_add_seconds(FIRST_CHECK_DELAY, first_check)
+
+    def _on_interval(self):
+        self.check()
+        return True
+
+    def check(self):
+        """Runs enforce() in the background unless it is already running."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        threading.Thread(target=self._check_thread, name="mamo-cache", daemon=True).start()
+
+    def _check_thread(self):
+        try:
+            self.enforce()
+        except Exception as e:
+            print(f"CacheManager: Error checking caches: {e}")
+        finally:
+            with self._lock:
+                self._running = False
+
+    def usage(self):
+        return sum(cache.usage() for cache in self.caches)
+
+    def enforce(self):
+        """Drops stale entries, evicts down to the quota and compacts. Any thread, slow."""
+        for cache in self.caches:
+            stale = getattr(cache, 'stale', None)
+            keys = stale() if stale else None
+            if keys:
+                cache.evict(keys)
+                print(f"CacheManager: Dropped {len(keys)} stale entries from {type(cache).__name__}")
+
+        # Bytes on disk, including what can't be evicted
+        total = self.usage()
+        if total > self.quota:
+            # Dead bytes go first, they may be all that is over
+            self._compact(self.caches, force=True)
+            total = self.usage()
+        if total <= self.quota:
+            self._compact(self.caches)
+            return
+
+        entries = [(accessed, size, cache, key)
+                   for cache in self.caches for key, size, accessed in cache.entries()]
+        entries.sort(key=lambda entry: entry[0])
+        target = self.quota * LOW_WATER
+        victims = collections.defaultdict(list)
+        for _accessed, size, cache, key in entries:
+            if total <= target:
+                break
+            victims[cache].append(key)
+            total -= size
+        for cache, keys in victims.items():
+            cache.evict(keys)
+        print(f"CacheManager: Evicted {sum(len(keys) for keys in victims.values())} entries, "
+              f"{total // 1024} KiB left of {self.quota // 1024} KiB")
+        self._compact(victims, force=True)
+
+    @staticmethod
+    def _compact(caches, force=False):
+        for cache in caches:
+            compact = getattr(cache, 'compact', None)
+            if compact:
+                compact(force=force)
@@ -0,0 +1,126 @@
+import os
+import time
+import collections
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import GObject, Gst, GstPbutils
+
+# A file that takes longer than this to discover is reported as an error
+DISCOVERY_TIMEOUT = 5 * Gst.SECOND
+# URIs handed to each Discoverer at a time: one being discovered, one
+# waiting behind it so the Discoverer never idles between results
+URIS_PER_DISCOVERER = 2
+# 'progress' is emitted at most this often (seconds)
+PROGRESS_INTERVAL = 0.25
+
+
+def default_workers():
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class DiscoveryPool(GObject.Object):
+    """
+    Discovers URIs with a pool of GstPbutils.Discoverers. URIs wait in a
+    queue and only a small window of them is handed to the Discoverers at
+    a time, so a folder of 10k files neither floods GStreamer nor keeps
+    the rest waiting behind one slow file.
+
+    Emits 'discovered' (info, error) for every URI that wasn't cancelled,
+    'progress' (done, total, eta seconds or -1) while a batch runs and
+    'finished' once the queue is empty. Used from the main thread.
+    """
+    __gsignals__ = {
+        'discovered': (GObject.SignalFlags.RUN_FIRST, None, (object, object)),
+        'progress': (GObject.SignalFlags.RUN_FIRST, None, (int, int, float)),
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    def __init__(self, workers=None, timeout=DISCOVERY_TIMEOUT, uris_per_discoverer=URIS_PER_DISCOVERER):
+        super().__init__()
+        self.uris_per_discoverer = uris_per_discoverer
+        self._in_flight = {} # Discoverer -> URIs handed to it
+        for _ in range(workers or default_workers()):
+            discoverer = GstPbutils.Discoverer.new(timeout)
+            discoverer.connect("discovered", self._on_discovered)
+            discoverer.start()
+            self._in_flight[discoverer] = 0
+        self._pending = collections.deque()
+        self._running = collections.Counter() # uri -> times in flight
+        self._cancelled = set() # In flight URIs whose results are dropped
+        self._done = 0
+        self._total = 0
+        self._started = 0.0
+        self._last_progress = 0.0
+
+    def add(self, uris):
+        """Queues URIs for discovery."""
+        uris = [uri for uri in uris if uri]
+        if not uris:
+            return
+        if not self._total:
+            self._started = time.monotonic()
+        self._pending.extend(uris)
+        self._total += len(uris)
+        self._fill()
+        self._check_finished()
+
+    def cancel_all(self):
+        """Drops everything queued or being discovered."""
+        self._total -= len(self._pending)
+        self._pending.clear()
+        self._cancelled.update(uri for uri, n in self._running.items() if n)
+        self._check_finished()
+
+    def stop(self):
+        self.cancel_all()
+        for discoverer in self._in_flight:
+            discoverer.stop()
+
+    def _fill(self):
+        while self._pending:
+            discoverer = min(self._in_flight, key=self._in_flight.get)
+            if self._in_flight[discoverer] >= self.uris_per_discoverer:
+                return
+            uri = self._pending.popleft()
+            if discoverer.discover_uri_async(uri):
+                self._in_flight[discoverer] += 1
+                self._running[uri] += 1
+            else:
+                print(f"DiscoveryPool: Could not queue {uri}")
+                self._done += 1
+
+    def _on_discovered(self, discoverer, info, error):
+        uri = info.get_uri()
+        self._in_flight[discoverer] -= 1
+        self._running[uri] -= 1
+        if self._running[uri] <= 0:
+            del self._running[uri]
+            cancelled = uri in self._cancelled
+            self._cancelled.discard(uri)
+        else:
+            cancelled = uri in self._cancelled
+        self._done += 1
+        self._fill()
+        if not cancelled:
+            self.emit('discovered', info, error)
+
+        now = time.monotonic()
+        if now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self._emit_progress(now)
+        self._check_finished()
+
+    def _emit_progress(self, now):
+        done = min(self._done, self._total)
+        eta = -1.0
+        if done:
+            eta = (now - self._started) / done * (self._total - done)
+        self.emit('progress', done, self._total, eta)
+
+    def _check_finished(self):
+        if self._total and not self._pending and not any(self._in_flight.values()):
+            self._emit_progress(time.monotonic())
+            self._done = self._total = 0
+            self.emit('finished')
@@ -2,77 +2,241 @@
 import gi
 import threading
 import os
-import json
 import base64
+import hashlib
+import collections
+import concurrent.futures
+import multiprocessing
 import mutagen
 from gi.repository import GObject, GLib
 
 from .models import Album, Song
+from .playlistmodel import SongRecord
+from .librarydb import LibraryDatabase, TrackRecord
+from .watcher import LibraryWatcher
+from .search import SearchIndex
 import pathlib
+import urllib.parse
+
+# Files used to detect albums during a scan
+SCAN_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.ogg')
+# Files that make up an album's tracks (and its folder fingerprint)
+TRACK_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.ogg', '.opus', '.wav')
+
+# Number of changed folders committed per database transaction
+SCAN_BATCH_SIZE = 200
+
+COVER_FILENAMES = ["cover.jpg", "Cover.jpg", "folder.jpg", "Folder.jpg", "cover.png", "Cover.png", "album.jpg", "Album.jpg", "album.png", "Album.png"]
+
+
+def read_folder_art(folder):
+    """Returns the raw bytes of the first cover image found in a folder."""
+    for fn in COVER_FILENAMES:
+        path = os.path.join(folder, fn)
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except:
+                pass
+    return None
+
+
+def read_embedded_art(filepath):
+    """Returns the raw bytes of the album art embedded in an audio file."""
+    try:
+        audio_raw = mutagen.File(filepath)
+        if not audio_raw or not audio_raw.tags:
+            return None
+        
+        art_bytes = None
+        if isinstance(audio_raw.tags, mutagen.id3.ID3):
+            # Search for any APIC frame
+            for tag_name in audio_raw.tags.keys():
+                if tag_name.startswith('APIC'):
+                    art_bytes = audio_raw.tags[tag_name].data
+                    break
+        elif isinstance(audio_raw, mutagen.mp4.MP4) and 'covr' in audio_raw.tags and audio_raw.tags['covr']:
+            art_bytes = bytes(audio_raw.tags['covr'][0])
+        elif hasattr(audio_raw, 'pictures') and audio_raw.pictures:
+            art_bytes = audio_raw.pictures[0].data
+        elif hasattr(audio_raw.tags, 'get'):
+            # Try common Ogg/Vorbis approach
+            pics = audio_raw.tags.get('metadata_block_picture', [])
+            if pics:
+                from mutagen.flac import Picture
+                try:
+                    p = Picture(base64.b64decode(pics[0]))
+                    art_bytes = p.data
+                except:
+                    pass
+        return art_bytes or None
+    except Exception as e:
+        print(f"LibraryManager: Error extracting embedded art from {filepath}: {e}")
+    return None
+
+
+def _parse_number(value):
+    """Parses track/disc numbers, including the "1/12" form."""
+    try:
+        return int(str(value).split('/')[0])
+    except (TypeError, ValueError):
+        return 0
+
+
+def read_track_tags(path):
+    """
+    Returns (title, artist, album, track_num, disc_num, duration_ns) for one
+    file, with None for missing tags, or None if mutagen cannot read it.
+    """
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as e:
+        print(f"LibraryManager: Error reading tags from {path}: {e}")
+        return None
+    if not audio:
+        return None
+    duration_ns = 0
+    if audio.info and hasattr(audio.info, 'length'):
+        duration_ns = int(audio.info.length * 1000000000)
+    return (audio.get('title', [None])[0],
+            audio.get('artist', [None])[0],
+            audio.get('album', [None])[0],
+            _parse_number(audio.get('tracknumber', ['0'])[0]),
+            _parse_number(audio.get('discnumber', ['0'])[0]),
+            duration_ns)
+
+
+def read_track(root, name, size, mtime):
+    """Reads one file into a TrackRecord for the track index."""
+    path = os.path.join(root, name)
+    tags = read_track_tags(path) or (None, None, None, 0, 0, 0)
+    return TrackRecord(pathlib.Path(path).as_uri(), root, *tags, mtime, size)
+
+
+def _album_files(tracks):
+    return [name for name, _size, _mtime in tracks if name.lower().endswith(SCAN_EXTENSIONS)]
+
+
+def read_album_art(root, album_files):
+    """Returns the cover art bytes of a folder, from a cover file or embedded art."""
+    art_bytes = read_folder_art(root)
+    if not art_bytes:
+        # Try multiple files in the folder for embedded art
+        for f in album_files[:5]: # Check up to 5 files
+            art_bytes = read_embedded_art(os.path.join(root, f))
+            if art_bytes:
+                break
+    return art_bytes
+
+
+def read_folder(root, tracks):
+    """
+    Reads the album key, cover art and track records of one folder. Runs in
+    the scan pool, possibly in another process, so it only deals in plain
+    Python values. tracks are (name, size, mtime) tuples from the walk.
+    Returns ((artist, album_title), art_bytes, records), with None for
+    anything missing.
+    """
+    records = []
+    key = None
+    album_files = []
+    for name, size, mtime in tracks:
+        path = os.path.join(root, name)
+        tags = read_track_tags(path)
+        records.append(TrackRecord(pathlib.Path(path).as_uri(), root,
+                                   *(tags or (None, None, None, 0, 0, 0)), mtime, size))
+        if not name.lower().endswith(SCAN_EXTENSIONS):
+            continue
+        # The first album file decides which album the folder holds
+        if not album_files and tags:
+            key = (tags[1] or 'Unknown Artist', tags[2] or 'Unknown Album')
+        album_files.append(name)
+
+    if not key:
+        return None, None, records
+    return key, read_album_art(root, album_files), records
+
 
 class LibraryManager(GObject.Object):
     """
-    Manages the persistent library database (at ~/.cache/mamo/library.json).
-    Scans the library path in a background thread.
+    Manages the persistent library database (at ~/.cache/mamo/library.db).
+    Scans the library path in a background thread and, when watching, keeps
+    it up to date from file system events.
+
+    'library-updated' carries (updated_albums, removed_albums) for targeted
+    updates, or (None, None) when the whole album list was replaced.
     """
     __gsignals__ = {
-        'library-updated': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        'library-updated': (GObject.SignalFlags.RUN_FIRST, None, (object, object)),
         'scan-started': (GObject.SignalFlags.RUN_FIRST, None, ()),
         'scan-finished': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        'tracks-indexed': (GObject.SignalFlags.RUN_FIRST, None, ()),
     }
 
-    def __init__(self, library_path, cache_file):
+    def __init__(self, library_path, db_file, art_store, thumbnails, scan_workers=None, scan_executor='thread', watch=False):
         super().__init__()
         self.library_path = library_path
-        self.cache_file = cache_file
+        self.db_file = db_file
+        # Folder parsing pool: 'thread' suits slow/network storage, 'process'
+        # sidesteps the GIL for tag parsing on fast local disks.
+        self.scan_workers = max(1, scan_workers or os.cpu_count() or 4)
+        self.scan_executor = scan_executor
+        self.art_store = art_store
+        self.thumbnails = thumbnails
+        self.db = LibraryDatabase(db_file, art_store)
+        art_store.add_references(self.db.art_hashes)
         self.albums = [] # List of Album objects
+        # Search indexes: albums by folder, tracks by URI
+        self.album_index = SearchIndex()
+        self.track_index = SearchIndex()
+        self._track_records = {} # uri -> TrackRecord, for the track index
+        self._track_index_serial = 0
+        self.watch = watch
+        self._watcher = None
         self._is_scanning = False
+        self._scan_thread = None
         self._is_loading_cache = False
         threading.Thread(target=self._load_cache_thread, daemon=True).start()
 
     def _load_cache_thread(self):
-        """Background thread to load the library cache."""
-        if not os.path.exists(self.cache_file):
-            print("LibraryManager: No cache found, starting initial scan.")
-            GLib.idle_add(self.start_scan)
-            return
-        
+        """Background thread to load the albums from the library database."""
         self._is_loading_cache = True
-        temp_albums = []
         try:
-            print(f"LibraryManager: Loading cache from {self.cache_file}")
-            with open(self.cache_file, 'r') as f:
-                data = json.load(f)
-                for item in data:
-                    art_data = None
-                    if 'art_base64' in item and item['art_base64']:
-                        try:
-                            raw = base64.b64decode(item['art_base64'])
-                            art_data = GLib.Bytes.new(raw)
-                        except:
-                            pass
-                    
-                    album = Album(
-                        title=item.get('title', 'Unknown Album'),
-                        artist=item.get('artist', 'Unknown Artist'),
-                        folder=item.get('folder', ''),
-                        art_data=art_data
-                    )
-                    temp_albums.append(album)
+            legacy_cache = os.path.join(os.path.dirname(self.db_file), "library.json")
+            if os.path.exists(legacy_cache) and self.db.is_empty():
+                self.db.migrate_from_json(legacy_cache)
+
+            if self.db.is_empty():
+                print("LibraryManager: Library database is empty, starting initial scan.")
+                self._is_loading_cache = False
+                GLib.idle_add(self.start_scan)
+                return
+
+            print(f"LibraryManager: Loading albums from {self.db_file}")
+            temp_albums = []
+            for title, artist, folder, art_hash in self.db.load_albums():
+                temp_albums.append(Album(title=title, artist=artist, folder=folder, art_hash=art_hash))
             
             def finalize_load():
-                self.albums = temp_albums
+                self._set_albums(temp_albums)
                 self._is_loading_cache = False
-                self.emit('library-updated')
+                self.emit('library-updated', None, None)
+                self._ensure_watching()
+                self._index_tracks()
                 return False
 
             GLib.idle_add(finalize_load)
         except Exception as e:
-            print(f"LibraryManager: Error loading cache: {e}")
+            print(f"LibraryManager: Error loading library database: {e}")
             self._is_loading_cache = False
 
 
-    def start_scan(self):
+    def start_scan(self, incremental=True):
+        """
+        Starts a background scan of the library path. Incremental scans only
+        re-read folders whose fingerprint changed since the last scan.
+        """
         if self._is_scanning:
             return
         if not self.library_path or not os.path.exists(self.library_path):
@@ -80,200 +244,447 @@ class LibraryManager(GObject.Object):
 
         self._is_scanning = True
         self.emit('scan-started')
-        thread = threading.Thread(target=self._scan_worker, daemon=True)
-        thread.start()
+        self._scan_thread = threading.Thread(target=self._scan_worker, args=(incremental,), daemon=True)
+        self._scan_thread.start()
+
+    def wait_for_scan(self):
+        """
+        Blocks until the last scan is done, including the thumbnails it
+        makes after 'scan-finished'. For tools like the benchmarks.
+        """
+        if self._scan_thread is not None:
+            self._scan_thread.join()
+
+    def set_library_path(self, path):
+        """Switches to another library folder (the caller starts the scan)."""
+        self.library_path = path
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        self._ensure_watching()
+
+    def _ensure_watching(self):
+        if not self.watch or self._watcher or not self.library_path or not os.path.isdir(self.library_path):
+            return
+        self._watcher = LibraryWatcher(self.library_path, self._on_watched_changes, self.start_scan)
+        self._watcher.start()
+
+    def _walk_library(self, top=None, recursive=True):
+        """
+        Walks the library path (or a folder below it) in a deterministic order,
+        yielding (folder, tracks, fingerprint) for every folder with audio files,
+        where tracks are (name, size, mtime) tuples sorted by name.
+        """
+        pending = [top or self.library_path]
+        while pending:
+            root = pending.pop()
+            subdirs = []
+            tracks = []
+            try:
+                dir_mtime = os.stat(root).st_mtime_ns
+                with os.scandir(root) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(TRACK_EXTENSIONS):
+                            st = entry.stat()
+                            tracks.append((entry.name, st.st_size, st.st_mtime_ns))
+            except OSError as e:
+                print(f"LibraryManager: Error reading {root}: {e}")
+                continue
+
+            # Visit subfolders in name order
+            if recursive:
+                pending.extend(sorted(subdirs, reverse=True))
+            if not tracks:
+                continue
+
+            tracks.sort()
+            digest = hashlib.sha1()
+            for name, size, mtime in tracks:
+                digest.update(f"{name}\0{size}\0{mtime}\n".encode('utf-8', 'surrogateescape'))
+            fingerprint = f"{dir_mtime}:{len(tracks)}:{digest.hexdigest()}"
+            yield root, tracks, fingerprint
+
+    def _make_scan_executor(self):
+        if self.scan_executor == 'process':
+            # Spawn rather than fork, the scan runs on a thread of a GTK process
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.scan_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.scan_workers, thread_name_prefix='mamo-scan')
+
+    def _scan_worker(self, incremental=True):
+        print(f"LibraryManager: Starting {'incremental' if incremental else 'full'} scan of {self.library_path} "
+              f"({self.scan_workers} {self.scan_executor} workers)")
+        previous_folders = self.db.load_folders() if incremental else {}
+        previous_albums = {album.folder: album for album in self.albums} if incremental else {}
+        # Only stream partial results when there is nothing to show yet
+        send_partial = not previous_albums
 
-    def _scan_worker(self):
-        print(f"LibraryManager: Starting scan of {self.library_path}")
         found_albums = {} # (artist, title) -> Album
+        folders = {} # folder -> {'fingerprint', 'artist', 'title'}
+        n_reread = 0
+        # Changed folders and albums, committed to the database in batches
+        batch_folders = {}
+        batch_albums = []
+        batch_tracks = {}
+
+        def flush_batch():
+            self.db.commit_scan_batch(batch_folders, batch_albums, batch_tracks)
+            batch_folders.clear()
+            batch_albums.clear()
+            batch_tracks.clear()
 
-        for root, dirs, files in os.walk(self.library_path):
-            audio_files = [f for f in files if not f.startswith('.') and f.lower().endswith(('.mp3', '.flac', '.m4a', '.ogg'))]
-            if audio_files:
-                first_file = os.path.join(root, audio_files[0])
+        def merge(root, tracks, fingerprint, unchanged, result):
+            """Merges one folder into found_albums, in discovery order."""
+            records = []
+            if unchanged:
+                key, art_bytes = result, None
+            else:
                 try:
-                    audio = mutagen.File(first_file, easy=True)
-                    if not audio: continue
-                    album_title = audio.get('album', ['Unknown Album'])[0]
-                    artist = audio.get('artist', ['Unknown Artist'])[0]
-                    
-                    key = (artist, album_title)
-                    if key not in found_albums:
-                        art_data = self._find_art_for_folder(root)
-                        
-                        if not art_data:
-                            # Try multiple files in the folder for embedded art
-                            for f in audio_files[:5]: # Check up to 5 files
-                                art_data = self._find_embedded_art(os.path.join(root, f))
-                                if art_data:
-                                    break
-                                    
-                        album = Album(title=album_title, artist=artist, folder=root, art_data=art_data)
-                        found_albums[key] = album
-                        
-                        # Periodically update UI (every 10 albums)
-                        if len(found_albums) % 10 == 0:
-                            GLib.idle_add(self._on_partial_update, list(found_albums.values()))
+                    key, art_bytes, records = result.result()
                 except Exception as e:
-                    print(f"LibraryManager: Error scanning {first_file}: {e}")
+                    print(f"LibraryManager: Error scanning {root}: {e}")
+                    key, art_bytes = None, None
+
+            folder_entry = {'fingerprint': fingerprint}
+            if key:
+                folder_entry['artist'], folder_entry['title'] = key
+            folders[root] = folder_entry
+            if not unchanged:
+                batch_folders[root] = folder_entry
+                batch_tracks[root] = records
+
+            if not key or key in found_albums:
+                return
+
+            cached = previous_albums.get(root)
+            if unchanged and cached and (cached.artist, cached.title) == key:
+                found_albums[key] = cached
+                return
+
+            artist, album_title = key
+            if unchanged:
+                # The folder took over an album from a removed folder
+                art_bytes = read_album_art(root, _album_files(tracks))
+            art_hash = self.art_store.put(art_bytes)
+            found_albums[key] = Album(title=album_title, artist=artist, folder=root, art_hash=art_hash)
+            batch_albums.append((album_title, artist, root, art_hash))
+
+            # Periodically update UI (every 10 albums)
+            if send_partial and len(found_albums) % 10 == 0:
+                GLib.idle_add(self._on_partial_update, list(found_albums.values()))
+
+        # Discovery feeds changed folders to the pool, bounded so a huge
+        # library does not queue every folder at once. Results are merged
+        # strictly in discovery order to keep album selection deterministic.
+        pending = collections.deque()
+        slots = threading.BoundedSemaphore(self.scan_workers * 4)
+        with self._make_scan_executor() as executor:
+            for root, tracks, fingerprint in self._walk_library():
+                entry = previous_folders.get(root)
+                unchanged = entry is not None and entry.get('fingerprint') == fingerprint
+
+                if unchanged:
+                    result = (entry['artist'], entry['title']) if 'artist' in entry else None
+                else:
+                    n_reread += 1
+                    slots.acquire()
+                    result = executor.submit(read_folder, root, tracks)
+                    result.add_done_callback(lambda f: slots.release())
+                pending.append((root, tracks, fingerprint, unchanged, result))
+
+                while pending and (pending[0][3] or pending[0][4].done()):
+                    merge(*pending.popleft())
+                if len(batch_folders) >= SCAN_BATCH_SIZE:
+                    flush_batch()
+
+            while pending:
+                merge(*pending.popleft())
 
         final_albums = list(found_albums.values())
-        self._save_cache_data(final_albums)
+        try:
+            flush_batch()
+            _n_albums, n_removed = self.db.prune([a.folder for a in final_albums], folders)
+        except Exception as e:
+            print(f"LibraryManager: Error saving library database: {e}")
+            n_removed = 0
+        try:
+            # Covers of removed or re-tagged albums
+            self.art_store.sweep()
+        except Exception as e:
+            print(f"LibraryManager: Error sweeping unused cover art: {e}")
+        print(f"LibraryManager: Scan done, {len(folders)} folders, {n_reread} re-read, {n_removed} removed")
+
         GLib.idle_add(self._on_scan_complete, final_albums)
+        self._generate_thumbnails(album.art_hash for album in final_albums)
+
+    def _generate_thumbnails(self, art_hashes):
+        """Pre-scales cover art for the browser and now playing view (skips existing ones)."""
+        art_hashes = sorted({h for h in art_hashes if h})
+        # Pixbuf decoding releases the GIL, threads are enough here
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.scan_workers) as executor:
+            for _ in executor.map(self.thumbnails.generate, art_hashes):
+                pass
 
     def _on_partial_update(self, albums):
-        self.albums = albums
-        self.emit('library-updated')
+        self._set_albums(albums)
+        self.emit('library-updated', None, None)
         return False
 
     def _on_scan_complete(self, albums):
-        self.albums = albums
+        self._set_albums(albums)
         self._is_scanning = False
-        self.emit('library-updated')
+        self.emit('library-updated', None, None)
         self.emit('scan-finished')
+        self._ensure_watching()
+        self._index_tracks()
 
-    def _save_cache_data(self, albums):
-        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+    def _on_watched_changes(self, dirty):
+        """Watcher callback, returns False to have the changes retried later."""
+        if self._is_scanning:
+            return False
+        self._is_scanning = True
+        threading.Thread(target=self._refresh_worker, args=(dirty,), daemon=True).start()
+        return True
+
+    def _refresh_worker(self, dirty):
+        """
+        Re-reads only the given folders (folder -> recursive flag) and works
+        out which albums were added, changed or removed.
+        """
         try:
-            data = []
-            for album in albums:
-                art_base64 = None
-                if album.art_data:
-                    art_base64 = base64.b64encode(album.art_data.get_data()).decode('utf-8')
-                
-                data.append({
-                    'title': album.title,
-                    'artist': album.artist,
-                    'folder': album.folder,
-                    'art_base64': art_base64
-                })
-            with open(self.cache_file, 'w') as f:
-                json.dump(data, f)
-        except Exception as e:
-            print(f"LibraryManager: Error saving cache: {e}")
+            known = self.db.load_folders()
+            owners = self.db.load_album_owners() # (artist, title) -> folder
+            owner_keys = {folder: key for key, folder in owners.items()}
 
-    def _save_cache(self):
-        # Wrapper for saving current state
-        self._save_cache_data(self.albums)
+            seen = set()
+            removed_folders = set()
+            to_read = []
+            for path, recursive in sorted(dirty.items()):
+                if os.path.isdir(path):
+                    for root, tracks, fingerprint in self._walk_library(path, recursive):
+                        seen.add(root)
+                        entry = known.get(root)
+                        if not entry or entry.get('fingerprint') != fingerprint:
+                            to_read.append((root, tracks, fingerprint))
+                prefix = path + os.sep
+                removed_folders.update(f for f in known
+                                       if (f == path or (recursive and f.startswith(prefix))) and f not in seen)
 
-    def _find_art_for_folder(self, folder):
-        cover_filenames = ["cover.jpg", "Cover.jpg", "folder.jpg", "Folder.jpg", "cover.png", "Cover.png", "album.jpg", "Album.jpg", "album.png", "Album.png"]
-        for fn in cover_filenames:
-            path = os.path.join(folder, fn)
-            if os.path.exists(path):
-                try:
-                    with open(path, "rb") as f:
-                        return GLib.Bytes.new(f.read())
-                except:
-                    pass
-        return None
+            with self._make_scan_executor() as executor:
+                results = list(executor.map(read_folder, [r[0] for r in to_read], [r[1] for r in to_read]))
 
-    @staticmethod
-    def detect_embedded_art(filepath):
-        """Extracts embedded album art from an audio file."""
-        try:
-            audio_raw = mutagen.File(filepath)
-            if not audio_raw or not audio_raw.tags:
-                return None
-            
-            art_bytes = None
-            if isinstance(audio_raw.tags, mutagen.id3.ID3):
-                # Search for any APIC frame
-                for tag_name in audio_raw.tags.keys():
-                    if tag_name.startswith('APIC'):
-                        art_bytes = audio_raw.tags[tag_name].data
-                        break
-            elif isinstance(audio_raw, mutagen.mp4.MP4) and 'covr' in audio_raw.tags and audio_raw.tags['covr']:
-                art_bytes = bytes(audio_raw.tags['covr'][0])
-            elif hasattr(audio_raw, 'pictures') and audio_raw.pictures:
-                art_bytes = audio_raw.pictures[0].data
-            elif hasattr(audio_raw.tags, 'get'):
-                # Try common Ogg/Vorbis approach
-                pics = audio_raw.tags.get('metadata_block_picture', [])
-                if pics:
-                    from mutagen.flac import Picture
-                    try:
-                        p = Picture(base64.b64decode(pics[0]))
-                        art_bytes = p.data
-                    except:
-                        pass
-            
-            if art_bytes:
-                return GLib.Bytes.new(art_bytes)
+            changed_folders = {}
+            changed_tracks = {}
+            read = {}
+            for (root, _tracks, fingerprint), (key, art_bytes, records) in zip(to_read, results):
+                entry = {'fingerprint': fingerprint}
+                if key:
+                    entry['artist'], entry['title'] = key
+                changed_folders[root] = entry
+                changed_tracks[root] = records
+                read[root] = (key, art_bytes)
+
+            # Albums whose folder went away or now holds another album
+            dropped = set()
+            for folder in removed_folders | set(read):
+                key = owner_keys.get(folder)
+                if key and (folder in removed_folders or read[folder][0] != key):
+                    dropped.add(folder)
+                    del owners[key]
+
+            updated = {} # folder -> (title, artist, art hash)
+            for root in sorted(read):
+                key, art_bytes = read[root]
+                if key and owners.get(key, root) == root:
+                    owners[key] = root
+                    updated[root] = (key[1], key[0], self.art_store.put(art_bytes))
+
+            # Another folder of a dropped album (e.g. a second disc) takes over
+            folders_now = {f: e for f, e in known.items() if f not in removed_folders}
+            folders_now.update(changed_folders)
+            for folder in sorted(dropped):
+                key = owner_keys[folder]
+                if key in owners:
+                    continue
+                candidates = sorted(f for f, e in folders_now.items()
+                                    if (e.get('artist'), e.get('title')) == key)
+                if candidates:
+                    for root, tracks, _fingerprint in self._walk_library(candidates[0], recursive=False):
+                        art_bytes = read_album_art(root, _album_files(tracks))
+                        owners[key] = root
+                        updated[root] = (key[1], key[0], self.art_store.put(art_bytes))
+
+            removed_albums = dropped - set(updated)
+            self.db.commit_scan_batch(changed_folders, [(t, a, f, art) for f, (t, a, art) in updated.items()],
+                                      changed_tracks)
+            self.db.remove(removed_folders, removed_albums)
         except Exception as e:
-            print(f"LibraryManager: Error extracting embedded art from {filepath}: {e}")
-        return None
+            print(f"LibraryManager: Error refreshing library: {e}")
+            GLib.idle_add(self._on_refresh_complete, [], set())
+            return
 
-    def _find_embedded_art(self, filepath):
-        return LibraryManager.detect_embedded_art(filepath)
-    def get_album_songs(self, album):
-        """Returns a list of Song objects for the given album."""
+        print(f"LibraryManager: Refreshed {len(seen)} folders, {len(to_read)} re-read, "
+              f"{len(updated)} albums updated, {len(removed_albums)} removed")
+        albums = [Album(title=t, artist=a, folder=f, art_hash=art_hash)
+                  for f, (t, a, art_hash) in sorted(updated.items())]
+        GLib.idle_add(self._on_refresh_complete, albums, removed_albums)
+        self._generate_thumbnails(album.art_hash for album in albums)
+
+    def _on_refresh_complete(self, updated, removed_folders):
+        self._is_scanning = False
+        replaced = removed_folders | {album.folder for album in updated}
+        removed = [album for album in self.albums if album.folder in replaced]
+        if updated or removed:
+            self.albums = [album for album in self.albums if album.folder not in replaced] + updated
+            for album in removed:
+                self.album_index.remove(album.folder)
+            for album in updated:
+                self.album_index.add(album.folder, album.title, album.artist)
+            self.emit('library-updated', updated, removed)
+        self._index_tracks()
+        return False
+
+    def _set_albums(self, albums):
+        self.albums = albums
+        index = SearchIndex()
+        for album in albums:
+            index.add(album.folder, album.title, album.artist)
+        self.album_index = index
+
+    def _index_tracks(self):
+        """Rebuilds the track search index in the background."""
+        self._track_index_serial += 1
+        serial = self._track_index_serial
+
+        def build():
+            try:
+                records = [r for folder_records in self.db.load_all_tracks().values() for r in folder_records]
+            except Exception as e:
+                print(f"LibraryManager: Error loading track index: {e}")
+                return
+            # Keys are added in display order, so results need no sorting
+            records.sort(key=lambda r: (r.artist or '', r.album or '', r.disc_num, r.track_num, r.title or ''))
+            index = SearchIndex()
+            for record in records:
+                index.add(record.uri, record.title or self._title_from_uri(record.uri),
+                          record.artist, record.album)
+            GLib.idle_add(finish, index, {r.uri: r for r in records})
+
+        def finish(index, records):
+            # A newer rebuild may have been started in the meantime
+            if serial == self._track_index_serial:
+                self.track_index = index
+                self._track_records = records
+                self.emit('tracks-indexed')
+            return False
+
+        threading.Thread(target=build, daemon=True).start()
+
+    def search_albums(self, query):
+        """Returns the folders of the albums matching query."""
+        return self.album_index.search(query)
+
+    def search_songs(self, query, limit=None):
+        """Returns Songs for the tracks matching query, by artist, album and track number."""
+        albums = {album.folder: album for album in self.albums}
         songs = []
-        if not album.folder or not os.path.exists(album.folder):
-            return songs
-            
+        for uri in self.track_index.search(query, limit):
+            record = self._track_records[uri]
+            songs.append(self._song_from_record(record, albums.get(record.folder)))
+        return songs
+
+    def get_album_songs(self, album):
+        """
+        Returns a list of Song objects for the given album. Tracks come from
+        the index; only files whose mtime or size changed are re-tagged.
+        """
+        return [self._song_from_record(record, album)
+                for record in self._sorted_tracks(self._album_tracks(album))]
+
+    def _album_tracks(self, album):
+        """The album's TrackRecords, re-tagging files changed since they were indexed."""
+        if not album.folder:
+            return []
         try:
-            for f in os.listdir(album.folder):
-                if f.startswith('.'): continue
-                if not f.lower().endswith(('.mp3', '.flac', '.m4a', '.ogg', '.opus', '.wav')): continue
-                
-                full_path = os.path.join(album.folder, f)
-                uri = pathlib.Path(full_path).as_uri()
-                
-                # Extract metadata
-                title = None
-                artist = None
-                album_title = None
-                duration_ns = 0
-                track_num = 0
-                
-                try:
-                    audio = mutagen.File(full_path, easy=True)
-                    if audio:
-                        title = audio.get('title', [None])[0]
-                        artist = audio.get('artist', [None])[0]
-                        album_title = audio.get('album', [None])[0]
-                        
-                        track_num_str = audio.get('tracknumber', ['0'])[0]
-                        try:
-                            # Handle "1/12" format
-                            if '/' in track_num_str:
-                                track_num = int(track_num_str.split('/')[0])
-                            else:
-                                track_num = int(track_num_str)
-                        except:
-                            track_num = 0
-
-                        if audio.info and hasattr(audio.info, 'length'):
-                             duration_ns = int(audio.info.length * 1000000000)
-                except Exception as e:
-                    print(f"LibraryManager: Error reading tags from {full_path}: {e}")
-
-                # Fallback to filename if title missing
-                if not title:
-                    title = os.path.splitext(f)[0]
-                
-                # If artist/album missing, use album object's data as fallback
-                if not artist: artist = album.artist
-                if not album_title: album_title = album.title
-                
-                song = Song(uri=uri, title=title, artist=artist, album=album_title, duration=duration_ns)
-                song.album_art_data = album.art_data # Propagate album art
-                song._track_num = track_num # Store for sorting
-                
-                songs.append(song)
-            
-            # Sort by track number, then title
-            songs.sort(key=lambda s: (getattr(s, '_track_num', 0), s.title))
-            
-        except Exception as e:
+            indexed = {record.uri: record for record in self.db.load_tracks(album.folder)}
+            records = []
+            stale = []
+            with os.scandir(album.folder) as it:
+                for entry in it:
+                    if entry.name.startswith('.') or not entry.name.lower().endswith(TRACK_EXTENSIONS):
+                        continue
+                    st = entry.stat()
+                    record = indexed.pop(pathlib.Path(entry.path).as_uri(), None)
+                    if record is None or record.mtime != st.st_mtime_ns or record.size != st.st_size:
+                        record = read_track(album.folder, entry.name, st.st_size, st.st_mtime_ns)
+                        stale.append(record)
+                    records.append(record)
+        except OSError as e:
             print(f"Error listing songs for album {album.title}: {e}")
-            
-        return songs
+            return []
+
+        if stale or indexed:
+            try:
+                self.db.save_tracks(stale, indexed.keys())
+            except Exception as e:
+                print(f"LibraryManager: Error updating track index: {e}")
+        return records
+
+    @staticmethod
+    def _title_from_uri(uri):
+        return os.path.splitext(urllib.parse.unquote(uri.rsplit('/', 1)[-1]))[0]
+
+    def _song_from_record(self, record, album):
+        # Fallback to filename if title missing
+        title = record.title or self._title_from_uri(record.uri)
+        # If artist/album missing, use album object's data as fallback
+        song = Song(uri=record.uri, title=title,
+                    artist=record.artist or (album.artist if album else None),
+                    album=record.album or (album.title if album else None),
+                    duration=record.duration)
+        if album:
+            song.album_art_hash = album.art_hash # Propagate album art
+        return song
+
+    def _sorted_tracks(self, records):
+        # Sort by disc and track number, then title
+        return sorted(records, key=lambda record: (record.disc_num, record.track_num,
+                                                   record.title or self._title_from_uri(record.uri)))
+
+    def _playlist_record(self, record, album):
+        """Like _song_from_record(), as the SongRecord a playlist stores."""
+        return SongRecord(record.uri, record.title or self._title_from_uri(record.uri),
+                          record.artist or (album.artist if album else None),
+                          record.album or (album.title if album else None),
+                          record.duration, album.art_hash if album else None)
 
     def get_all_songs(self):
-        """Returns a list of all songs in the library (expensive)."""
+        """
+        Returns a list of all songs in the library, straight from the track
+        index (the scan and the watcher keep it current).
+        """
+        tracks = self.db.load_all_tracks()
         all_songs = []
         for album in self.albums:
-            all_songs.extend(self.get_album_songs(album))
+            records = tracks.get(album.folder) or self._album_tracks(album)
+            all_songs.extend(self._song_from_record(record, album)
+                             for record in self._sorted_tracks(records))
         return all_songs
+
+    def iter_album_records(self, albums):
+        """
+        Yields (album, [SongRecord]) for albums in the given order, reading
+        each album's tracks from the index as it is asked for. Any thread.
+        """
+        for album in albums:
+            records = self.db.load_tracks(album.folder) if album.folder else []
+            if not records:
+                # Not indexed yet, e.g. a library scanned by an older version
+                records = self._album_tracks(album)
+            yield album, [self._playlist_record(record, album) for record in self._sorted_tracks(records)]
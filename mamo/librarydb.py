@@ -0,0 +1,231 @@
+import os
+import json
+import base64
+import sqlite3
+import threading
+import collections
+
+# 1: art blobs in an `art` table, 2: art moved to the ArtStore
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    folder TEXT NOT NULL UNIQUE,
+    art_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS albums_artist ON albums(artist);
+CREATE INDEX IF NOT EXISTS albums_title ON albums(title);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    artist TEXT,
+    title TEXT
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    uri TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    track_num INTEGER NOT NULL DEFAULT 0,
+    disc_num INTEGER NOT NULL DEFAULT 0,
+    duration INTEGER NOT NULL DEFAULT 0,
+    mtime INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tracks_folder ON tracks(folder);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks(artist);
+CREATE INDEX IF NOT EXISTS tracks_title ON tracks(title);
+"""
+
+# One row of the tracks table. Plain tuples so scan results can cross
+# process boundaries; mtime (ns) and size tell whether the tags are current.
+TrackRecord = collections.namedtuple(
+    'TrackRecord', 'uri folder title artist album track_num disc_num duration mtime size')
+
+TRACK_COLUMNS = ', '.join(TrackRecord._fields)
+TRACK_PLACEHOLDERS = ', '.join('?' * len(TrackRecord._fields))
+
+
+class LibraryDatabase:
+    """
+    SQLite store for the library (albums, scanned folders and tracks). Cover
+    art lives in the ArtStore and is referenced by hash. Uses WAL mode and one
+    connection per thread, so the browser can read while a scan commits its
+    results.
+    """
+    def __init__(self, path, art_store):
+        self.path = path
+        self.art_store = art_store
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connection()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        with conn:
+            conn.executescript(SCHEMA)
+            if version == 1:
+                self._move_art_to_store(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _move_art_to_store(self, conn):
+        n = 0
+        for art_hash, data in conn.execute("SELECT hash, data FROM art"):
+            # Both use the SHA-1 of the image, so album rows stay valid
+            self.art_store.put(bytes(data))
+            n += 1
+        conn.execute("DROP TABLE art")
+        print(f"LibraryDatabase: Moved {n} images to the art store")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def is_empty(self):
+        row = self._connection().execute("SELECT EXISTS (SELECT 1 FROM folders)").fetchone()
+        return not row[0]
+
+    def art_hashes(self):
+        """Returns the art hashes albums refer to."""
+        rows = self._connection().execute("SELECT DISTINCT art_hash FROM albums WHERE art_hash IS NOT NULL")
+        return {art_hash for (art_hash,) in rows}
+
+    def load_albums(self):
+        """Returns (title, artist, folder, art hash) for every album."""
+        rows = self._connection().execute(
+            "SELECT title, artist, folder, art_hash FROM albums ORDER BY artist, title")
+        return rows.fetchall()
+
+    def load_album_owners(self):
+        """Returns (artist, title) -> folder of the folder each album was read from."""
+        return {(artist, title): folder for artist, title, folder in self._connection().execute(
+            "SELECT artist, title, folder FROM albums")}
+
+    def load_folders(self):
+        """Returns folder -> {'fingerprint', 'artist', 'title'} from the last scan."""
+        folders = {}
+        for path, fingerprint, artist, title in self._connection().execute(
+                "SELECT path, fingerprint, artist, title FROM folders"):
+            entry = {'fingerprint': fingerprint}
+            if artist is not None:
+                entry['artist'] = artist
+                entry['title'] = title
+            folders[path] = entry
+        return folders
+
+    def load_tracks(self, folder):
+        """Returns the indexed TrackRecords of one folder."""
+        rows = self._connection().execute(
+            f"SELECT {TRACK_COLUMNS} FROM tracks WHERE folder = ?", (folder,))
+        return [TrackRecord(*row) for row in rows]
+
+    def load_all_tracks(self):
+        """Returns folder -> [TrackRecord] for the whole index."""
+        tracks = collections.defaultdict(list)
+        for row in self._connection().execute(f"SELECT {TRACK_COLUMNS} FROM tracks"):
+            record = TrackRecord(*row)
+            tracks[record.folder].append(record)
+        return tracks
+
+    def clear_tracks(self):
+        """Empties the track index; albums are read from their folders again as they are opened."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM tracks")
+
+    def save_tracks(self, records, removed_uris=()):
+        """Updates individual tracks, e.g. files re-tagged since the last scan."""
+        conn = self._connection()
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO tracks ({TRACK_COLUMNS}) "
+                             f"VALUES ({TRACK_PLACEHOLDERS})", records)
+            conn.executemany("DELETE FROM tracks WHERE uri = ?", [(uri,) for uri in removed_uris])
+
+    def commit_scan_batch(self, folders, albums, tracks=None):
+        """
+        Stores one batch of scan results in a single transaction.
+        folders: folder -> entry dict, albums: (title, artist, folder, art hash),
+        tracks: folder -> [TrackRecord], replacing everything indexed for that folder.
+        """
+        conn = self._connection()
+        with conn:
+            if tracks:
+                conn.executemany("DELETE FROM tracks WHERE folder = ?", [(f,) for f in tracks])
+                conn.executemany(f"INSERT OR REPLACE INTO tracks ({TRACK_COLUMNS}) "
+                                 f"VALUES ({TRACK_PLACEHOLDERS})",
+                                 [r for records in tracks.values() for r in records])
+            conn.executemany(
+                "INSERT OR REPLACE INTO folders (path, fingerprint, artist, title) VALUES (?, ?, ?, ?)",
+                [(path, e['fingerprint'], e.get('artist'), e.get('title')) for path, e in folders.items()])
+            conn.executemany(
+                "INSERT INTO albums (title, artist, folder, art_hash) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(folder) DO UPDATE SET title = excluded.title, "
+                "artist = excluded.artist, art_hash = excluded.art_hash",
+                albums)
+
+    def prune(self, album_folders, folder_paths):
+        """Drops albums and folders not seen by the last scan."""
+        conn = self._connection()
+        album_folders = set(album_folders)
+        folder_paths = set(folder_paths)
+        stale_albums = [f for (f,) in conn.execute("SELECT folder FROM albums") if f not in album_folders]
+        stale_folders = [p for (p,) in conn.execute("SELECT path FROM folders") if p not in folder_paths]
+        self.remove(stale_folders, stale_albums)
+        return len(stale_albums), len(stale_folders)
+
+    def remove(self, folder_paths, album_folders):
+        """Deletes the given folders (with their tracks) and albums."""
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM albums WHERE folder = ?", [(f,) for f in album_folders])
+            conn.executemany("DELETE FROM folders WHERE path = ?", [(p,) for p in folder_paths])
+            conn.executemany("DELETE FROM tracks WHERE folder = ?", [(p,) for p in folder_paths])
+
+    def migrate_from_json(self, json_path):
+        """
+        One-time import of the old library.json cache. The JSON file is
+        renamed afterwards so the import does not run again.
+        """
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"LibraryDatabase: Could not read {json_path}: {e}")
+            return False
+
+        # Version 1 caches are a bare list of albums without fingerprints
+        if isinstance(data, dict):
+            items = data.get('albums', [])
+            folders = data.get('folders', {})
+        else:
+            items = data
+            folders = {}
+
+        albums = []
+        for item in items:
+            art_hash = None
+            if item.get('art_base64'):
+                try:
+                    art_hash = self.art_store.put(base64.b64decode(item['art_base64']))
+                except Exception:
+                    pass
+            albums.append((item.get('title', 'Unknown Album'),
+                           item.get('artist', 'Unknown Artist'),
+                           item.get('folder', ''),
+                           art_hash))
+
+        # Without fingerprints every folder is re-read on the next scan,
+        # so record the album folders with an empty one.
+        for _title, _artist, folder, _art in albums:
+            folders.setdefault(folder, {'fingerprint': ''})
+
+        self.commit_scan_batch(folders, albums)
+        os.replace(json_path, json_path + ".migrated")
+        print(f"LibraryDatabase: Migrated {len(albums)} albums from {json_path}")
+        return True
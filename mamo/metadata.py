@@ -0,0 +1,393 @@
+import os
+import time
+import sqlite3
+import threading
+import collections
+import concurrent.futures
+from urllib.parse import urlparse, unquote
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GObject, GLib, Gst
+
+from .library import read_track_tags, read_embedded_art
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    duration INTEGER NOT NULL DEFAULT 0,
+    art_hash TEXT
+);
+"""
+
+# What the playlist needs to know about a file. Tags may be None.
+FileMetadata = collections.namedtuple('FileMetadata', 'title artist album duration art_hash')
+
+# Files read (in parallel) before their results go to the main thread
+RESOLVE_CHUNK_SIZE = 64
+# 'progress' is emitted at most this often (seconds)
+PROGRESS_INTERVAL = 0.25
+
+COVER_NAMES = ["cover.jpg", "Cover.jpg", "folder.jpg", "Folder.jpg",
+               "artwork.jpg", "Artwork.jpg", "front.jpg", "Front.jpg"]
+COVER_NAMES += [name.replace(".jpg", ".png") for name in COVER_NAMES]
+
+
+def find_cover(folder):
+    """Returns the path of a cover image in folder, or None."""
+    for name in COVER_NAMES:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            return path
+    # Any image that looks like a cover
+    try:
+        for name in os.listdir(folder):
+            lower = name.lower()
+            if ("cover" in lower or "front" in lower or "folder" in lower) and lower.endswith((".jpg", ".jpeg", ".png")):
+                return os.path.join(folder, name)
+    except OSError:
+        pass
+    return None
+
+
+def uri_to_path(uri):
+    parsed = urlparse(uri)
+    return unquote(parsed.path) if parsed.scheme == 'file' else None
+
+
+class MetadataCache:
+    """
+    Metadata of files added to the playlist, keyed by path and valid while
+    the file's mtime and size are unchanged (~/.cache/mamo/metadata.db).
+    One connection per thread, like LibraryDatabase.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, path, mtime, size):
+        row = self._connection().execute(
+            "SELECT title, artist, album, duration, art_hash FROM files WHERE path = ? AND mtime = ? AND size = ?",
+            (path, mtime, size)).fetchone()
+        return FileMetadata(*row) if row else None
+
+    def art_hashes(self):
+        """Returns the art hashes of cached files."""
+        rows = self._connection().execute("SELECT DISTINCT art_hash FROM files WHERE art_hash IS NOT NULL")
+        return {art_hash for (art_hash,) in rows}
+
+    def put(self, rows):
+        """Stores (path, mtime, size, FileMetadata) rows."""
+        if not rows:
+            return
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(path, mtime, size, *metadata) for path, mtime, size, metadata in rows])
+
+    # CacheManager interface. Rows are kept current rather than evicted,
+    # but the database counts towards the quota.
+
+    def entries(self):
+        return []
+
+    def evict(self, keys):
+        pass
+
+    def usage(self):
+        total = 0
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                total += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return total
+
+
+class MetadataService(GObject.Object):
+    """
+    Reads the metadata of files added to the playlist. Files are first
+    looked up in the MetadataCache, then read with mutagen in a pool of
+    threads; only files mutagen can't handle go to the DiscoveryPool,
+    which runs a GStreamer pipeline for each.
+
+    Emits 'resolved' with a list of (uri, FileMetadata) in the order the
+    URIs were added (discoverer results come later), 'progress' (done,
+    total, eta seconds or -1) and 'finished'.
+    """
+    __gsignals__ = {
+        'resolved': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+        'progress': (GObject.SignalFlags.RUN_FIRST, None, (int, int, float)),
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    def __init__(self, db_path, art_store, discovery, workers=None):
+        super().__init__()
+        self.cache = MetadataCache(db_path)
+        self.art_store = art_store
+        art_store.add_references(self.cache.art_hashes)
+        self.discovery = discovery
+        self.discovery.connect("discovered", self._on_discovered)
+        self.discovery.connect("finished", self._on_discovery_finished)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1))
+        self._folder_art = {} # folder -> (its mtime, cover hash or None), under the lock
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._worker_running = False
+        self._generation = 0 # Bumped by cancel_all(), older chunks are dropped
+        self._in_worker = 0 # URIs taken from the queue whose results are on the way
+        self._fallbacks = collections.Counter() # uri -> times waiting on the DiscoveryPool
+        self._done = 0
+        self._total = 0
+        self._started = 0.0
+        self._last_progress = 0.0
+
+    def add(self, uris):
+        """Resolves URIs in the background."""
+        uris = [uri for uri in uris if uri]
+        if not uris:
+            return
+        if not self._total:
+            self._started = time.monotonic()
+        self._total += len(uris)
+        with self._lock:
+            self._queue.extend(uris)
+            if self._worker_running:
+                return
+            self._worker_running = True
+        threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    def cancel_all(self):
+        """Drops everything still to be resolved."""
+        with self._lock:
+            self._total -= len(self._queue) + self._in_worker
+            self._queue.clear()
+            self._in_worker = 0
+            self._generation += 1
+        self._total -= sum(self._fallbacks.values())
+        self._fallbacks.clear()
+        self.discovery.cancel_all()
+        self._check_finished()
+
+    def read(self, path):
+        """Returns the FileMetadata of a local file without the discoverer, or None. Any thread."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        metadata = self.cache.get(path, st.st_mtime_ns, st.st_size)
+        if metadata is None:
+            metadata = self._read_file(path)
+            if metadata is not None:
+                self.cache.put([(path, st.st_mtime_ns, st.st_size, metadata)])
+        return metadata
+
+    def _worker_loop(self):
+        stopped = False
+        try:
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        self._worker_running = False
+                        stopped = True
+                        return
+                    generation = self._generation
+                    chunk = [self._queue.popleft() for _ in range(min(RESOLVE_CHUNK_SIZE, len(self._queue)))]
+                    self._in_worker += len(chunk)
+                try:
+                    results = list(self._executor.map(self._resolve, chunk))
+                    self.cache.put([row for _uri, _metadata, row in results if row])
+                except Exception as e:
+                    print(f"MetadataService: Error reading {len(chunk)} files: {e}")
+                    GLib.idle_add(self._on_failed, generation, len(chunk))
+                    continue
+                GLib.idle_add(self._on_chunk_resolved, generation,
+                              [(uri, metadata) for uri, metadata, _row in results])
+        finally:
+            if not stopped:
+                # Died on something unexpected; add() starts a new worker
+                with self._lock:
+                    self._worker_running = False
+
+    def _resolve(self, uri):
+        """Returns (uri, FileMetadata or None, new cache row or None)."""
+        path = uri_to_path(uri)
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        if st is None:
+            return uri, None, None
+        metadata = self.cache.get(path, st.st_mtime_ns, st.st_size)
+        if metadata is not None:
+            return uri, metadata, None
+        metadata = self._read_file(path)
+        if metadata is None:
+            return uri, None, None
+        return uri, metadata, (path, st.st_mtime_ns, st.st_size, metadata)
+
+    def _read_file(self, path):
+        tags = read_track_tags(path)
+        if tags is None:
+            return None
+        title, artist, album, _track, _disc, duration = tags
+        if not title:
+            title = os.path.splitext(os.path.basename(path))[0]
+        return FileMetadata(title, artist, album, duration, self._read_art(path))
+
+    def _read_art(self, path):
+        """Hash of the folder's cover, or else of the art embedded in the file. Any thread."""
+        folder = os.path.dirname(path)
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            cached = self._folder_art.get(folder)
+        # A cover added, removed or renamed changes the folder's mtime
+        if cached is not None and cached[0] == mtime:
+            art_hash = cached[1]
+        else:
+            art_hash = None
+            cover = find_cover(folder)
+            if cover:
+                try:
+                    with open(cover, "rb") as f:
+                        art_hash = self.art_store.put(f.read())
+                except OSError as e:
+                    print(f"MetadataService: Error loading external artwork {cover}: {e}")
+            with self._lock:
+                self._folder_art[folder] = (mtime, art_hash)
+        return art_hash or self.art_store.put(read_embedded_art(path))
+
+    def _on_chunk_resolved(self, generation, results):
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._in_worker -= len(results)
+        resolved = []
+        fallbacks = []
+        for uri, metadata in results:
+            if metadata is None:
+                fallbacks.append(uri)
+            else:
+                resolved.append((uri, metadata))
+        self._done += len(resolved)
+        for uri in fallbacks:
+            self._fallbacks[uri] += 1
+        # Formats mutagen doesn't know, and non-local URIs
+        self.discovery.add(fallbacks)
+        if resolved:
+            self.emit('resolved', resolved)
+        self._progress()
+        return False
+
+    def _on_discovered(self, pool, info, error):
+        uri = info.get_uri()
+        if not self._fallbacks[uri]:
+            return
+        self._fallbacks[uri] -= 1
+        if not self._fallbacks[uri]:
+            del self._fallbacks[uri]
+        if error:
+            print(f"Discovery error for {uri}: {error.message}")
+            self._done += 1
+            self._progress()
+            return
+        # Tags are taken here; cover art (file reads, hashing) is read in the
+        # pool and the result comes back like a resolved chunk
+        with self._lock:
+            generation = self._generation
+            self._in_worker += 1
+        self._executor.submit(self._finish_discovered, generation, uri, self._tags_from_info(info))
+
+    def _on_discovery_finished(self, pool):
+        # URIs the pool couldn't even queue never come back
+        if self._fallbacks:
+            self._done += sum(self._fallbacks.values())
+            self._fallbacks.clear()
+            self._progress()
+
+    def _finish_discovered(self, generation, uri, tags):
+        try:
+            path = uri_to_path(uri)
+            metadata = FileMetadata(*tags, self._read_art(path) if path else None)
+            if path:
+                try:
+                    st = os.stat(path)
+                    self.cache.put([(path, st.st_mtime_ns, st.st_size, metadata)])
+                except OSError:
+                    pass
+        except Exception as e:
+            print(f"MetadataService: Error reading art for {uri}: {e}")
+            GLib.idle_add(self._on_failed, generation, 1)
+            return
+        GLib.idle_add(self._on_chunk_resolved, generation, [(uri, metadata)])
+
+    def _on_failed(self, generation, count):
+        """Gives back the in-worker count of URIs whose reading failed; they count as done."""
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._in_worker -= count
+        self._done += count
+        self._progress()
+        return False
+
+    def _tags_from_info(self, info):
+        """Returns (title, artist, album, duration) of a DiscovererInfo."""
+        uri = info.get_uri()
+        tags = info.get_tags()
+
+        def get_tag_str(tag_name):
+            if not tags:
+                return None
+            res, val = tags.get_string(tag_name)
+            return val if res else None
+
+        title = get_tag_str(Gst.TAG_TITLE)
+        path = uri_to_path(uri)
+        if not title:
+            title = os.path.splitext(os.path.basename(path or unquote(urlparse(uri).path)))[0]
+        duration = info.get_duration()
+        return title, get_tag_str(Gst.TAG_ARTIST), get_tag_str(Gst.TAG_ALBUM), duration if duration > 0 else 0
+
+    def _progress(self):
+        now = time.monotonic()
+        if now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self._emit_progress(now)
+        self._check_finished()
+
+    def _emit_progress(self, now):
+        done = min(self._done, self._total)
+        eta = -1.0
+        if done:
+            eta = (now - self._started) / done * (self._total - done)
+        self.emit('progress', done, self._total, eta)
+
+    def _check_finished(self):
+        if self._total <= 0 and not self._done:
+            return
+        with self._lock:
+            busy = self._queue or self._in_worker
+        if not busy and not self._fallbacks:
+            self._emit_progress(time.monotonic())
+            self._done = self._total = 0
+            self.emit('finished')
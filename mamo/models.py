@@ -1,6 +1,6 @@
 
 import gi
-from gi.repository import GObject, GLib
+from gi.repository import GObject
 
 class Song(GObject.Object):
     __gtype_name__ = 'Song'
@@ -10,7 +10,7 @@ class Song(GObject.Object):
     artist = GObject.Property(type=str, default="Unknown Artist")
     album = GObject.Property(type=str, default="Unknown Album")
     duration = GObject.Property(type=GObject.TYPE_INT64, default=0) 
-    album_art_data = GObject.Property(type=GLib.Bytes) 
+    album_art_hash = GObject.Property(type=str) # Key into the ArtStore
     is_playing = GObject.Property(type=bool, default=False)
 
     def __init__(self, uri, title=None, artist=None, album=None, duration=None):
@@ -30,12 +30,12 @@ class Album(GObject.Object):
 
     title = GObject.Property(type=str, default="Unknown Album")
     artist = GObject.Property(type=str, default="Unknown Artist")
-    art_data = GObject.Property(type=GLib.Bytes)
+    art_hash = GObject.Property(type=str) # Key into the ArtStore
     folder = GObject.Property(type=str) # The folder containing the album
 
-    def __init__(self, title, artist, folder, art_data=None):
+    def __init__(self, title, artist, folder, art_hash=None):
         super().__init__()
         self.title = title
         self.artist = artist
         self.folder = folder
-        self.art_data = art_data
+        self.art_hash = art_hash
@@ -1,7 +1,5 @@
 
 import gi
-import os
-import tempfile
 import pathlib
 from gi.repository import Gio, GLib, Gst
 
@@ -62,7 +60,6 @@ class MprisManager:
         self.window = window
         self.bus_name = None
         self.registration_ids = []
-        self.art_file = None
         
         self.node_info = Gio.DBusNodeInfo.new_for_xml(MPRIS_INTERFACE_XML)
         
@@ -142,19 +139,11 @@ class MprisManager:
         metadata["xesam:album"] = GLib.Variant("s", song.album)
         metadata["xesam:url"] = GLib.Variant("s", song.uri)
 
-        # Handle Album Art
-        if song.album_art_data:
-            try:
-                if self.art_file and os.path.exists(self.art_file):
-                    os.unlink(self.art_file)
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as f:
-                    f.write(song.album_art_data.get_data())
-                    self.art_file = f.name
-                
-                metadata["mpris:artUrl"] = GLib.Variant("s", pathlib.Path(self.art_file).as_uri())
-            except Exception as e:
-                print(f"Error saving temp art for MPRIS: {e}")
+        # Handle Album Art, served straight from the art store
+        art_store = self.window.art_store
+        if art_store.contains(song.album_art_hash):
+            art_path = art_store.path(song.album_art_hash)
+            metadata["mpris:artUrl"] = GLib.Variant("s", pathlib.Path(art_path).as_uri())
 
         return metadata
 
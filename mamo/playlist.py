@@ -0,0 +1,292 @@
+import os
+import json
+import tempfile
+import threading
+from gi.repository import GLib
+
+# Snapshot format: {"version": 2, "generation": N, "songs": [...]}. Version 1
+# playlists are a bare list of song dicts and still load.
+SNAPSHOT_VERSION = 2
+
+# Buffered journal lines are written out this often
+FLUSH_INTERVAL_MS = 1000
+# Compact once the journal holds this many operations and at least half as
+# many as there are songs, so replaying never costs much more than the snapshot
+COMPACT_MIN_OPS = 500
+
+_COMPACT_JSON = {'separators': (',', ':'), 'ensure_ascii': False}
+
+
+def song_entry(song):
+    """Returns the stored form of a Song (or SongRecord), as used in playlist files."""
+    duration = song.duration if isinstance(song.duration, int) and song.duration >= 0 else 0
+    entry = {'uri': song.uri, 'title': song.title, 'artist': song.artist, 'duration_ns': duration}
+    if song.album_art_hash:
+        entry['art_hash'] = song.album_art_hash
+    return entry
+
+
+def write_playlist_file(path, entries, generation=0):
+    """Writes a compact snapshot atomically (write, then rename)."""
+    target_dir = os.path.dirname(path)
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir or None, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'generation': generation, 'songs': entries},
+                      f, **_COMPACT_JSON)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_playlist_file(path):
+    """Returns (entries, generation) of a snapshot or an old style playlist."""
+    entries, generation, _version = _read_snapshot(path)
+    return entries, generation
+
+
+def _read_snapshot(path):
+    """Returns (entries, generation, version) of a snapshot or an old style playlist."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return ([e for e in data.get('songs', []) if isinstance(e, dict)],
+                data.get('generation', 0), data.get('version', SNAPSHOT_VERSION))
+    if isinstance(data, list):
+        return [e for e in data if isinstance(e, dict)], 0, 1
+    return [], 0, SNAPSHOT_VERSION
+
+
+def apply_operation(entries, op):
+    """Replays one journal operation on a list of entries."""
+    kind = op.get('op')
+    if kind == 'insert':
+        pos = op['pos']
+        entries[pos:pos] = op['songs']
+    elif kind == 'remove':
+        del entries[op['pos']:op['pos'] + op['count']]
+    elif kind == 'move':
+        entries.insert(op['to'], entries.pop(op['from']))
+    elif kind == 'duration':
+        pos = op['pos']
+        entries[pos] = dict(entries[pos], duration_ns=op['duration_ns'])
+
+
+class PlaylistJournal:
+    """
+    Persists the playlist as a compact snapshot (playlist.json) plus an
+    append-only journal of edits (playlist.json.journal), so an edit costs
+    one short line on disk instead of a rewrite of the whole playlist.
+
+    The journal follows the store through items-changed; a remove of one
+    song followed by its re-insert (a drag and drop) is logged as a move.
+    Every so often the journal is folded into a new snapshot in a
+    background thread. The journal's first line names the snapshot
+    generation it applies to, so a journal left over from an interrupted
+    compaction is ignored rather than replayed twice.
+
+    Follows a PlaylistModel, whose records it stores without making Songs.
+    Must be used from the main thread, except load().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.recording = True
+        self._store = None
+        self._entries = [] # Mirror of the store in stored form
+        self._generation = 0
+        self._n_ops = 0
+        self._pending = [] # Operations not yet written
+        self._since_compaction = None # Operations logged while a compaction runs
+        self._compact_again = False
+        self._journal_file = None
+        self._journal_current = False # Journal on disk belongs to our snapshot
+        self._flush_timer_id = None
+        self._legacy = False # Loaded snapshot is version 1 or embeds art
+
+    def load(self):
+        """
+        Reads the snapshot and replays the journal. Returns the song entries.
+        Safe to call from a background thread before attach().
+        """
+        entries = []
+        generation = 0
+        version = SNAPSHOT_VERSION
+        if os.path.exists(self.path):
+            entries, generation, version = _read_snapshot(self.path)
+
+        n_ops = 0
+        try:
+            with open(self.journal_path, 'r') as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('generation') == generation:
+                    self._journal_current = True
+                    for line in f:
+                        try:
+                            op = json.loads(line)
+                        except ValueError:
+                            break # Torn last line from a crash
+                        apply_operation(entries, op)
+                        n_ops += 1
+                else:
+                    print(f"PlaylistJournal: Ignoring journal of generation {header.get('generation')}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"PlaylistJournal: Error replaying {self.journal_path}: {e}")
+
+        self._legacy = version < SNAPSHOT_VERSION or any('album_art_b64' in e for e in entries)
+        self._generation = generation
+        self._n_ops = n_ops
+        return entries
+
+    def attach(self, store):
+        """
+        Starts following the store. Its contents must match the loaded
+        entries; a legacy snapshot is rewritten in the current form.
+        """
+        self._store = store
+        store.connect("items-changed", self._on_items_changed)
+        # In stored form, as edits are logged (and moves recognised)
+        self._entries = [song_entry(record) for record in store.get_records()]
+        if self._legacy or self._n_ops >= COMPACT_MIN_OPS:
+            self._legacy = False
+            self.compact()
+
+    def reset(self):
+        """Forgets the journal and snapshots the store as it is now."""
+        self._pending.clear()
+        self._entries = [song_entry(record) for record in self._store.get_records()]
+        self.compact()
+
+    def update_duration(self, position):
+        """Records a new duration for the song at position."""
+        entry = song_entry(self._store.get_record(position))
+        # Replaced rather than changed, a compaction may be writing the old one
+        self._entries[position] = entry
+        self._log({'op': 'duration', 'pos': position, 'duration_ns': entry['duration_ns']})
+
+    def _on_items_changed(self, store, position, removed, added):
+        if not self.recording:
+            return
+        if removed:
+            op = {'op': 'remove', 'pos': position, 'count': removed}
+            if removed == 1 and not added:
+                # Kept (but not written) to recognise a following re-insert
+                op['_entry'] = self._entries[position]
+            del self._entries[position:position + removed]
+            self._log(op)
+        if added:
+            songs = [song_entry(record) for record in store.get_records(position, added)]
+            self._entries[position:position] = songs
+            last = self._pending[-1] if self._pending else None
+            if added == 1 and not removed and last and last.get('_entry') == songs[0]:
+                # remove() then insert() of the same song: a reorder
+                move = {'op': 'move', 'from': last['pos'], 'to': position}
+                self._pending[-1] = move
+                if self._since_compaction:
+                    self._since_compaction[-1] = move
+            else:
+                self._log({'op': 'insert', 'pos': position, 'songs': songs})
+
+    def _log(self, op):
+        self._pending.append(op)
+        if self._since_compaction is not None:
+            self._since_compaction.append(op)
+        if self._flush_timer_id is None:
+            self._flush_timer_id = GLib.timeout_add(FLUSH_INTERVAL_MS, self._on_flush_timer)
+
+    def _on_flush_timer(self):
+        self._flush_timer_id = None
+        self.flush()
+        return False
+
+    def flush(self):
+        """Appends the pending operations to the journal."""
+        if not self._pending:
+            return
+        try:
+            if self._journal_file is None:
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+                if self._journal_current:
+                    self._journal_file = open(self.journal_path, 'a')
+                else:
+                    # Missing or stale journal, start over from the snapshot
+                    self._journal_file = open(self.journal_path, 'w')
+                    self._journal_file.write(json.dumps({'generation': self._generation}) + "\n")
+                    self._journal_current = True
+            self._journal_file.write(''.join(self._dump(op) for op in self._pending))
+            self._journal_file.flush()
+        except OSError as e:
+            print(f"PlaylistJournal: Error writing {self.journal_path}: {e}")
+            return
+        self._n_ops += len(self._pending)
+        self._pending.clear()
+        if self._n_ops >= max(COMPACT_MIN_OPS, len(self._entries) // 2):
+            self.compact()
+
+    @staticmethod
+    def _dump(op):
+        return json.dumps({k: v for k, v in op.items() if not k.startswith('_')}, **_COMPACT_JSON) + "\n"
+
+    def compact(self):
+        """Writes a new snapshot in the background and starts a fresh journal."""
+        if self._since_compaction is not None:
+            self._compact_again = True
+            return
+        self.flush()
+        entries = list(self._entries)
+        generation = self._generation + 1
+        self._since_compaction = []
+
+        def write():
+            try:
+                write_playlist_file(self.path, entries, generation)
+                ok = True
+            except Exception as e:
+                print(f"PlaylistJournal: Error writing snapshot {self.path}: {e}")
+                ok = False
+            GLib.idle_add(self._on_compacted, generation, ok)
+
+        threading.Thread(target=write, daemon=True).start()
+
+    def _on_compacted(self, generation, ok):
+        since, self._since_compaction = self._since_compaction, None
+        if not ok:
+            return False
+        # Start the new journal with what happened while the snapshot was
+        # written; anything still pending is part of that too
+        self._pending.clear()
+        lines = [self._dump(op) for op in since]
+        if self._journal_file:
+            self._journal_file.close()
+            self._journal_file = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.journal_path), prefix=".tmp-")
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps({'generation': generation}) + "\n")
+                f.write(''.join(lines))
+            os.replace(tmp_path, self.journal_path)
+            self._journal_current = True
+        except OSError as e:
+            print(f"PlaylistJournal: Error starting journal {self.journal_path}: {e}")
+            self._journal_current = False
+        self._generation = generation
+        self._n_ops = len(lines)
+        if self._compact_again:
+            self._compact_again = False
+            self.compact()
+        return False
+
+    def close(self):
+        """Writes out pending operations (e.g. at shutdown)."""
+        if self._flush_timer_id:
+            GLib.source_remove(self._flush_timer_id)
+            self._flush_timer_id = None
+        self.flush()
+        if self._journal_file:
+            self._journal_file.close()
+            self._journal_file = None
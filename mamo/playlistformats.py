@@ -0,0 +1,194 @@
+import os
+import re
+import pathlib
+import tempfile
+import collections
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+from urllib.parse import urljoin, urlparse, quote, unquote
+
+# Duration in ns, 0 if unknown. Title and artist may be None.
+PlaylistEntry = collections.namedtuple('PlaylistEntry', 'uri title artist duration')
+
+EXTENSIONS = ('.m3u', '.m3u8', '.pls', '.xspf')
+
+_SCHEME = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*://')
+_PLS_KEY = re.compile(r'^(File|Title|Length)(\d+)$', re.IGNORECASE)
+
+NS_PER_SECOND = 1000000000
+XSPF_NS = 'http://xspf.org/ns/0/'
+
+
+def is_playlist_file(path):
+    return path.lower().endswith(EXTENSIONS)
+
+
+def resolve_location(location, base_dir):
+    """Turns a playlist location (URI, absolute or relative path) into a URI."""
+    location = location.strip()
+    if _SCHEME.match(location):
+        return location
+    path = location if os.path.isabs(location) else os.path.join(base_dir, location)
+    if '\\' in path and not os.path.exists(path):
+        # Exported on Windows
+        path = path.replace('\\', '/')
+    # What pathlib's as_uri() does, without building a Path per entry
+    return 'file://' + quote(os.fsencode(os.path.normpath(path)))
+
+
+def _location_of(uri):
+    """The path of a local file, the URI of anything else."""
+    parsed = urlparse(uri)
+    return unquote(parsed.path) if parsed.scheme == 'file' else uri
+
+
+def _seconds_to_ns(value):
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(seconds * NS_PER_SECOND) if seconds > 0 else 0
+
+
+def _split_display_name(name):
+    """'Artist - Title' as written by #EXTINF, or just a title."""
+    name = name.strip()
+    if ' - ' in name:
+        artist, title = name.split(' - ', 1)
+        return title.strip() or None, artist.strip() or None
+    return name or None, None
+
+
+def read_m3u(path):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    title = artist = None
+    duration = 0
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                if line.upper().startswith('#EXTINF:'):
+                    info, _sep, name = line[8:].partition(',')
+                    # The length may be followed by attributes (key="value")
+                    duration = _seconds_to_ns(info.split(' ', 1)[0])
+                    title, artist = _split_display_name(name)
+                continue
+            yield PlaylistEntry(resolve_location(line, base_dir), title, artist, duration)
+            title = artist = None
+            duration = 0
+
+
+def read_pls(path):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    number = None
+    fields = {}
+
+    def entry():
+        return PlaylistEntry(resolve_location(fields['file'], base_dir), fields.get('title') or None,
+                             None, _seconds_to_ns(fields.get('length')))
+
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            key, sep, value = line.strip().partition('=')
+            match = _PLS_KEY.match(key) if sep else None
+            if not match:
+                continue
+            if match.group(2) != number:
+                # Entries come one after another, so a new number ends the last one
+                if 'file' in fields:
+                    yield entry()
+                number = match.group(2)
+                fields = {}
+            fields[match.group(1).lower()] = value.strip()
+    if 'file' in fields:
+        yield entry()
+
+
+def read_xspf(path):
+    base_uri = pathlib.Path(os.path.abspath(path)).as_uri()
+    track_list = None
+    for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            if tag == 'trackList':
+                track_list = element
+            continue
+        if tag != 'track':
+            continue
+        fields = {child.tag.rsplit('}', 1)[-1]: (child.text or '').strip() for child in element}
+        location = fields.get('location')
+        if location:
+            uri = location if _SCHEME.match(location) else urljoin(base_uri, location)
+            try:
+                duration = int(fields.get('duration') or 0) * 1000000
+            except ValueError:
+                duration = 0
+            yield PlaylistEntry(uri, fields.get('title') or None, fields.get('creator') or None, max(duration, 0))
+        # Drop parsed tracks, memory stays flat however long the list is
+        if track_list is not None:
+            track_list.remove(element)
+
+
+READERS = {'.m3u': read_m3u, '.m3u8': read_m3u, '.pls': read_pls, '.xspf': read_xspf}
+
+
+def read_playlist(path):
+    """
+    Yields the PlaylistEntries of an M3U/M3U8, PLS or XSPF file, reading it
+    a line (or XML element) at a time so memory use doesn't grow with the
+    playlist. Relative locations are resolved against the file's folder.
+    """
+    return READERS[os.path.splitext(path)[1].lower()](path)
+
+
+def _write_m3u(f, entries):
+    f.write("#EXTM3U\n")
+    for entry in entries:
+        seconds = entry.duration // NS_PER_SECOND if entry.duration else -1
+        name = f"{entry.artist} - {entry.title}" if entry.artist else entry.title
+        f.write(f"#EXTINF:{seconds},{name}\n{_location_of(entry.uri)}\n")
+
+
+def _write_pls(f, entries):
+    f.write("[playlist]\n")
+    n = 0
+    for n, entry in enumerate(entries, 1):
+        seconds = entry.duration // NS_PER_SECOND if entry.duration else -1
+        f.write(f"File{n}={_location_of(entry.uri)}\nTitle{n}={entry.title}\nLength{n}={seconds}\n")
+    f.write(f"NumberOfEntries={n}\nVersion=2\n")
+
+
+def _write_xspf(f, entries):
+    f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<playlist version="1" xmlns="{XSPF_NS}">\n  <trackList>\n')
+    for entry in entries:
+        f.write(f"    <track><location>{escape(entry.uri)}</location>")
+        if entry.title:
+            f.write(f"<title>{escape(entry.title)}</title>")
+        if entry.artist:
+            f.write(f"<creator>{escape(entry.artist)}</creator>")
+        if entry.duration:
+            f.write(f"<duration>{entry.duration // 1000000}</duration>")
+        f.write("</track>\n")
+    f.write("  </trackList>\n</playlist>\n")
+
+
+WRITERS = {'.m3u': _write_m3u, '.m3u8': _write_m3u, '.pls': _write_pls, '.xspf': _write_xspf}
+
+
+def write_playlist(path, entries):
+    """
+    Writes entries (anything with uri, title, artist and duration, such as
+    SongRecords) as M3U/M3U8, PLS or XSPF by extension, atomically.
+    """
+    writer = WRITERS[os.path.splitext(path)[1].lower()]
+    target_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            writer(f, entries)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,405 @@
+import sys
+import weakref
+import itertools
+import collections
+from gi.repository import GObject, GLib, Gio
+
+from .models import Song
+
+# Songs kept alive after the list stops showing them, so scrolling back and
+# forth reuses them instead of building new ones
+RECENT_SONGS = 256
+
+
+def ranges_of(positions):
+    """Turns sorted positions into (start, count) runs of consecutive ones."""
+    ranges = []
+    for position in positions:
+        if ranges and ranges[-1][0] + ranges[-1][1] == position:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([position, 1])
+    return [tuple(r) for r in ranges]
+
+
+class SongRecord:
+    """The compact form of a playlist entry; Songs are made from it on demand."""
+    __slots__ = ('uri', 'title', 'artist', 'album', 'duration', 'album_art_hash')
+
+    def __init__(self, uri, title=None, artist=None, album=None, duration=0, album_art_hash=None):
+        self.uri = uri
+        self.title = title or "Unknown Title"
+        # Shared by every track of an album
+        self.artist = sys.intern(artist or "Unknown Artist")
+        self.album = sys.intern(album or "Unknown Album")
+        self.duration = duration if isinstance(duration, int) and duration >= 0 else 0
+        self.album_art_hash = album_art_hash
+
+    @classmethod
+    def from_song(cls, song):
+        return cls(song.uri, song.title, song.artist, song.album, song.duration, song.album_art_hash)
+
+    def to_song(self):
+        song = Song(uri=self.uri, title=self.title, artist=self.artist, album=self.album,
+                    duration=self.duration)
+        if self.album_art_hash:
+            song.album_art_hash = self.album_art_hash
+        return song
+
+
+class PlaylistModel(GObject.Object, Gio.ListModel):
+    """
+    A list model of Songs that stores SongRecords and only makes a Song for
+    a row when someone asks for it (the ListView binding it, the player).
+    A Song lives as long as it is referenced, plus a while in a small
+    recently-used cache; asking for the same row while it lives returns the
+    same Song, so Songs can still be compared by identity.
+
+    Offers the Gio.ListStore methods the window uses (append, insert,
+    remove, remove_all, splice), taking Songs, plus record based access.
+    """
+    __gtype_name__ = 'PlaylistModel'
+
+    def __init__(self):
+        super().__init__()
+        self._records = []
+        self._songs = weakref.WeakValueDictionary() # record -> live Song
+        self._recent = collections.OrderedDict() # record -> Song, most recent last
+
+    def do_get_item_type(self):
+        return Song.__gtype__
+
+    def do_get_n_items(self):
+        return len(self._records)
+
+    def do_get_item(self, position):
+        if position >= len(self._records):
+            return None
+        return self.song_for_record(self._records[position])
+
+    def __len__(self):
+        return len(self._records)
+
+    def song_for_record(self, record):
+        song = self._songs.get(record)
+        if song is None:
+            song = record.to_song()
+            song.playlist_record = record
+            self._songs[record] = song
+        self._recent[record] = song
+        self._recent.move_to_end(record)
+        if len(self._recent) > RECENT_SONGS:
+            self._recent.popitem(last=False)
+        return song
+
+    def record_of(self, song):
+        """Returns the record a Song stands for, or None if it is not in this playlist."""
+        record = getattr(song, 'playlist_record', None)
+        if record is not None and self._songs.get(record) is song:
+            return record
+        return None
+
+    def get_record(self, position):
+        return self._records[position]
+
+    def get_records(self, position=0, n_items=None):
+        end = len(self._records) if n_items is None else position + n_items
+        return self._records[position:end]
+
+    def splice_records(self, position, n_removals, records):
+        removed = self._records[position:position + n_removals]
+        # Records that stay (a move) keep their Songs
+        staying = set(records) if removed and records else ()
+        for record in removed:
+            if record not in staying:
+                self._forget(record)
+        self._records[position:position + n_removals] = records
+        self.items_changed(position, len(removed), len(records))
+
+    def splice(self, position, n_removals, songs):
+        # Forgotten first, the songs may be coming back
+        for record in self._records[position:position + n_removals]:
+            self._forget(record)
+        records = []
+        for song in songs:
+            record = SongRecord.from_song(song)
+            # A Song already in the playlist keeps standing for its first entry
+            if self.record_of(song) is None:
+                song.playlist_record = record
+                self._songs[record] = song
+            records.append(record)
+        self.splice_records(position, n_removals, records)
+
+    def append(self, song):
+        self.splice(len(self._records), 0, [song])
+
+    def insert(self, position, song):
+        self.splice(position, 0, [song])
+
+    def remove(self, position):
+        self.splice_records(position, 1, [])
+
+    def remove_all(self):
+        self.splice_records(0, len(self._records), [])
+
+    def remove_ranges(self, ranges):
+        """Removes (start, count) ranges, one splice per range."""
+        for start, count in sorted(ranges, reverse=True):
+            self.splice_records(start, count, [])
+
+    def move_ranges(self, ranges, target):
+        """
+        Moves the entries in (start, count) ranges, in order, to just before
+        position target. Everything between the ranges and the target
+        changes in a single splice. Returns the new position of the first
+        moved entry.
+        """
+        if not ranges:
+            return None
+        low = min(ranges[0][0], target)
+        high = max(ranges[-1][0] + ranges[-1][1], target)
+        moving = set()
+        for start, count in ranges:
+            moving.update(range(start, start + count))
+        span = self._records[low:high]
+        before = [r for i, r in enumerate(span, low) if i < target and i not in moving]
+        after = [r for i, r in enumerate(span, low) if i >= target and i not in moving]
+        moved = [r for i, r in enumerate(span, low) if i in moving]
+        reordered = before + moved + after
+        if any(a is not b for a, b in zip(reordered, span)):
+            self.splice_records(low, high - low, reordered)
+        return low + len(before)
+
+    def shift_ranges(self, ranges, offset):
+        """
+        Moves each of the sorted (start, count) ranges one row up (offset -1)
+        or down (+1) by swapping it with the row next to it; a range already
+        at the edge stays. The rows that change go in a single splice.
+        Returns the new ranges.
+        """
+        n_items = len(self._records)
+        moving = [(start, count) for start, count in ranges
+                  if (start > 0 if offset < 0 else start + count < n_items)]
+        if not moving:
+            return list(ranges)
+        if offset < 0:
+            low, high = moving[0][0] - 1, moving[-1][0] + moving[-1][1]
+        else:
+            low, high = moving[0][0], moving[-1][0] + moving[-1][1] + 1
+        span = self._records[low:high]
+        # Ranges are apart by at least one row, so the swaps don't overlap
+        for start, count in moving:
+            block = self._records[start:start + count]
+            if offset < 0:
+                span[start - 1 - low:start + count - low] = block + [self._records[start - 1]]
+            else:
+                span[start - low:start + count + 1 - low] = [self._records[start + count]] + block
+        self.splice_records(low, high - low, span)
+        moving = set(moving)
+        return [(start + offset, count) if (start, count) in moving else (start, count)
+                for start, count in ranges]
+
+    def update_record(self, record, **fields):
+        """Changes fields of a record and of its Song if there is one. See refresh()."""
+        song = self._songs.get(record)
+        for name, value in fields.items():
+            setattr(record, name, value)
+            if song is not None:
+                setattr(song, name, value)
+
+    def refresh(self, ranges):
+        """Announces changed entries in (start, count) ranges, a splice per range."""
+        for start, count in ranges:
+            self.splice_records(start, count, self._records[start:start + count])
+
+    def set_duration(self, position, duration):
+        """Changes the duration of an entry, and of its Song if there is one."""
+        record = self._records[position]
+        record.duration = duration
+        song = self._songs.get(record)
+        if song is not None:
+            song.duration = duration
+
+    def _forget(self, record):
+        self._recent.pop(record, None)
+        song = self._songs.pop(record, None)
+        if song is not None and song.playlist_record is record:
+            song.playlist_record = None
+
+
+class PlaylistIndex:
+    """
+    Maps Songs and URIs to their position in a PlaylistModel, kept in sync
+    through items-changed. Positions are assigned lazily: an edit only
+    marks everything after it as stale, and a lookup renumbers the stale
+    part up to the entry it is after. Lookups before the first edit since
+    the last renumbering are O(1), as are appends and edits near the end
+    followed by lookups there; a lookup of row p after an edit at row e
+    costs O(p - e), so an edit near the top followed by a lookup near the
+    bottom is a scan of the whole playlist. Edits themselves never scan.
+
+    The index works on the model's records, so it doesn't make Songs for
+    rows nobody shows. The same URI may appear several times;
+    positions_of_uri() returns all of them.
+    """
+    def __init__(self, model):
+        self._model = model
+        self._items = [] # Mirror of the model's records
+        self._positions = {} # record -> position, always correct below _valid_upto
+        self._valid_upto = 0
+        self._by_uri = {} # uri -> {record: None}, an ordered set
+        self._on_items_changed(model, 0, 0, model.get_n_items())
+        model.connect("items-changed", self._on_items_changed)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _on_items_changed(self, model, position, removed, added):
+        for record in self._items[position:position + removed]:
+            self._positions.pop(record, None)
+            records = self._by_uri.get(record.uri)
+            if records is not None:
+                records.pop(record, None)
+                if not records:
+                    del self._by_uri[record.uri]
+        new_items = model.get_records(position, added)
+        self._items[position:position + removed] = new_items
+        for record in new_items:
+            self._by_uri.setdefault(record.uri, {})[record] = None
+        self._valid_upto = min(self._valid_upto, position)
+
+    def _renumber(self, until=None):
+        """Assigns positions from the first stale one, stopping after until if given."""
+        items = self._items
+        positions = self._positions
+        i = self._valid_upto
+        n = len(items)
+        while i < n:
+            record = items[i]
+            positions[record] = i
+            i += 1
+            if record is until:
+                break
+        self._valid_upto = i
+
+    def contains_uri(self, uri):
+        return uri in self._by_uri
+
+    def position_of(self, song):
+        """Returns the position of song, or None if it is not in the playlist."""
+        record = self._model.record_of(song)
+        return None if record is None else self.position_of_record(record)
+
+    def position_of_record(self, record):
+        position = self._positions.get(record)
+        # Entries past the renumbered part may be stale, so check the slot
+        if position is not None and position < len(self._items) and self._items[position] is record:
+            return position
+        if record not in self._by_uri.get(record.uri, ()):
+            return None
+        self._renumber(until=record)
+        return self._positions.get(record)
+
+    def positions_of_uri(self, uri):
+        """Returns the sorted positions of every entry with this URI."""
+        records = self._by_uri.get(uri)
+        if not records:
+            return []
+        return sorted(self.position_of_record(record) for record in records)
+
+    def first_position_of_uri(self, uri):
+        positions = self.positions_of_uri(uri)
+        return positions[0] if positions else None
+
+
+# Songs per splice: a chunk is journaled and indexed within a frame, and a
+# playlist of 20k songs arrives in ten items-changed signals instead of 20k
+SPLICE_CHUNK_SIZE = 2048
+
+
+class SpliceBatcher:
+    """
+    Adds songs to the end of a PlaylistModel with splice(), one chunk per
+    idle callback. Idle sources run below GTK's redraw priority, so the
+    playlist keeps drawing (and playback starts) while a long list of songs
+    is still going in. Songs are always added in the order they were given.
+
+    extend() takes Songs or, from producers that have no Songs to begin
+    with, SongRecords, which go in with splice_records() without becoming
+    Songs.
+
+    generation changes whenever waiting songs are dropped, so producers
+    feeding the batcher from the background can tell their songs are no
+    longer wanted.
+    """
+    def __init__(self, store, chunk_size=SPLICE_CHUNK_SIZE):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.generation = 0
+        self._pending = [] # Songs and SongRecords
+        self._idle_id = None
+
+    def __len__(self):
+        """Number of songs waiting to be added."""
+        return len(self._pending)
+
+    def __iter__(self):
+        """The songs (or records) waiting to be added."""
+        return iter(list(self._pending))
+
+    def extend(self, songs, defer=False):
+        """
+        Adds songs. Unless deferred (or songs are already waiting) the first
+        chunk goes in right away; deferred songs from several calls end up
+        in one splice.
+        """
+        songs = list(songs)
+        if not defer and not self._pending:
+            self._commit(songs[:self.chunk_size])
+            songs = songs[self.chunk_size:]
+        if songs:
+            self._pending.extend(songs)
+            if self._idle_id is None:
+                self._idle_id = GLib.idle_add(self._on_idle)
+
+    def replace(self, songs):
+        """Replaces the contents of the store, the first chunk right away."""
+        self.cancel()
+        songs = list(songs)
+        self.store.splice(0, self.store.get_n_items(), songs[:self.chunk_size])
+        self.extend(songs[self.chunk_size:], defer=True)
+
+    def flush(self):
+        """Adds everything still waiting in a single splice."""
+        songs, self._pending = self._pending, []
+        self._stop_idle()
+        self._commit(songs)
+
+    def cancel(self):
+        """Drops the songs still waiting."""
+        self.generation += 1
+        self._pending = []
+        self._stop_idle()
+
+    def _stop_idle(self):
+        if self._idle_id is not None:
+            GLib.source_remove(self._idle_id)
+            self._idle_id = None
+
+    def _commit(self, items):
+        # One splice per run of Songs or of records
+        for is_record, run in itertools.groupby(items, key=lambda item: isinstance(item, SongRecord)):
+            run = list(run)
+            if is_record:
+                self.store.splice_records(self.store.get_n_items(), 0, run)
+            else:
+                self.store.splice(self.store.get_n_items(), 0, run)
+
+    def _on_idle(self):
+        chunk = self._pending[:self.chunk_size]
+        del self._pending[:self.chunk_size]
+        self._commit(chunk)
+        if self._pending:
+            return True
+        self._idle_id = None
+        return False
@@ -0,0 +1,126 @@
+import re
+import bisect
+import heapq
+import unicodedata
+
+# Query words shorter than this are matched as word prefixes, longer ones
+# as substrings through the trigram table
+TRIGRAM_SIZE = 3
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Casefolds text and strips accents, so "Björk" matches "bjork"."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _WORD_RE.findall(normalize(text)) if text else []
+
+
+def _trigrams(word):
+    return {word[i:i + TRIGRAM_SIZE] for i in range(len(word) - TRIGRAM_SIZE + 1)}
+
+
+class SearchIndex:
+    """
+    Word index over a set of keys (album folders, track URIs...). Every
+    word of a query has to match a word of the indexed text, either as a
+    prefix or, for words of three letters or more, as a substring. Results
+    come back in the order the keys were added, so callers add them sorted.
+
+    Not thread safe: build it in one thread, then hand it over.
+    """
+    def __init__(self):
+        self._keys = [] # id -> key, None once removed
+        self._ids = {} # key -> id
+        self._words_of = [] # id -> words
+        self._postings = {} # word -> set of ids
+        self._trigrams = {} # trigram -> set of words
+        self._sorted_words = None # For prefix lookups, rebuilt lazily
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def add(self, key, *fields):
+        if key in self._ids:
+            self.remove(key)
+        doc_id = len(self._keys)
+        words = set()
+        for field in fields:
+            words.update(tokenize(field))
+        self._keys.append(key)
+        self._ids[key] = doc_id
+        self._words_of.append(words)
+        for word in words:
+            ids = self._postings.get(word)
+            if ids is None:
+                ids = self._postings[word] = set()
+                for trigram in _trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+                self._sorted_words = None
+            ids.add(doc_id)
+
+    def remove(self, key):
+        doc_id = self._ids.pop(key, None)
+        if doc_id is None:
+            return
+        for word in self._words_of[doc_id]:
+            ids = self._postings[word]
+            ids.discard(doc_id)
+            if not ids:
+                del self._postings[word]
+                for trigram in _trigrams(word):
+                    words = self._trigrams[trigram]
+                    words.discard(word)
+                    if not words:
+                        del self._trigrams[trigram]
+                self._sorted_words = None
+        self._keys[doc_id] = None
+        self._words_of[doc_id] = ()
+
+    def _matching_words(self, query_word):
+        if len(query_word) >= TRIGRAM_SIZE:
+            candidates = None
+            # Smallest sets first keeps the intersection cheap
+            for words in sorted((self._trigrams.get(t, ()) for t in _trigrams(query_word)), key=len):
+                candidates = set(words) if candidates is None else candidates & words
+                if not candidates:
+                    return ()
+            return [w for w in candidates if query_word in w]
+
+        if self._sorted_words is None:
+            self._sorted_words = sorted(self._postings)
+        words = self._sorted_words
+        start = bisect.bisect_left(words, query_word)
+        end = bisect.bisect_left(words, query_word + '\U0010ffff', start)
+        return words[start:end]
+
+    def _search_ids(self, query):
+        """Returns the set of ids matching every word of the query, or None for an empty query."""
+        query_words = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not query_words:
+            return None
+        result = None
+        # Longest words first, they are the most selective
+        for query_word in query_words:
+            ids = set()
+            for word in self._matching_words(query_word):
+                ids.update(self._postings[word])
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result
+
+    def search(self, query, limit=None):
+        """Returns the keys matching the query, in insertion order."""
+        ids = self._search_ids(query)
+        if ids is None:
+            return []
+        ids = sorted(ids) if limit is None else heapq.nsmallest(limit, ids)
+        return [self._keys[i] for i in ids]
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import threading
+import collections
+
+import gi
+gi.require_version('Gdk', '4.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gdk, GdkPixbuf, GLib
+
+# Album browser rows and the now playing cover
+BROWSER_SIZE = 48
+COVER_SIZE = 320
+THUMBNAIL_SIZES = (BROWSER_SIZE, COVER_SIZE)
+
+# Decoded textures kept in memory (a 48px texture is ~9 KB)
+MAX_TEXTURES = 512
+
+
+class ThumbnailCache:
+    """
+    Pre-scaled renditions of ArtStore images, stored on disk under
+    ~/.cache/mamo/thumbnails/<size>/<hash>.png, with an in-memory LRU of
+    Gdk.Textures. Decoding and scaling happen in background threads; the
+    main thread only ever turns a small pixbuf into a texture.
+    """
+    def __init__(self, art_store, root):
+        self.art_store = art_store
+        self.root = root
+        self._textures = collections.OrderedDict() # (hash, size) -> (texture, rgb)
+        self._lock = threading.Lock()
+        self._waiting = {} # (hash, size) -> [callbacks]
+        self._queue = collections.deque()
+        self._worker_running = False
+
+    def path(self, art_hash, size):
+        return os.path.join(self.root, str(size), f"{art_hash}.png")
+
+    def generate(self, art_hash):
+        """Writes any missing renditions of an image. Safe to call from any thread."""
+        for size in THUMBNAIL_SIZES:
+            self._load_or_generate(art_hash, size)
+
+    def _load_or_generate(self, art_hash, size):
+        """Returns the scaled pixbuf, creating the thumbnail file if needed."""
+        thumb_path = self.path(art_hash, size)
+        if os.path.exists(thumb_path):
+            try:
+                return GdkPixbuf.Pixbuf.new_from_file(thumb_path)
+            except GLib.Error:
+                pass # Corrupt, regenerate below
+
+        if not self.art_store.contains(art_hash):
+            return None
+        try:
+            # The loader scales while decoding, so big JPEGs stay cheap
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+                self.art_store.path(art_hash), size, size, False)
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(thumb_path), prefix=".tmp-")
+            os.close(fd)
+            pixbuf.savev(tmp_path, "png", [], [])
+            os.replace(tmp_path, thumb_path)
+            return pixbuf
+        except (GLib.Error, OSError) as e:
+            print(f"ThumbnailCache: Error creating {size}px thumbnail for {art_hash}: {e}")
+            return None
+
+    def lookup(self, art_hash, size):
+        """Returns (texture, average_rgb) if already in memory, else None. Main thread only."""
+        key = (art_hash, size)
+        entry = self._textures.get(key)
+        if entry is not None:
+            self._textures.move_to_end(key)
+        return entry
+
+    def request(self, art_hash, size, callback):
+        """
+        Loads a thumbnail in the background and calls callback(texture, rgb)
+        on the main thread. texture is None if the image could not be loaded.
+        """
+        entry = self.lookup(art_hash, size)
+        if entry is not None:
+            callback(*entry)
+            return
+
+        key = (art_hash, size)
+        with self._lock:
+            if key in self._waiting:
+                self._waiting[key].append(callback)
+                return
+            self._waiting[key] = [callback]
+            self._queue.append(key)
+            if self._worker_running:
+                return
+            self._worker_running = True
+        threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker_running = False
+                    return
+                # Newest first, the rows scrolled to last are the visible ones
+                key = self._queue.pop()
+
+            pixbuf = self._load_or_generate(*key)
+            rgb = None
+            if pixbuf:
+                pixels = pixbuf.scale_simple(1, 1, GdkPixbuf.InterpType.BILINEAR).get_pixels()
+                if pixels and len(pixels) >= 3:
+                    rgb = (pixels[0], pixels[1], pixels[2])
+            GLib.idle_add(self._deliver, key, pixbuf, rgb)
+
+    def _deliver(self, key, pixbuf, rgb):
+        texture = Gdk.Texture.new_for_pixbuf(pixbuf) if pixbuf else None
+        if texture:
+            self._textures[key] = (texture, rgb)
+            while len(self._textures) > MAX_TEXTURES:
+                self._textures.popitem(last=False)
+        with self._lock:
+            callbacks = self._waiting.pop(key, [])
+        for callback in callbacks:
+            callback(texture, rgb)
+        return False
+
+    # CacheManager interface. Thumbnails are made again when they're asked for.
+
+    def entries(self):
+        """Returns (path, bytes, last access) of every thumbnail file."""
+        entries = []
+        for size in THUMBNAIL_SIZES:
+            folder = os.path.join(self.root, str(size))
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, max(st.st_atime, st.st_mtime)))
+        return entries
+
+    def evict(self, paths):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def usage(self):
+        return sum(size for _path, size, _accessed in self.entries())
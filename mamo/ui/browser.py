@@ -1,8 +1,9 @@
 
 import gi
-from gi.repository import Gtk, Adw, Gio, GdkPixbuf, Pango
+from gi.repository import Gtk, Adw, Gio, Pango
 
 from ..models import Album
+from ..thumbnails import BROWSER_SIZE
 
 class AlbumBrowser(Adw.Window):
     def __init__(self, parent, library_manager, callback):
@@ -15,6 +16,10 @@ class AlbumBrowser(Adw.Window):
 
         self.albums_store = Gio.ListStore(item_type=Album)
         self.filter_model = Gtk.FilterListModel(model=self.albums_store)
+        # Folders of the albums matching the search, looked up in the
+        # library's search index rather than matched album by album
+        self._search_matches = None
+        self._search_filter = Gtk.CustomFilter.new(lambda album: album.folder in self._search_matches)
         
         # Sorting: Artist then Title
         self.multi_sorter = Gtk.MultiSorter()
@@ -112,8 +117,19 @@ class AlbumBrowser(Adw.Window):
         for album in self.library_manager.albums:
             self.albums_store.append(album)
 
-    def _on_library_updated(self, manager):
-        self._update_store()
+    def _on_library_updated(self, manager, updated, removed):
+        if updated is None:
+            self._update_store()
+        else:
+            removed = set(removed)
+            for i in reversed(range(self.albums_store.get_n_items())):
+                if self.albums_store.get_item(i) in removed:
+                    self.albums_store.remove(i)
+            for album in updated:
+                self.albums_store.append(album)
+
+        if self._search_matches is not None:
+            self._on_search_changed(self.search_entry)
 
     def _on_item_setup(self, factory, list_item):
         box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
@@ -158,31 +174,37 @@ class AlbumBrowser(Adw.Window):
             artist_label.set_label(album.artist)
 
         if image:
-            if album.art_data:
-                try:
-                    loader = GdkPixbuf.PixbufLoader()
-                    loader.write(album.art_data.get_data())
-                    loader.close()
-                    pixbuf = loader.get_pixbuf()
-                    scaled = pixbuf.scale_simple(48, 48, GdkPixbuf.InterpType.BILINEAR)
-                    image.set_from_pixbuf(scaled)
-                except Exception:
-                    image.set_from_icon_name("audio-x-generic-symbolic")
+            # Thumbnails load in the background; the row may be rebound by then
+            art_hash = album.art_hash
+            list_item._art_hash = art_hash
+            thumbnails = self.library_manager.thumbnails
+            cached = thumbnails.lookup(art_hash, BROWSER_SIZE) if art_hash else None
+            if cached:
+                image.set_from_paintable(cached[0])
             else:
                 image.set_from_icon_name("audio-x-generic-symbolic")
+                if art_hash:
+                    def on_loaded(texture, rgb):
+                        if texture and getattr(list_item, "_art_hash", None) == art_hash:
+                            image.set_from_paintable(texture)
+                    thumbnails.request(art_hash, BROWSER_SIZE, on_loaded)
 
     def _on_search_changed(self, entry):
-        search_text = entry.get_text().lower()
-        if not search_text:
+        search_text = entry.get_text()
+        if not search_text.strip():
+            self._search_matches = None
             self.filter_model.set_filter(None)
             return
 
-        def filter_func(item):
-            return (search_text in item.title.lower() or 
-                    search_text in item.artist.lower())
-
-        custom_filter = Gtk.CustomFilter.new(filter_func)
-        self.filter_model.set_filter(custom_filter)
+        previous = self._search_matches
+        self._search_matches = set(self.library_manager.search_albums(search_text))
+        if previous is None:
+            self.filter_model.set_filter(self._search_filter)
+        elif self._search_matches <= previous:
+            # Typing another letter only narrows the results
+            self._search_filter.changed(Gtk.FilterChange.MORE_STRICT)
+        else:
+            self._search_filter.changed(Gtk.FilterChange.DIFFERENT)
 
     def _on_selection_changed(self, selection_model, position, n_items):
         has_selection = selection_model.get_selected_item() is not None
@@ -210,7 +232,7 @@ class AlbumBrowser(Adw.Window):
             folder = dialog.select_folder_finish(result)
             if folder:
                 new_path = folder.get_path()
-                self.library_manager.library_path = new_path
+                self.library_manager.set_library_path(new_path)
                 self.lib_label.set_label(_("Library: ") + f"{new_path}")
                 
                 # Tell parent to save new path
@@ -0,0 +1,128 @@
+import gi
+from gi.repository import Gtk, Adw, Gio, Pango
+
+from ..models import Song
+
+# Rows shown for a search, more than anyone scrolls through
+MAX_RESULTS = 200
+
+
+class SongSearchDialog(Adw.Window):
+    """
+    "Play Song" dialog: searches every track in the library by title, artist
+    and album, using the library's track index.
+    """
+    def __init__(self, parent, library_manager, callback):
+        super().__init__(transient_for=parent, modal=True)
+        self.set_title(_("Play Song"))
+        self.set_icon_name("multimedia-audio-player")
+        self.set_default_size(450, 550)
+        self.callback = callback
+        self.library_manager = library_manager
+
+        self.songs_store = Gio.ListStore(item_type=Song)
+        self.selection_model = Gtk.SingleSelection(model=self.songs_store)
+
+        # The track index is rebuilt in the background after scans
+        self._indexed_handler = self.library_manager.connect('tracks-indexed', self._on_tracks_indexed)
+        self.connect("close-request", self._on_close_request)
+
+        main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
+        main_box.set_margin_start(12)
+        main_box.set_margin_end(12)
+        main_box.set_margin_top(12)
+        main_box.set_margin_bottom(12)
+        self.set_content(main_box)
+
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text(_("Search Title, Artist or Album..."))
+        self.search_entry.connect("search-changed", self._on_search_changed)
+        self.search_entry.connect("activate", lambda x: self._on_action_clicked(None, "play"))
+        main_box.append(self.search_entry)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_vexpand(True)
+        main_box.append(scrolled)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_item_setup)
+        factory.connect("bind", self._on_item_bind)
+
+        self.list_view = Gtk.ListView(model=self.selection_model, factory=factory)
+        self.list_view.add_css_class("navigation-sidebar")
+        self.list_view.connect("activate", lambda lv, pos: self._on_action_clicked(None, "play"))
+        scrolled.set_child(self.list_view)
+
+        button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        button_box.set_halign(Gtk.Align.END)
+        main_box.append(button_box)
+
+        cancel_button = Gtk.Button(label=_("Cancel"))
+        cancel_button.connect("clicked", lambda x: self.close())
+        button_box.append(cancel_button)
+
+        self.queue_button = Gtk.Button(label=_("Queue Song"))
+        self.queue_button.connect("clicked", self._on_action_clicked, "queue")
+        self.queue_button.set_sensitive(False)
+        button_box.append(self.queue_button)
+
+        self.play_button = Gtk.Button(label=_("Play Song"))
+        self.play_button.add_css_class("suggested-action")
+        self.play_button.connect("clicked", self._on_action_clicked, "play")
+        self.play_button.set_sensitive(False)
+        button_box.append(self.play_button)
+
+        self.selection_model.connect("selection-changed", self._on_selection_changed)
+        self._on_selection_changed(self.selection_model, 0, 0)
+
+    def _on_item_setup(self, factory, list_item):
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        box.set_margin_start(6)
+        box.set_margin_end(6)
+        box.set_margin_top(6)
+        box.set_margin_bottom(6)
+        box.set_can_focus(False)
+
+        title_label = Gtk.Label(xalign=0)
+        title_label.set_ellipsize(Pango.EllipsizeMode.END)
+        box.append(title_label)
+        list_item._title_label = title_label
+
+        details_label = Gtk.Label(xalign=0)
+        details_label.set_ellipsize(Pango.EllipsizeMode.END)
+        details_label.add_css_class("caption")
+        box.append(details_label)
+        list_item._details_label = details_label
+
+        list_item.set_child(box)
+
+    def _on_item_bind(self, factory, list_item):
+        song = list_item.get_item()
+        list_item._title_label.set_label(song.title)
+        list_item._details_label.set_label(f"{song.artist} — {song.album}")
+
+    def _on_search_changed(self, entry):
+        songs = self.library_manager.search_songs(entry.get_text(), MAX_RESULTS)
+        # One splice instead of a change signal per row
+        self.songs_store.splice(0, self.songs_store.get_n_items(), songs)
+        if songs:
+            self.selection_model.set_selected(0)
+
+    def _on_tracks_indexed(self, manager):
+        if self.search_entry.get_text():
+            self._on_search_changed(self.search_entry)
+
+    def _on_selection_changed(self, selection_model, position, n_items):
+        has_selection = selection_model.get_selected_item() is not None
+        self.play_button.set_sensitive(has_selection)
+        self.queue_button.set_sensitive(has_selection)
+
+    def _on_action_clicked(self, button, action):
+        song = self.selection_model.get_selected_item()
+        if song:
+            self.callback(action, song)
+            self.close()
+
+    def _on_close_request(self, window):
+        self.library_manager.disconnect(self._indexed_handler)
+        return False
@@ -1,7 +1,82 @@
 
+import math
+from array import array
+
 import gi
 from gi.repository import Gtk, Gdk, GObject
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class WaveformPyramid:
+    """
+    A waveform (linear levels 0..1) as a mipmap pyramid: each level holds
+    the min, max and mean square of pairs of entries of the level below,
+    down to a single entry. Any number of bars is served from the
+    coarsest level with at least that many entries, where every bar
+    covers one or two entries, so resampling costs O(bars) whatever the
+    length of the track. Array-backed, vectorized with NumPy when it is
+    installed. Levels are multiplied by scale as the bottom level is built.
+    """
+    def __init__(self, data, scale=1.0):
+        if numpy is not None:
+            level = numpy.asarray(data, dtype=numpy.float32)
+            if scale != 1.0:
+                level = level * numpy.float32(scale)
+            self.levels = [(level, level, level * level)]
+            while len(self.levels[-1][0]) > 1:
+                mins, maxs, squares = self.levels[-1]
+                if len(mins) % 2:
+                    # The last entry pairs with itself
+                    mins, maxs, squares = (numpy.append(a, a[-1]) for a in (mins, maxs, squares))
+                self.levels.append((numpy.minimum(mins[0::2], mins[1::2]),
+                                    numpy.maximum(maxs[0::2], maxs[1::2]),
+                                    (squares[0::2] + squares[1::2]) * 0.5))
+        else:
+            level = array('f', data) if scale == 1.0 else array('f', (x * scale for x in data))
+            self.levels = [(level, level, array('f', [x * x for x in level]))]
+            while len(self.levels[-1][0]) > 1:
+                mins, maxs, squares = self.levels[-1]
+                n = len(mins)
+                pairs = range(0, n, 2)
+                last = n - 1
+                self.levels.append((array('f', [min(mins[i], mins[min(i + 1, last)]) for i in pairs]),
+                                    array('f', [max(maxs[i], maxs[min(i + 1, last)]) for i in pairs]),
+                                    array('f', [(squares[i] + squares[min(i + 1, last)]) * 0.5 for i in pairs])))
+
+    def __len__(self):
+        return len(self.levels[0][0])
+
+    def _level_for(self, n_bars):
+        for level in reversed(self.levels):
+            if len(level[0]) >= n_bars:
+                return level
+        return self.levels[0]
+
+    def bars(self, n_bars):
+        """Returns (mins, maxs, rms) lists of n_bars values each."""
+        mins, maxs, squares = self._level_for(n_bars)
+        n = len(mins)
+        if numpy is not None:
+            index = numpy.arange(n_bars)
+            first = numpy.minimum(index * n // n_bars, n - 1)
+            last = numpy.maximum(first, numpy.minimum((index + 1) * n // n_bars, n) - 1)
+            # One or two entries per bar
+            rms = numpy.sqrt((squares[first] + squares[last]) * 0.5)
+            return (numpy.minimum(mins[first], mins[last]).tolist(),
+                    numpy.maximum(maxs[first], maxs[last]).tolist(), rms.tolist())
+        spans = []
+        for i in range(n_bars):
+            first = min(i * n // n_bars, n - 1)
+            spans.append((first, max(first, min((i + 1) * n // n_bars, n) - 1)))
+        return ([min(mins[a], mins[b]) for a, b in spans],
+                [max(maxs[a], maxs[b]) for a, b in spans],
+                [math.sqrt((squares[a] + squares[b]) * 0.5) for a, b in spans])
+
+
 class WaveformBar(Gtk.DrawingArea):
     """
     A custom widget that renders a pseudo-waveform using vertical bars.
@@ -16,7 +91,8 @@ class WaveformBar(Gtk.DrawingArea):
         self.seek_callback = seek_callback
         
         # Display parameters
-        self.metric_data = [] # The raw waveform data (linear 0..1)
+        self.pyramid = None # The normalized waveform data, see WaveformPyramid
+        self.filled = 1.0 # How much of the bar the data covers, while it is being analyzed
         self.n_bars = 60 # Default, will be dynamic based on width
         self.amplitudes = [] # Normalized localized amplitudes for display
         self._dirty_resample = True
@@ -51,10 +127,10 @@ class WaveformBar(Gtk.DrawingArea):
             self.n_bars = new_n_bars
             self._dirty_resample = True
 
-        if self.metric_data and self._dirty_resample:
+        if self.pyramid and self._dirty_resample:
             self._resample_data_to_bars()
             self._dirty_resample = False
-        elif not self.metric_data and len(self.amplitudes) != self.n_bars:
+        elif not self.pyramid and len(self.amplitudes) != self.n_bars:
             self.amplitudes = [0.0] * self.n_bars
 
         # Bar layout
@@ -91,53 +167,34 @@ class WaveformBar(Gtk.DrawingArea):
             cr.rectangle(x, y, actual_bar_width, bar_h)
         cr.fill()
 
-    def set_waveform_data(self, data):
-        """Sets the raw waveform data (list of floats 0..1)."""
-        # Normalize data to peak at 1.0
+    def set_waveform_data(self, data, expected=None):
+        """
+        Sets the raw waveform data (list of floats 0..1). While it is still
+        being analyzed, expected is the length the full waveform will have,
+        and data fills the bar from the left.
+        """
+        # Normalize data to peak at 1.0, as the pyramid is built
         if data:
             peak = max(data)
-            if peak > 0:
-                self.metric_data = [x / peak for x in data]
-            else:
-                 self.metric_data = data
+            self.pyramid = WaveformPyramid(data, 1.0 / peak if peak > 0 else 1.0)
+            self.filled = min(1.0, len(data) / expected) if expected else 1.0
         else:
-            self.metric_data = []
-        
+            self.pyramid = None
+            self.filled = 1.0
+
         self.queue_draw()
         self._dirty_resample = True
 
     def _resample_data_to_bars(self):
-        """Downsamples metric_data to len(self.amplitudes)."""
-        if not self.metric_data:
+        """Downsamples the waveform to self.n_bars amplitudes."""
+        if not self.pyramid:
             self.amplitudes = [0.0] * self.n_bars
             return
 
-        total_samples = len(self.metric_data)
-        
-        new_amps = []
-        for i in range(self.n_bars):
-            # Calculate range in original data
-            start_idx = int(i * total_samples / self.n_bars)
-            end_idx = int((i + 1) * total_samples / self.n_bars)
-            # Ensure at least one sample is picked if range is 0 (upsampling/nearest)
-            if end_idx <= start_idx:
-                end_idx = start_idx + 1
-            
-            # Clamp
-            start_idx = min(start_idx, total_samples - 1)
-            end_idx = min(end_idx, total_samples)
-            if start_idx == end_idx: # Should rarely happen now
-                 val = self.metric_data[start_idx] if start_idx < total_samples else 0.0
-            else:
-                 chunk = self.metric_data[start_idx:end_idx]
-                 val = sum(chunk) / len(chunk)
-            
-            # Boost it a bit visually
-            val = val * 1.5 
-            if val > 1.0: val = 1.0
-            
-            new_amps.append(val)
-        self.amplitudes = new_amps
+        n_filled = max(1, int(self.n_bars * self.filled))
+        _mins, _maxs, rms = self.pyramid.bars(n_filled)
+        # Boost it a bit visually
+        self.amplitudes = [min(1.0, value * 1.5) for value in rms] + [0.0] * (self.n_bars - n_filled)
 
     def set_fraction(self, fraction):
         self.fraction = max(0.0, min(1.0, fraction))
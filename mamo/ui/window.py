@@ -1,7 +1,6 @@
 
 import sys
 import threading
-import collections
 import os
 import random
 import subprocess
@@ -9,25 +8,38 @@ import tempfile
 import html
 import json
 import base64
-import mutagen
 import pathlib
 from urllib.parse import urlparse, unquote
-import hashlib
 
 import gi
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 gi.require_version('Gst', '1.0')
-gi.require_version('GstPbutils', '1.0')
-gi.require_version('GdkPixbuf', '2.0')
 
-from gi.repository import Gtk, Adw, Gio, GLib, GObject, Gst, GstPbutils, GdkPixbuf, Gdk, Pango
+from gi.repository import Gtk, Adw, Gio, GLib, GObject, Gst, Gdk, Pango
 
 from ..models import Song
 from ..library import LibraryManager
+from ..artstore import ArtStore, ArtCache
+from ..playlistmodel import PlaylistModel, SongRecord, PlaylistIndex, SpliceBatcher, ranges_of, SPLICE_CHUNK_SIZE
+from ..playlistformats import is_playlist_file, read_playlist, write_playlist
+from ..playlist import PlaylistJournal, song_entry, read_playlist_file, write_playlist_file
+from ..thumbnails import ThumbnailCache, COVER_SIZE
 from ..mpris import MprisManager
+from ..discovery import DiscoveryPool
+from ..metadata import MetadataService
+from ..waveform import WaveformAnalyzer, PRIORITY_CURRENT, WAVEFORM_INTERVAL
+from ..waveformcache import WaveformCache
+from ..cachemanager import CacheManager, DEFAULT_QUOTA
 from .widgets import WaveformBar
 from .browser import AlbumBrowser
+from .songsearch import SongSearchDialog
+
+# Songs after the playing one whose waveforms are analyzed before the rest
+UPCOMING_ANALYSES = 3
+# Scrolling settles for this long before the analysis queue is reordered (ms)
+REPRIORITIZE_DELAY = 250
+
 
 class MamoWindow(Adw.ApplicationWindow):
     PLAY_ICON = "media-playback-start-symbolic"
@@ -39,38 +51,58 @@ class MamoWindow(Adw.ApplicationWindow):
         self.current_song = None
         self._last_indicated_song = None
         self._auto_play_after_load = False
-        self._save_timer_id = None
         self._progress_timer_id = None
         self._waveform_push_ctr = 0
         self._is_switching = False
         self._playlist_file_path = os.path.expanduser("~/.config/mamo/playlist.json")
         self._settings_file_path = os.path.expanduser("~/.config/mamo/settings.json")
+        # Snapshot plus edit journal, so edits don't rewrite the whole playlist
+        self.playlist_journal = PlaylistJournal(self._playlist_file_path)
+        self._playlist_journal_attached = False
         self.duration_ns = 0 
-        self._waveform_cache_dir = os.path.expanduser("~/.cache/mamo/waveforms")
-        os.makedirs(self._waveform_cache_dir, exist_ok=True)
+        self.waveform_cache = WaveformCache(os.path.expanduser("~/.cache/mamo/waveforms"))
+        self.art_store = ArtStore(os.path.expanduser("~/.cache/mamo/art"))
+        self.thumbnails = ThumbnailCache(self.art_store, os.path.expanduser("~/.cache/mamo/thumbnails"))
+        self.art_store.add_references(self._playlist_art_hashes)
+        self._displayed_art_hash = None
         
         self._init_player()
         self._setup_actions()
         self._auto_play_after_load = False
-        self._external_art_cache = {} # dirpath -> GLib.Bytes
-        self._active_analysis_uris = set()
-        self._analysis_queue = collections.deque()
-        self._analysis_worker_running = False
         self._is_loading = False
         self.mpris = None
         self.library_manager = None
         
         self.library_path = os.path.expanduser("~/Music")
+        self.scan_workers = 0 # 0 picks the CPU count
+        self.scan_executor = "thread"
+        self.watch_library = True
+        self.analysis_workers = 0 # 0 picks the CPU count
+        self.cache_quota = DEFAULT_QUOTA
         self._load_settings()
 
-        self._library_cache_path = os.path.expanduser("~/.cache/mamo/library.json")
+        self.waveform_analyzer = WaveformAnalyzer(self.analysis_workers or None)
+        self.waveform_analyzer.connect("analyzed", self._on_waveform_analyzed)
+        self.waveform_analyzer.connect("partial", self._on_waveform_partial)
+
+        self._library_db_path = os.path.expanduser("~/.cache/mamo/library.db")
         
         def deferred_init():
             # Deferred MPRIS
             self.mpris = MprisManager(self)
             
             # Deferred Library Manager
-            self.library_manager = LibraryManager(self.library_path, self._library_cache_path)
+            self.library_manager = LibraryManager(self.library_path, self._library_db_path,
+                                                  self.art_store, self.thumbnails,
+                                                  scan_workers=self.scan_workers,
+                                                  scan_executor=self.scan_executor,
+                                                  watch=self.watch_library)
+
+            # Waveforms, thumbnails, cover art and metadata stay under the quota together
+            self.cache_manager = CacheManager([self.waveform_cache, self.thumbnails,
+                                               ArtCache(self.art_store), self.metadata.cache],
+                                              quota=self.cache_quota)
+            self.cache_manager.start()
             return False
 
         GLib.idle_add(deferred_init)
@@ -204,8 +236,13 @@ class MamoWindow(Adw.ApplicationWindow):
         play_album_button.connect("clicked", self._on_play_album_clicked)
         play_album_button.set_tooltip_text(_("Album Browser"))
 
+        play_song_button = Gtk.Button.new_from_icon_name("system-search-symbolic")
+        play_song_button.connect("clicked", self._on_play_song_clicked)
+        play_song_button.set_tooltip_text(_("Play Song"))
+
         header.pack_end(menu_button) 
         header.pack_end(play_album_button)
+        header.pack_end(play_song_button)
 
         song_info_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
         song_info_box.set_margin_start(12)
@@ -278,14 +315,28 @@ class MamoWindow(Adw.ApplicationWindow):
         playlist_container.append(scrolled_window)
 
         
-        self.playlist_store = Gio.ListStore(item_type=Song) 
+        # Holds compact records, Songs are made for the rows on screen
+        self.playlist_store = PlaylistModel()
+        # Song/URI -> position, so lookups don't scan the playlist
+        self.playlist_index = PlaylistIndex(self.playlist_store)
+        # Bulk additions go through here, a chunk per splice
+        self.playlist_batch = SpliceBatcher(self.playlist_store)
+        self.playlist_store.connect("items-changed", self._on_playlist_items_changed)
+        self._analysis_sweep_id = None
+
+        # Rows scrolled into view have their waveforms analyzed first
+        self._playlist_adjustment = scrolled_window.get_vadjustment()
+        self._playlist_adjustment.connect("value-changed", self._on_playlist_scrolled)
+        self._reprioritize_id = None
 
         factory = Gtk.SignalListItemFactory()
         factory.connect("setup", self._on_playlist_item_setup)
         factory.connect("bind", self._on_playlist_item_bind)
         factory.connect("unbind", self._on_playlist_item_unbind)
 
-        self.selection_model = Gtk.SingleSelection(model=self.playlist_store)
+        # Ctrl/Shift click select several rows; the first selected row is the
+        # one Next/Previous move from
+        self.selection_model = Gtk.MultiSelection(model=self.playlist_store)
         self.selection_model.connect("selection-changed", self._on_playlist_selection_changed)
         self.selection_model.connect("selection-changed", lambda *a: self._update_playback_controls_sensitivity())
         # Removed remaining time update signal
@@ -317,6 +368,7 @@ class MamoWindow(Adw.ApplicationWindow):
             self._load_playlist()
         else:
             print("Clear Playlist on Start is enabled. Starting empty.")
+            self._attach_playlist_journal(reset=True)
 
         self._update_viewport()
         self._update_song_display(None)
@@ -345,7 +397,7 @@ class MamoWindow(Adw.ApplicationWindow):
             return
 
         loop_all = self.action_group.get_action_state("loop_all").get_boolean()
-        current_pos = self.selection_model.get_selected()
+        current_pos = self._selected_position()
 
         if loop_all:
             self.prev_button.set_sensitive(True)
@@ -429,10 +481,14 @@ class MamoWindow(Adw.ApplicationWindow):
     def _init_player(self):
         """Initialize GStreamer player and discoverer."""
         
-        self.discoverer = GstPbutils.Discoverer.new(5 * Gst.SECOND) 
-        self.discoverer.connect("discovered", self._on_discoverer_discovered)
-        self.discoverer.connect("finished", self._on_discoverer_finished)
-        self.discoverer.start() 
+        # Files added to the playlist are read with mutagen (or from the
+        # cache); the rest are discovered a few at a time
+        self.metadata = MetadataService(os.path.expanduser("~/.cache/mamo/metadata.db"),
+                                        self.art_store, DiscoveryPool())
+        self.metadata.connect("resolved", self._on_metadata_resolved)
+        self.metadata.connect("progress", self._on_discovery_progress)
+        self.metadata.connect("finished", self._on_discovery_finished)
+        self._discovery_toast = None
 
         
         self.player = Gst.ElementFactory.make("playbin", "player")
@@ -479,8 +535,11 @@ class MamoWindow(Adw.ApplicationWindow):
         bus.add_signal_watch()
         bus.connect("message", self._on_player_message)
 
-    def play_uri(self, uri):
-        """Loads and starts playing a URI."""
+    def play_uri(self, uri, song=None):
+        """
+        Loads and starts playing a URI. Pass the playlist entry as song when
+        known, the same URI may be in the playlist more than once.
+        """
         if self._is_switching:
             print(f"play_uri: already switching, ignoring request for {uri}")
             return
@@ -495,12 +554,12 @@ class MamoWindow(Adw.ApplicationWindow):
             old_song = self.current_song
             
             self.current_song = None
-            n = self.playlist_store.get_n_items()
-            for i in range(n):
-                 song = self.playlist_store.get_item(i)
-                 if song.uri == uri:
-                     self.current_song = song
-                     break
+            if song is not None and self.playlist_index.position_of(song) is not None:
+                self.current_song = song
+            else:
+                position = self.playlist_index.first_position_of_uri(uri)
+                if position is not None:
+                    self.current_song = self.playlist_store.get_item(position)
             
             # Clear state of old song if it's different
             if old_song and old_song != self.current_song:
@@ -732,28 +791,32 @@ class MamoWindow(Adw.ApplicationWindow):
         if target_pos == Gtk.INVALID_LIST_POSITION:
             return False
 
-        # Find the source position
-        source_pos = -1
-        for i in range(self.playlist_store.get_n_items()):
-            if self.playlist_store.get_item(i) == song:
-                source_pos = i
-                break
-        
-        if source_pos == -1 or source_pos == target_pos:
+        source_pos = self.playlist_index.position_of(song)
+        if source_pos is None or source_pos == target_pos:
             return False
 
+        if self.selection_model.is_selected(source_pos):
+            # Dragging one of several selected rows moves all of them
+            ranges = self._selected_ranges()
+            if len(ranges) > 1 or ranges[0][1] > 1:
+                n_selected = sum(count for _start, count in ranges)
+                # Dropped below the source, the rows go after the target row
+                start = self.playlist_store.move_ranges(ranges, target_pos + 1 if target_pos > source_pos else target_pos)
+                self.selection_model.select_range(start, n_selected, True)
+                return True
+
         print(f"Moving song from {source_pos} to {target_pos}")
         
         # Move in the store
         # Optimization: remove and insert
         # We need to be careful with selection if we want to keep it
-        is_selected = self.selection_model.get_selected() == source_pos
+        is_selected = self._selected_position() == source_pos
         
         self.playlist_store.remove(source_pos)
         self.playlist_store.insert(target_pos, song)
         
         if is_selected:
-            self.selection_model.set_selected(target_pos)
+            self._select_position(target_pos)
             
         return True
 
@@ -788,9 +851,9 @@ class MamoWindow(Adw.ApplicationWindow):
         # Update selection to this row if not already selected
         row_pos = list_item.get_position()
         if row_pos != Gtk.INVALID_LIST_POSITION:
-             # Only select if not already part of a multi-selection (if we supported that)
-             # SInce single selection, just select it.
-             self.selection_model.set_selected(row_pos)
+             # Keep a multi-selection the row is part of, the menu acts on all of it
+             if not self.selection_model.is_selected(row_pos):
+                 self._select_position(row_pos)
 
         menu = Gio.Menu()
         menu.append(_("Remove from Playlist"), "win.remove_selected_song")
@@ -817,11 +880,29 @@ class MamoWindow(Adw.ApplicationWindow):
         popover.set_parent(list_item.get_child()) 
         popover.popup()
         
+    def _selected_position(self):
+        """Returns the first selected position, or Gtk.INVALID_LIST_POSITION."""
+        # The minimum of an empty bitset is G_MAXUINT, i.e. INVALID_LIST_POSITION
+        return self.selection_model.get_selection().get_minimum()
+
+    def _select_position(self, position):
+        """Selects just this row."""
+        self.selection_model.select_item(position, True)
+
+    def _selected_ranges(self):
+        """Returns the selection as sorted (start, count) ranges."""
+        selection = self.selection_model.get_selection()
+        return ranges_of(selection.get_nth(i) for i in range(selection.get_size()))
+
     def _on_remove_selected_song_action(self, action, param):
-        """Removes the currently selected song from the playlist."""
-        selected_pos = self.selection_model.get_selected()
-        if selected_pos != Gtk.INVALID_LIST_POSITION:
-            self.playlist_store.remove(selected_pos)
+        """Removes the selected songs from the playlist, a splice per run of rows."""
+        ranges = self._selected_ranges()
+        if ranges:
+            self.playlist_store.remove_ranges(ranges)
+            n_items = self.playlist_store.get_n_items()
+            if n_items:
+                # Keep a row selected where the first removed one was
+                self._select_position(min(ranges[0][0], n_items - 1))
             
             # If we removed the playing song, stop playback?
             # Or just let it finish? Usually safer to stop or handle gracefully.
@@ -829,8 +910,20 @@ class MamoWindow(Adw.ApplicationWindow):
             if not self.current_song and self.playlist_store.get_n_items() == 0:
                 self._stop_playback()
 
+    def _move_selected(self, offset):
+        """Moves each run of selected rows up (-1) or down (+1) by one row."""
+        ranges = self._selected_ranges()
+        if not ranges:
+            return
+        selected = Gtk.Bitset.new_empty()
+        for start, count in self.playlist_store.shift_ranges(ranges, offset):
+            selected.add_range(start, count)
+        self.selection_model.set_selection(selected, Gtk.Bitset.new_range(0, self.playlist_store.get_n_items()))
+
     def _on_clear_playlist_action(self, action, param):
         """Clears the entire playlist."""
+        self.metadata.cancel_all()
+        self.playlist_batch.cancel()
         self.playlist_store.remove_all()
         self._stop_playback()
 
@@ -848,25 +941,21 @@ class MamoWindow(Adw.ApplicationWindow):
         # Single click selects
         # Double click plays
         
-        current_selection = self.selection_model.get_selected()
-        clicked_pos = -1
-        
-        # Find position of this song
-        n = self.playlist_store.get_n_items()
-        for i in range(n):
-            if self.playlist_store.get_item(i) == song:
-                clicked_pos = i
-                break
-        
-        if clicked_pos != -1:
-             # Always update selection on click
-             if clicked_pos != current_selection:
-                 self.selection_model.set_selected(clicked_pos)
+        clicked_pos = self.playlist_index.position_of(song)
+        if clicked_pos is not None:
+             # Ctrl/Shift clicks extend the selection, the list view handles those
+             modifiers = gesture.get_current_event_state() & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK)
+             if modifiers:
+                 return
+             # A click on a row of a multi-selection keeps it, for dragging them
+             if not self.selection_model.is_selected(clicked_pos):
+                 self._select_position(clicked_pos)
              
              # Only play purely on double click
              if n_press == 2:
                  print(f"Double click on row: {song.title}. Playing.")
-                 self.play_uri(song.uri)
+                 self._select_position(clicked_pos)
+                 self.play_uri(song.uri, song)
 
     def _on_playlist_selection_changed(self, selection_model, position, n_items):
         """Handle selection change."""
@@ -881,12 +970,15 @@ class MamoWindow(Adw.ApplicationWindow):
         if keyval == Gdk.KEY_Delete:
              self.action_group.activate_action("remove_selected_song", None)
              return True
+        elif state & Gdk.ModifierType.ALT_MASK and keyval in (Gdk.KEY_Up, Gdk.KEY_Down):
+             self._move_selected(-1 if keyval == Gdk.KEY_Up else 1)
+             return True
         elif keyval == Gdk.KEY_Return or keyval == Gdk.KEY_KP_Enter:
-             selected_pos = self.selection_model.get_selected()
+             selected_pos = self._selected_position()
              if selected_pos != Gtk.INVALID_LIST_POSITION:
                  song = self.playlist_store.get_item(selected_pos)
                  if song and song.uri:
-                     self.play_uri(song.uri)
+                     self.play_uri(song.uri, song)
                  return True
         return False
 
@@ -895,6 +987,22 @@ class MamoWindow(Adw.ApplicationWindow):
         browser = AlbumBrowser(self, self.library_manager, self._on_album_browser_selection)
         browser.present()
 
+    def _on_play_song_clicked(self, button):
+        """Opens the Play Song dialog."""
+        dialog = SongSearchDialog(self, self.library_manager, self._on_song_search_selection)
+        dialog.present()
+
+    def _on_song_search_selection(self, command, song):
+        """Callback from the Play Song dialog, adds the song to the playlist."""
+        # Songs still being added from an album go first
+        self.playlist_batch.flush()
+        self.playlist_store.append(song)
+        if command == "play":
+            self._select_position(self.playlist_store.get_n_items() - 1)
+            self.play_uri(song.uri, song)
+        elif not self.current_song:
+            self._select_position(0)
+
     def _on_album_browser_selection(self, command, data):
         """Callback from Album Browser."""
         if command == "play":
@@ -902,44 +1010,63 @@ class MamoWindow(Adw.ApplicationWindow):
             songs = self.library_manager.get_album_songs(album)
             if songs:
                 # Replace playlist
-                self.playlist_store.remove_all()
-                for s in songs:
-                    self.playlist_store.append(s)
+                self.playlist_batch.replace(songs)
                 
-                self.selection_model.set_selected(0)
+                self._select_position(0)
                 # Playback starts via selection-changed but if 0 was already selected (e.g. from previous playlist of same size?), 
                 # or if playing stopped, selection-changed might not fire or might think nothing changed.
                 # Explicitly play the first song to be sure.
                 if len(songs) > 0:
-                    self.play_uri(songs[0].uri)
+                    self.play_uri(songs[0].uri, songs[0])
 
         elif command == "play_all_albums":
-             # Play all albums (add all known songs?)
-             # Assuming 'data' is irrelevant or None
-             # This could be implemented to shuffle all songs.
-             all_songs = self.library_manager.get_all_songs()
-             random.shuffle(all_songs) # Basic shuffle
-             
-             self.playlist_store.remove_all()
-             for s in all_songs:
-                 self.playlist_store.append(s)
-             self.selection_model.set_selected(0)
-             if len(all_songs) > 0:
-                  self.play_uri(all_songs[0].uri)
+             # Every album, in random order. The first one is read now and
+             # starts playing; the rest follow from a background thread.
+             albums = list(self.library_manager.albums)
+             random.shuffle(albums)
+             first_songs = []
+             while albums and not first_songs:
+                 first_songs = self.library_manager.get_album_songs(albums.pop(0))
+             if not first_songs:
+                 return
+
+             self.playlist_batch.replace(first_songs)
+             self._select_position(0)
+             self.play_uri(first_songs[0].uri, first_songs[0])
+             if albums:
+                 threading.Thread(target=self._stream_albums_thread,
+                                  args=(albums, self.playlist_batch.generation), daemon=True).start()
         
         elif command == "queue":
             album = data
             songs = self.library_manager.get_album_songs(album)
             if songs:
-                for s in songs:
-                    self.playlist_store.append(s)
+                self.playlist_batch.extend(songs)
             
             # If playlist was empty, this might trigger something?
             # If nothing playing, maybe start?
             if not self.current_song and self.playlist_store.get_n_items() > 0:
-                 self.selection_model.set_selected(0)
+                 self._select_position(0)
 
 
+    def _stream_albums_thread(self, albums, generation):
+        """Reads the songs of albums and queues them in chunks, until the playlist is replaced."""
+        chunk = []
+        for _album, records in self.library_manager.iter_album_records(albums):
+            if self.playlist_batch.generation != generation:
+                return
+            chunk.extend(records)
+            if len(chunk) >= self.playlist_batch.chunk_size:
+                GLib.idle_add(self._on_streamed_records, chunk, generation)
+                chunk = []
+        if chunk:
+            GLib.idle_add(self._on_streamed_records, chunk, generation)
+
+    def _on_streamed_records(self, records, generation):
+        if self.playlist_batch.generation == generation:
+            self.playlist_batch.extend(records)
+        return False
+
     def _on_add_clicked(self, button):
         """Trigger 'add folder' action."""
         self.action_group.activate_action("add_folder_new", None)
@@ -979,7 +1106,7 @@ class MamoWindow(Adw.ApplicationWindow):
     def _discover_and_add_uri(self, uri):
         """Starts discovery for a URI to add it to the playlist."""
         if not uri: return
-        self.discoverer.discover_uri_async(uri)
+        self.metadata.add([uri])
 
     def _start_folder_scan(self, folder_file):
         """Recursively scans a folder for audio files and adds them."""
@@ -1014,115 +1141,63 @@ class MamoWindow(Adw.ApplicationWindow):
         except Exception as e:
             print(f"Error scanning folder {root_path}: {e}")
 
-        # Now discover them
-        # Note: discoverer is async. We can just fire them all off.
-        # But thousands might choke it.
-        # Let's schedule them on main thread.
+        # Now resolve them in the background
         GLib.idle_add(self._schedule_discoveries, found_uris)
 
     def _schedule_discoveries(self, uris):
         """Schedules discovery for a list of URIs."""
-        for uri in uris:
-            self.discoverer.discover_uri_async(uri)
+        self.metadata.add(uris)
         return False
 
-    def _on_discoverer_finished(self, discoverer):
-        """Called when discoverer has finished (all processing?). No, for each?"""
-        # Verify signal signature.
-        pass
-
-    def _on_discoverer_discovered(self, discoverer, info, error):
-        """Called when a URI has been discovered."""
-        if error:
-            print(f"Discovery error for {info.get_uri()}: {error.message}", file=sys.stderr)
+    def _on_discovery_progress(self, service, done, total, eta):
+        """Shows how far adding files has got in a toast that stays up until done."""
+        if total < 2:
             return
-
-        uri = info.get_uri()
-        duration_ns = info.get_duration()
-        tags = info.get_tags()
-
-        title = "Unknown Title"
-        artist = "Unknown Artist"
-        album = "Unknown Album"
-        
-        # Initial guess from filename
-        # ... (simplified)
-        
-        if tags:
-             # GstTagList
-             # We need to extract strings.
-             # Helper to get string:
-             def get_tag_str(tag_name):
-                 res, val = tags.get_string(tag_name)
-                 return val if res else None
-
-             t = get_tag_str(Gst.TAG_TITLE)
-             if t: title = t
-             
-             a = get_tag_str(Gst.TAG_ARTIST)
-             if a: artist = a
-             
-             alb = get_tag_str(Gst.TAG_ALBUM)
-             if alb: album = alb
-             
-        # Fallback to filename if "Unknown"
-        if title == "Unknown Title":
-            p = unquote(urlparse(uri).path)
-            title = os.path.splitext(os.path.basename(p))[0]
-
-        # Extract Album Art?
-        # Discoverer might provide it via tags 'image' or 'preview-image'
-        # But usually we need to extract from file manually or via existing cache.
-        # We'll let the Song object handle it or do it lazily.
-        # Or checking external files.
-        # For drag/drop files, we don't have them in LibraryManager cache necessarily.
-        
-        # Check external art cache (populated by _scan_for_external_art if we did that)
-        # We haven't implemented comprehensive art scan for added files here.
-        # Let's try basic extraction if we have time, but better to just add item.
-        # Models.Song handles lazy loading? No, it expects bytes in constructor or property.
-        
-        # Try to find art in the directory?
-        # Try to find art in the directory?
-        path = self._uri_to_path(uri)
-        art_bytes = None
-        if path:
-             # Check if we have cached art for this folder
-             folder = os.path.dirname(path)
-             if folder in self._external_art_cache:
-                 art_bytes = self._external_art_cache[folder]
-             else:
-                 # Try to find cover.jpg etc
-                 found_path = self._find_cover_in_folder(folder)
-                 if found_path:
-                     try:
-                         # Load into GLib.Bytes
-                         with open(found_path, "rb") as f:
-                             data = f.read()
-                             art_bytes = GLib.Bytes.new(data)
-                             self._external_art_cache[folder] = art_bytes
-                     except Exception as e:
-                         print(f"Error loading external artwork {found_path}: {e}")
-
-        # If no folder art found, try embedded art
-        if not art_bytes:
-             art_bytes = LibraryManager.detect_embedded_art(path)
-
-        song = Song(uri=uri, title=title, artist=artist, album=album, duration=duration_ns)
-        if art_bytes:
-            song.album_art_data = art_bytes
-        
-        # Add to playlist
-        self.playlist_store.append(song)
-        
-        # Trigger waveform analysis
-        self._start_waveform_analysis(song)
-        
-        # If this was the first song and auto-play is on
-        if self._auto_play_after_load and self.playlist_store.get_n_items() == 1:
-            self.selection_model.set_selected(0)
-            self.play_uri(song.uri)
+        title = _("Adding songs: {done} of {total}").format(done=done, total=total)
+        if eta >= 60:
+            title += " " + _("(about {n} min left)").format(n=round(eta / 60))
+        elif eta >= 0 and done < total:
+            title += " " + _("(about {n} s left)").format(n=max(1, round(eta)))
+        if self._discovery_toast is None:
+            toast = Adw.Toast.new(title)
+            toast.set_timeout(0)
+            toast.set_button_label(_("Cancel"))
+            toast.connect("button-clicked", lambda t: self.metadata.cancel_all())
+            toast.connect("dismissed", self._on_discovery_toast_dismissed)
+            self._discovery_toast = toast
+            self.toast_overlay.add_toast(toast)
+        else:
+            self._discovery_toast.set_title(title)
+
+    def _on_discovery_toast_dismissed(self, toast):
+        if self._discovery_toast is toast:
+            self._discovery_toast = None
+
+    def _on_discovery_finished(self, service):
+        if self._discovery_toast:
+            self._discovery_toast.dismiss()
+
+    def _on_metadata_resolved(self, service, results):
+        """Called with (uri, FileMetadata) for files being added to the playlist."""
+        songs = []
+        for uri, metadata in results:
+            song = Song(uri=uri, title=metadata.title, artist=metadata.artist, album=metadata.album,
+                        duration=metadata.duration)
+            if metadata.art_hash:
+                song.album_art_hash = metadata.art_hash
+            # Trigger waveform analysis
+            self._start_waveform_analysis(song)
+            songs.append(song)
+
+        # If this is the first song and auto-play is on, add it right away
+        if self._auto_play_after_load and self.playlist_store.get_n_items() == 0 and not self.playlist_batch:
+            song = songs.pop(0)
+            self.playlist_batch.extend([song])
+            self._select_position(0)
+            self.play_uri(song.uri, song)
             self._auto_play_after_load = False
+        # Songs resolved in a burst (a dropped folder) are added together
+        self.playlist_batch.extend(songs, defer=True)
 
     def _on_player_message(self, bus, message):
         """Handles messages from the GStreamer bus."""
@@ -1196,8 +1271,10 @@ class MamoWindow(Adw.ApplicationWindow):
              self._last_indicated_song = None
 
         if song:
-            # Ensure background analysis starts if missing
-            self._start_waveform_analysis(song)
+            # Ensure background analysis starts if missing, ahead of everything else
+            self.waveform_analyzer.watch(song.uri)
+            self._start_waveform_analysis(song, PRIORITY_CURRENT)
+            self._reprioritize_analysis()
             
             self.song_label.set_label(song.title)
             self.song_label.set_tooltip_text(song.title)
@@ -1219,43 +1296,31 @@ class MamoWindow(Adw.ApplicationWindow):
             self.time_label_remaining.set_label("--:--")
 
             
-            glib_bytes_data = song.album_art_data
-            pixbuf = None
-            
-            if glib_bytes_data:
-                raw_bytes_data = glib_bytes_data.get_data() 
-                try:
-                    loader = GdkPixbuf.PixbufLoader()
-                    loader.write(raw_bytes_data)
-                    loader.close()
-                    pixbuf = loader.get_pixbuf()
-                    
-                    scaled_pixbuf = pixbuf.scale_simple(320, 320, GdkPixbuf.InterpType.HYPER)
-                    self.cover_image.set_from_pixbuf(scaled_pixbuf)
-                    
-                except Exception as e:
-                    print(f"Error loading album art in _update_song_display for '{song.title}': {e}", file=sys.stderr)
-                    # Already set to generic icon above
-            else:
+            # Cover comes from the pre-scaled thumbnail cache, loaded off the main thread
+            art_hash = song.album_art_hash
+            self._displayed_art_hash = art_hash
+            cached = self.thumbnails.lookup(art_hash, COVER_SIZE) if art_hash else None
+            if cached:
+                self._apply_cover_art(*cached)
+            elif art_hash:
                 self.cover_image.set_from_icon_name("audio-x-generic-symbolic")
+                def on_cover_loaded(texture, rgb):
+                    if self._displayed_art_hash == art_hash:
+                        self._apply_cover_art(texture, rgb)
+                self.thumbnails.request(art_hash, COVER_SIZE, on_cover_loaded)
+            else:
+                self._apply_cover_art(None, None)
             
+            if not song.waveform_data:
+                song.waveform_data = self.waveform_cache.get(song.uri)
             if song.waveform_data:
                 self.waveform.set_waveform_data(song.waveform_data)
             else:
                 self.waveform.set_waveform_data([])
             
-            # Apply dynamic tint if enabled
-            if self.action_group.get_action_state("album_tinting").get_boolean() and glib_bytes_data:
-                try:
-                    # Reuse pixbuf from above for efficiency
-                    self._update_dynamic_tint(pixbuf)
-                except Exception as tint_e:
-                    print(f"Error applying tint: {tint_e}", file=sys.stderr)
-                    self._clear_dynamic_tint()
-            else:
-                self._clear_dynamic_tint()
-            
         else:
+            self.waveform_analyzer.watch(None)
+            self._displayed_art_hash = None
             self.set_title("Mamo")
             self._clear_dynamic_tint()
             
@@ -1268,20 +1333,25 @@ class MamoWindow(Adw.ApplicationWindow):
             self.waveform.set_waveform_data([])
             self._clear_dynamic_tint()
 
-    def _update_dynamic_tint(self, pixbuf):
-        """Extracts average color from pixbuf and applies it as a background tint."""
-        if not pixbuf:
+    def _apply_cover_art(self, texture, rgb):
+        """Shows a loaded cover texture and applies the tint if enabled."""
+        if texture:
+            self.cover_image.set_from_paintable(texture)
+        else:
+            self.cover_image.set_from_icon_name("audio-x-generic-symbolic")
+
+        if self.action_group.get_action_state("album_tinting").get_boolean() and texture and rgb:
+            self._update_dynamic_tint(rgb)
+        else:
             self._clear_dynamic_tint()
-            return
 
-        # Scale to 1x1 to get average RGB
-        small = pixbuf.scale_simple(1, 1, GdkPixbuf.InterpType.BILINEAR)
-        pixels = small.get_pixels()
-        if not pixels or len(pixels) < 3:
+    def _update_dynamic_tint(self, rgb):
+        """Applies the cover's average color (r, g, b) as a background tint."""
+        if not rgb:
             self._clear_dynamic_tint()
             return
-            
-        r, g, b = pixels[0], pixels[1], pixels[2]
+
+        r, g, b = rgb
         
         # Apply subtle tint (0.15 alpha for active, 0.07 for backdrop)
         # Use CSS transitions for smoothness, synchronized between both classes
@@ -1341,146 +1411,82 @@ class MamoWindow(Adw.ApplicationWindow):
         if hasattr(self, 'waveform'):
              self.waveform.set_active_color(None)
 
-    def _start_waveform_analysis(self, song):
-        """Adds a song to the background analysis queue."""
-        if song.waveform_data or song.uri in self._active_analysis_uris:
+    def _start_waveform_analysis(self, song, priority=None):
+        """Adds a song to the background analysis queue, at the back unless given a priority."""
+        if song.waveform_data or song.uri in self.waveform_analyzer:
             return
 
         # Check cache first
-        cached_data = self._load_waveform_from_cache(song)
+        cached_data = self.waveform_cache.get(song.uri)
         if cached_data:
             song.waveform_data = cached_data
             if self.current_song == song:
                 GLib.idle_add(lambda: self.waveform.set_waveform_data(song.waveform_data))
             return
-            
-        self._active_analysis_uris.add(song.uri)
-        self._analysis_queue.append(song)
-        
-        if not self._analysis_worker_running:
-            self._analysis_worker_running = True
-            thread = threading.Thread(target=self._analysis_worker_loop, daemon=True)
-            thread.start()
-
-    def _analysis_worker_loop(self):
-        """Worker thread that processes the analysis queue one by one."""
-        while self._analysis_queue:
-            song = self._analysis_queue.popleft()
-            try:
-                self._analyze_waveform_thread(song)
-            except Exception as e:
-                print(f"Analysis worker error: {e}")
-        self._analysis_worker_running = False
-
-    def _analyze_waveform_thread(self, song):
-        """Background thread to scan the audio file and generate waveform data."""
-        uri = song.uri
-        # Use uridecodebin and level for fast scanning. 50ms interval for good detail.
-        pipeline_str = f"uridecodebin uri=\"{uri}\" ! audioconvert ! level interval=50000000 post-messages=true ! fakesink"
-        try:
-            pipeline = Gst.parse_launch(pipeline_str)
-            if not pipeline:
-                print(f"Failed to create analysis pipeline for {uri}")
-                self._active_analysis_uris.discard(uri)
-                return
 
-            bus = pipeline.get_bus()
-            pipeline.set_state(Gst.State.PLAYING)
-            
-            waveform_data = []
-            
-            while True:
-                msg = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, 
-                                           Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.ELEMENT)
-                if not msg:
-                    break
-                
-                t = msg.type
-                if t == Gst.MessageType.EOS:
-                    break
-                elif t == Gst.MessageType.ERROR:
-                    err, dbg = msg.parse_error()
-                    print(f"Waveform Analysis Error for {uri}: {err.message}")
-                    break
-                elif t == Gst.MessageType.ELEMENT:
-                    struct = msg.get_structure()
-                    if struct and struct.get_name() == "level":
-                        rms_list = struct.get_value("rms")
-                        if rms_list:
-                            avg_db = sum(rms_list) / len(rms_list)
-                            linear = pow(10, avg_db / 20.0)
-                            waveform_data.append(linear)
-            
-            pipeline.set_state(Gst.State.NULL)
-            
-            if waveform_data:
-                song.waveform_data = waveform_data
-                GLib.idle_add(self._on_waveform_analysis_finished, song)
-            
-            self._active_analysis_uris.discard(uri)
-                
-        except Exception as e:
-            print(f"Unexpected error in waveform analysis for {uri}: {e}")
-            if hasattr(self, "_active_analysis_uris"):
-                self._active_analysis_uris.discard(uri)
+        if priority is None:
+            self.waveform_analyzer.add(song.uri)
+        else:
+            self.waveform_analyzer.add(song.uri, priority)
 
-    def _on_waveform_analysis_finished(self, song):
-        """Triggered on main thread when analysis is done."""
-        if song.waveform_data:
-            self._save_waveform_to_cache(song, song.waveform_data)
-
-        if self.current_song == song:
-            self.waveform.set_waveform_data(song.waveform_data)
-        self._schedule_playlist_save()
-
-    def _schedule_playlist_save(self):
-        """Schedules a playlist save with debouncing (2 seconds)."""
-        if self._save_timer_id is not None:
-            GLib.source_remove(self._save_timer_id)
-        self._save_timer_id = GLib.timeout_add_seconds(2, self._debounced_save)
-
-    def _debounced_save(self):
-        """Timer callback to perform the actual save."""
-        self._save_timer_id = None
-        self._save_playlist()
+    def _on_waveform_partial(self, analyzer, uri, data):
+        """Shows the playing song's waveform as far as it has been analyzed."""
+        song = self.current_song
+        if not song or song.uri != uri or song.waveform_data:
+            return
+        duration = song.duration or self.duration_ns
+        expected = None
+        if duration and 0 < duration != Gst.CLOCK_TIME_NONE:
+            expected = duration // WAVEFORM_INTERVAL + 1
+        self.waveform.set_waveform_data(data, expected)
+
+    def _reprioritize_analysis(self):
+        """Puts the playing song, the next few and the rows on screen first in the analysis queue."""
+        self._reprioritize_id = None
+        current = self.current_song.uri if self.current_song else None
+        upcoming = []
+        position = self.playlist_index.position_of(self.current_song) if self.current_song else None
+        if position is not None:
+            upcoming = [record.uri for record in self.playlist_store.get_records(position + 1, UPCOMING_ANALYSES)]
+
+        visible = []
+        n_items = self.playlist_store.get_n_items()
+        adjustment = self._playlist_adjustment
+        if n_items and adjustment.get_upper() > 0:
+            # Rows are all the same height
+            row_height = adjustment.get_upper() / n_items
+            first = int(adjustment.get_value() / row_height)
+            last = min(n_items, int((adjustment.get_value() + adjustment.get_page_size()) / row_height) + 1)
+            visible = [record.uri for record in self.playlist_store.get_records(first, max(0, last - first))]
+
+        self.waveform_analyzer.prioritize(current, upcoming, visible)
         return False
 
-    def _get_song_hash(self, song):
-        """Generates a SHA256 hash for the song URI to use as a cache key."""
-        return hashlib.sha256(song.uri.encode('utf-8')).hexdigest()
+    def _on_playlist_scrolled(self, adjustment):
+        if self._reprioritize_id is None:
+            self._reprioritize_id = GLib.timeout_add(REPRIORITIZE_DELAY, self._reprioritize_analysis)
 
-    def _load_waveform_from_cache(self, song):
-        """Attempts to load waveform data from the disk cache."""
-        song_hash = self._get_song_hash(song)
-        cache_path = os.path.join(self._waveform_cache_dir, f"{song_hash}.json")
-        
-        if os.path.exists(cache_path):
-            try:
-                with open(cache_path, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading waveform cache for {song.uri}: {e}")
-        return None
+    def _on_playlist_items_changed(self, model, position, removed, added):
+        # Removed rows don't need their waveforms anymore
+        if removed and self._analysis_sweep_id is None:
+            self._analysis_sweep_id = GLib.idle_add(self._cancel_removed_analyses)
 
-    def _save_waveform_to_cache(self, song, data):
-        """Saves waveform data to the disk cache."""
-        if not data:
-            return
-        song_hash = self._get_song_hash(song)
-        cache_path = os.path.join(self._waveform_cache_dir, f"{song_hash}.json")
-        try:
-            with open(cache_path, 'w') as f:
-                json.dump(data, f)
-        except Exception as e:
-            print(f"Error saving waveform cache for {song.uri}: {e}")
+    def _cancel_removed_analyses(self):
+        """Cancels the analyses of URIs no longer in the playlist (or on their way in)."""
+        self._analysis_sweep_id = None
+        wanted = {song.uri for song in self.playlist_batch}
+        if self.current_song:
+            wanted.add(self.current_song.uri)
+        self.waveform_analyzer.retain(lambda uri: uri in wanted or self.playlist_index.contains_uri(uri))
+        return False
 
+    def _on_waveform_analyzed(self, analyzer, uri, data):
+        """Triggered on main thread when analysis is done."""
+        self.waveform_cache.put(uri, data)
 
-    
-    
-    
-
-    
-    
+        if self.current_song and self.current_song.uri == uri:
+            self.current_song.waveform_data = data
+            self.waveform.set_waveform_data(data)
 
     def _update_progress(self):
         """Timer callback to update playback progress."""
@@ -1552,7 +1558,7 @@ class MamoWindow(Adw.ApplicationWindow):
             self.player.seek_simple(Gst.Format.TIME, seek_flags, 0)
         else:
             print("Previous: Selecting previous track.")
-            current_pos = self.selection_model.get_selected()
+            current_pos = self._selected_position()
             n_items = self.playlist_store.get_n_items()
             if n_items == 0: return
 
@@ -1565,10 +1571,10 @@ class MamoWindow(Adw.ApplicationWindow):
                     new_pos = n_items - 1
             
             if new_pos != Gtk.INVALID_LIST_POSITION:
-                self.selection_model.set_selected(new_pos)
+                self._select_position(new_pos)
                 song = self.playlist_store.get_item(new_pos)
                 if song and song.uri:
-                    self.play_uri(song.uri)
+                    self.play_uri(song.uri, song)
             
 
     def _on_next_clicked(self, button=None): 
@@ -1577,7 +1583,7 @@ class MamoWindow(Adw.ApplicationWindow):
         n_items = self.playlist_store.get_n_items()
         if n_items == 0: return 
 
-        current_pos = self.selection_model.get_selected()
+        current_pos = self._selected_position()
         new_pos = Gtk.INVALID_LIST_POSITION
 
         if current_pos != Gtk.INVALID_LIST_POSITION and current_pos < (n_items - 1):
@@ -1590,10 +1596,10 @@ class MamoWindow(Adw.ApplicationWindow):
                 print("End of playlist reached, loop_all is OFF.")
         
         if new_pos != Gtk.INVALID_LIST_POSITION:
-            self.selection_model.set_selected(new_pos)
+            self._select_position(new_pos)
             song = self.playlist_store.get_item(new_pos)
             if song and song.uri:
-                self.play_uri(song.uri)
+                self.play_uri(song.uri, song)
         
 
     
@@ -1605,9 +1611,10 @@ class MamoWindow(Adw.ApplicationWindow):
 
         
         json_filter = Gtk.FileFilter.new()
-        json_filter.set_name("Playlist Files (*.json)")
+        json_filter.set_name("Playlist Files (*.json, *.m3u, *.m3u8, *.pls, *.xspf)")
         json_filter.add_mime_type("application/json")
-        json_filter.add_pattern("*.json")
+        for pattern in ("*.json", "*.m3u", "*.m3u8", "*.pls", "*.xspf"):
+            json_filter.add_pattern(pattern)
 
         
         filters = Gio.ListStore.new(Gtk.FileFilter)
@@ -1625,8 +1632,12 @@ class MamoWindow(Adw.ApplicationWindow):
                 filepath = gio_file.get_path()
                 print(f"Opening playlist from: {filepath}")
                 
+                self.playlist_batch.cancel()
                 self.playlist_store.remove_all()
-                self._load_playlist(filepath=filepath)
+                if is_playlist_file(filepath):
+                    self._import_playlist(filepath)
+                else:
+                    self._load_playlist(filepath=filepath)
         except GLib.Error as e:
             if e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
                 print("Open playlist cancelled.")
@@ -1647,8 +1658,15 @@ class MamoWindow(Adw.ApplicationWindow):
         json_filter.add_mime_type("application/json")
         json_filter.add_pattern("*.json")
 
+        # Saved in the format the file name's extension says
+        other_filter = Gtk.FileFilter.new()
+        other_filter.set_name("Other Players (*.m3u, *.m3u8, *.pls, *.xspf)")
+        for pattern in ("*.m3u", "*.m3u8", "*.pls", "*.xspf"):
+            other_filter.add_pattern(pattern)
+
         filters = Gio.ListStore.new(Gtk.FileFilter)
         filters.append(json_filter)
+        filters.append(other_filter)
         dialog.set_filters(filters)
         dialog.set_default_filter(json_filter)
 
@@ -1671,7 +1689,7 @@ class MamoWindow(Adw.ApplicationWindow):
             if gio_file:
                 filepath = gio_file.get_path()
                 
-                if not filepath.lower().endswith(".json"):
+                if not filepath.lower().endswith(".json") and not is_playlist_file(filepath):
                     filepath += ".json"
                     print(f"Appended .json extension. Saving to: {filepath}")
                 else:
@@ -1782,6 +1800,11 @@ class MamoWindow(Adw.ApplicationWindow):
                         la_action.change_state(GLib.Variant.new_boolean(loop_all_val))
 
                     self.library_path = settings.get("library_path", os.path.expanduser("~/Music"))
+                    self.scan_workers = settings.get("scan_workers", 0)
+                    self.scan_executor = settings.get("scan_executor", "thread")
+                    self.watch_library = settings.get("watch_library", True)
+                    self.analysis_workers = settings.get("analysis_workers", 0)
+                    self.cache_quota = settings.get("cache_quota", DEFAULT_QUOTA)
 
                     album_tinting = settings.get("album_tinting", True)
                     at_action = self.action_group.lookup_action("album_tinting")
@@ -1801,7 +1824,12 @@ class MamoWindow(Adw.ApplicationWindow):
             "repeat": self.action_group.get_action_state("repeat").get_boolean(),
             "loop_all": self.action_group.get_action_state("loop_all").get_boolean(),
             "album_tinting": self.action_group.get_action_state("album_tinting").get_boolean(),
-            "library_path": self.library_path
+            "library_path": self.library_path,
+            "scan_workers": self.scan_workers,
+            "scan_executor": self.scan_executor,
+            "watch_library": self.watch_library,
+            "analysis_workers": self.analysis_workers,
+            "cache_quota": self.cache_quota
         }
         try:
             with open(self._settings_file_path, 'w') as f:
@@ -1894,25 +1922,34 @@ class MamoWindow(Adw.ApplicationWindow):
             style_manager.set_color_scheme(Adw.ColorScheme.PREFER_LIGHT)
 
     def _load_playlist(self, filepath=None):
-        """Loads the playlist from a JSON file in a background thread."""
+        """
+        Loads a playlist file in a background thread. Without a filepath the
+        default playlist is restored from its snapshot and journal.
+        """
         path_to_use = filepath if filepath else self._playlist_file_path
 
-        if not os.path.exists(path_to_use):
-            if filepath: 
-                print(f"Error: Playlist file not found: {path_to_use}", file=sys.stderr)
-            else:
-                 print("Default playlist file not found, starting empty.")
+        if filepath and not os.path.exists(path_to_use):
+            print(f"Error: Playlist file not found: {path_to_use}", file=sys.stderr)
+            return
+        if not filepath and not (os.path.exists(path_to_use) or
+                                 os.path.exists(self.playlist_journal.journal_path)):
+            print("Default playlist file not found, starting empty.")
+            self._attach_playlist_journal()
             return
 
         self._is_loading = True
         self._update_viewport()
 
         def background_load():
-            songs_to_add = []
+            records = []
+            art_hashes_by_b64 = {}
+            loaded = False
             try:
                 print(f"Loading playlist from: {path_to_use}")
-                with open(path_to_use, 'r') as f:
-                    playlist_data = json.load(f)
+                if filepath:
+                    playlist_data, _generation = read_playlist_file(path_to_use)
+                else:
+                    playlist_data = self.playlist_journal.load()
 
                 if isinstance(playlist_data, list):
                     for item in playlist_data:
@@ -1921,41 +1958,119 @@ class MamoWindow(Adw.ApplicationWindow):
                             if not isinstance(duration_ns_loaded, int) or duration_ns_loaded < 0:
                                 duration_ns_loaded = 0
 
-                            album_art_glib_bytes = None
+                            art_hash = item.get('art_hash')
                             album_art_b64 = item.get('album_art_b64')
-                            if album_art_b64:
-                                try:
-                                    decoded_bytes = base64.b64decode(album_art_b64)
-                                    album_art_glib_bytes = GLib.Bytes.new(decoded_bytes)
-                                except Exception: pass
-
-                            song = Song(uri=item.get('uri'),
-                                         title=item.get('title'),
-                                         artist=item.get('artist'),
-                                         duration=duration_ns_loaded)
-                            
-                            if album_art_glib_bytes:
-                                song.album_art_data = album_art_glib_bytes
-                            
-                            song.waveform_data = self._load_waveform_from_cache(song)
-                            if not song.waveform_data:
-                                song.waveform_data = item.get('waveform_data')
-                            
-                            songs_to_add.append(song)
+                            if not art_hash and album_art_b64:
+                                # Older playlists embed a copy of the art in every entry
+                                art_hash = art_hashes_by_b64.get(album_art_b64)
+                                if art_hash is None:
+                                    try:
+                                        art_hash = self.art_store.put(base64.b64decode(album_art_b64))
+                                    except Exception: pass
+                                    art_hashes_by_b64[album_art_b64] = art_hash
+
+                            # Waveforms are read from the cache once a song is shown
+                            records.append(SongRecord(uri=item.get('uri'),
+                                                      title=item.get('title'),
+                                                      artist=item.get('artist'),
+                                                      duration=duration_ns_loaded,
+                                                      album_art_hash=art_hash))
+                loaded = True
             except Exception as e:
                 print(f"Error in background playlist load: {e}", file=sys.stderr)
-            
-            GLib.idle_add(self._apply_loaded_playlist, songs_to_add)
+
+            # A playlist opened from a file (or a broken one) becomes the new snapshot
+            GLib.idle_add(self._apply_loaded_playlist, records, loaded and not filepath)
 
         thread = threading.Thread(target=background_load, daemon=True)
         thread.start()
 
-    def _apply_loaded_playlist(self, songs):
+    def _import_playlist(self, filepath):
+        """
+        Streams an M3U/M3U8, PLS or XSPF playlist into the (emptied)
+        playlist: rows appear as the file is read, and what the file
+        doesn't say about a song is read from the song afterwards.
+        """
+        print(f"Importing playlist from: {filepath}")
+        thread = threading.Thread(target=self._import_playlist_thread,
+                                  args=(filepath, self.playlist_batch.generation), daemon=True)
+        thread.start()
+
+    def _import_playlist_thread(self, filepath, generation):
+        incomplete = []
+        chunk = []
+        # A small first chunk, so rows show up right away
+        chunk_size = 256
+        try:
+            for entry in read_playlist(filepath):
+                if self.playlist_batch.generation != generation:
+                    return
+                title = entry.title or os.path.splitext(os.path.basename(unquote(urlparse(entry.uri).path)))[0]
+                record = SongRecord(entry.uri, title, entry.artist, duration=entry.duration)
+                chunk.append(record)
+                if not (entry.title and entry.duration) and entry.uri.startswith("file://"):
+                    incomplete.append(record)
+                if len(chunk) >= chunk_size:
+                    GLib.idle_add(self._on_imported_records, chunk, generation)
+                    chunk = []
+                    chunk_size = SPLICE_CHUNK_SIZE
+        except Exception as e:
+            print(f"Error importing playlist {filepath}: {e}", file=sys.stderr)
+        if chunk:
+            GLib.idle_add(self._on_imported_records, chunk, generation)
+
+        # Fill in tags and durations (from the metadata cache when it has them)
+        updates = []
+        for record in incomplete:
+            if self.playlist_batch.generation != generation:
+                return
+            metadata = self.metadata.read(self._uri_to_path(record.uri))
+            if metadata:
+                updates.append((record, metadata))
+                if metadata.duration and record.uri not in self.waveform_cache:
+                    self.waveform_analyzer.add(record.uri)
+            if len(updates) >= 256:
+                GLib.idle_add(self._on_imported_metadata, updates, generation)
+                updates = []
+        if updates:
+            GLib.idle_add(self._on_imported_metadata, updates, generation)
+
+    def _on_imported_records(self, records, generation):
+        if self.playlist_batch.generation == generation:
+            n_items = self.playlist_store.get_n_items()
+            self.playlist_store.splice_records(n_items, 0, records)
+            if n_items == 0:
+                self._select_position(0)
+        return False
+
+    def _on_imported_metadata(self, updates, generation):
+        if self.playlist_batch.generation != generation:
+            return False
+        positions = []
+        for record, metadata in updates:
+            self.playlist_store.update_record(
+                record, title=metadata.title or record.title, artist=metadata.artist or record.artist,
+                album=metadata.album or record.album, duration=metadata.duration or record.duration,
+                album_art_hash=metadata.art_hash or record.album_art_hash)
+            position = self.playlist_index.position_of_record(record)
+            if position is not None:
+                positions.append(position)
+        # Rows are redrawn (and the journal updated) through items-changed;
+        # the selection would not survive that on its own
+        selection = self.selection_model.get_selection().copy()
+        self.playlist_store.refresh(ranges_of(sorted(positions)))
+        self.selection_model.set_selection(selection, selection)
+        return False
+
+    def _apply_loaded_playlist(self, records, from_journal=False):
         """Called on main thread to populate the playlist store."""
         # Only remove all if it's a full playlist load (we might want to change this)
-        self.playlist_store.remove_all()
-        for s in songs:
-            self.playlist_store.append(s)
+        # One splice: the journal is attached once the whole playlist is in
+        self.playlist_batch.cancel()
+        self.playlist_journal.recording = False
+        self.playlist_store.splice_records(0, self.playlist_store.get_n_items(), records)
+        self.playlist_journal.recording = True
+        self._attach_playlist_journal(reset=not from_journal)
         self._is_loading = False
         self._update_viewport()
         self._update_viewport()
@@ -1963,42 +2078,50 @@ class MamoWindow(Adw.ApplicationWindow):
         # We NO LONGER populate the Now Playing UI here by default,
         # to ensure it stays in sync with current_song (which is None).
         self._update_song_display(None)
-        self.selection_model.set_selected(0)
+        self._select_position(0)
 
         # Trigger background repair for 0-duration items
-        threading.Thread(target=self._repair_playlist_durations, daemon=True).start()
+        threading.Thread(target=self._repair_playlist_durations,
+                         args=(self.playlist_store.get_records(),), daemon=True).start()
 
-    def _repair_playlist_durations(self):
+    def _playlist_art_hashes(self):
+        """ArtStore reference source: the art of the playlist, once it is loaded. Any thread."""
+        if not self._playlist_journal_attached:
+            return None
+        items = self.playlist_store.get_records() + list(self.playlist_batch)
+        return {item.album_art_hash for item in items}
+
+    def _attach_playlist_journal(self, reset=False):
+        """Starts journaling playlist edits, optionally from a fresh snapshot of the store."""
+        if not self._playlist_journal_attached:
+            self._playlist_journal_attached = True
+            self.playlist_journal.attach(self.playlist_store)
+        if reset:
+            self.playlist_journal.reset()
+
+    def _on_duration_repaired(self, record, duration):
+        position = self.playlist_index.position_of_record(record)
+        if position is not None:
+            self.playlist_store.set_duration(position, duration)
+            self.playlist_journal.update_duration(position)
+        return False
+
+    def _repair_playlist_durations(self, records):
         """Background thread to fix missing durations in the playlist."""
-        needs_save = False
-        n_items = self.playlist_store.get_n_items()
-        
-        for i in range(n_items):
-            song = self.playlist_store.get_item(i)
-            if song and (song.duration is None or song.duration == 0):
-                path = self._uri_to_path(song.uri)
-                if path and os.path.exists(path):
-                    try:
-                        # Try Mutagen Easy
-                        audio = mutagen.File(path, easy=True)
-                        if audio and audio.info and hasattr(audio.info, 'length'):
-                            song.duration = int(audio.info.length * Gst.SECOND)
-                            needs_save = True
-                        # Fallback to standard Mutagen
-                        elif not audio:
-                             audio = mutagen.File(path)
-                             if audio and audio.info and hasattr(audio.info, 'length'):
-                                 song.duration = int(audio.info.length * Gst.SECOND)
-                                 needs_save = True
-                    except Exception as e:
-                        print(f"Error repairing duration for {path}: {e}")
-
-            # Trigger waveform analysis if missing
-            if song and song.duration > 0 and not song.waveform_data:
-                self._start_waveform_analysis(song)
-
-        if needs_save:
-            GLib.idle_add(self._schedule_playlist_save)
+        for record in records:
+            duration = record.duration
+            if not duration:
+                path = self._uri_to_path(record.uri)
+                # Served from the metadata cache after the first time
+                metadata = self.metadata.read(path) if path else None
+                if metadata and metadata.duration:
+                    duration = metadata.duration
+                    GLib.idle_add(self._on_duration_repaired, record, duration)
+
+            # Trigger waveform analysis if missing, results are matched to
+            # the playing song by URI. The analyzer is safe to use from here.
+            if duration > 0 and record.uri not in self.waveform_cache:
+                self.waveform_analyzer.add(record.uri)
 
     def _uri_to_path(self, uri):
         try:
@@ -2007,67 +2130,24 @@ class MamoWindow(Adw.ApplicationWindow):
         except:
             return None
 
-    def _find_cover_in_folder(self, folder_path):
-        """Scans for common cover art filenames in the folder."""
-        common_names = ["cover.jpg", "Cover.jpg", "folder.jpg", "Folder.jpg", 
-                        "artwork.jpg", "Artwork.jpg", "front.jpg", "Front.jpg"]
-        
-        # also check png
-        common_names.extend([n.replace(".jpg", ".png") for n in common_names])
-        
-        for name in common_names:
-            p = os.path.join(folder_path, name)
-            if os.path.exists(p):
-                return p
-        
-        # Scan if not found?
-        try:
-            for f in os.listdir(folder_path):
-                lower = f.lower()
-                if "cover" in lower or "front" in lower or "folder" in lower:
-                    if lower.endswith(".jpg") or lower.endswith(".png") or lower.endswith(".jpeg"):
-                        return os.path.join(folder_path, f)
-        except:
-            pass
-            
-        return None
-
     def _save_playlist(self, filepath=None):
-        """Saves the current playlist to a JSON file. Uses default if filepath is None."""
-        path_to_use = filepath if filepath else self._playlist_file_path
-        playlist_data = []
-        for i in range(self.playlist_store.get_n_items()):
-            song = self.playlist_store.get_item(i)
-            
-            duration_to_save = song.duration if isinstance(song.duration, int) and song.duration >= 0 else 0
-
-            
-            song_data_to_save = {
-                'uri': song.uri,
-                'title': song.title,
-                'artist': song.artist,
-                'duration_ns': duration_to_save
-            }
-            
-            if song.album_art_data:
-                 raw_bytes = song.album_art_data.get_data()
-                 song_data_to_save['album_art_b64'] = base64.b64encode(raw_bytes).decode('ascii')
-
-            
-            playlist_data.append(song_data_to_save)
+        """
+        Saves the current playlist to a JSON file. Without a filepath the
+        default playlist's pending journal entries are written out; it is
+        otherwise kept up to date as the playlist changes.
+        """
+        if not filepath:
+            self.playlist_journal.close()
+            return
 
         try:
-            
-            target_dir = os.path.dirname(path_to_use)
-            if target_dir: 
-                 os.makedirs(target_dir, exist_ok=True)
-
-            print(f"Saving playlist to: {path_to_use}")
-            with open(path_to_use, 'w') as f:
-                json.dump(playlist_data, f, indent=2) 
-
+            print(f"Saving playlist to: {filepath}")
+            if is_playlist_file(filepath):
+                write_playlist(filepath, self.playlist_store.get_records())
+            else:
+                write_playlist_file(filepath, [song_entry(record) for record in self.playlist_store.get_records()])
         except Exception as e:
-            print(f"Error saving playlist to {path_to_use}: {e}", file=sys.stderr)
+            print(f"Error saving playlist to {filepath}: {e}", file=sys.stderr)
 
 
 
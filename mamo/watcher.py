@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+from gi.repository import Gio, GLib
+
+# inotify watches are a per-user resource, stay well below the usual limit
+MAX_WATCHED_FOLDERS = 4000
+# Flush changes once the tree has been quiet this long...
+DEBOUNCE_SECONDS = 2.0
+# ...or at the latest this long after the first change of a burst
+MAX_DELAY_SECONDS = 15.0
+# Fallback fingerprint check when the tree is too big to watch fully
+POLL_INTERVAL_SECONDS = 600
+
+WATCHED_EVENTS = (
+    Gio.FileMonitorEvent.CREATED,
+    Gio.FileMonitorEvent.DELETED,
+    Gio.FileMonitorEvent.MOVED_IN,
+    Gio.FileMonitorEvent.MOVED_OUT,
+    Gio.FileMonitorEvent.RENAMED,
+    Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+)
+
+
+class LibraryWatcher:
+    """
+    Watches a library tree with one Gio.FileMonitor per folder and reports
+    which folders need to be re-read. Events are debounced and coalesced, so
+    a large copy turns into a few refresh calls rather than one per file.
+
+    on_changes(dirty) receives a dict of folder -> recursive flag; recursive
+    entries are folders that appeared or disappeared as a whole. on_poll() is
+    called periodically when the tree has more folders than can be watched.
+    Must be used from the main thread.
+    """
+    def __init__(self, root, on_changes, on_poll):
+        self.root = root
+        self.on_changes = on_changes
+        self.on_poll = on_poll
+        self._monitors = {} # folder -> Gio.FileMonitor
+        self._dirty = {}
+        self._first_event = 0.0
+        self._last_event = 0.0
+        self._flush_timer_id = None
+        self._poll_timer_id = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._watch_tree(self.root)
+
+    def stop(self):
+        self._running = False
+        for monitor in self._monitors.values():
+            monitor.cancel()
+        self._monitors.clear()
+        self._dirty.clear()
+        if self._flush_timer_id:
+            GLib.source_remove(self._flush_timer_id)
+            self._flush_timer_id = None
+        if self._poll_timer_id:
+            GLib.source_remove(self._poll_timer_id)
+            self._poll_timer_id = None
+
+    def _watch_tree(self, top):
+        """Lists the folders below top in a thread, then monitors them."""
+        def list_folders():
+            folders = []
+            pending = [top]
+            # Breadth first, so the upper levels are watched if we hit the limit
+            while pending:
+                folder = pending.pop(0)
+                folders.append(folder)
+                try:
+                    with os.scandir(folder) as it:
+                        for entry in it:
+                            if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                except OSError:
+                    pass
+            GLib.idle_add(self._add_monitors, folders)
+
+        threading.Thread(target=list_folders, daemon=True).start()
+
+    def _add_monitors(self, folders):
+        if not self._running:
+            return False
+        for folder in folders:
+            if folder in self._monitors:
+                continue
+            if len(self._monitors) >= MAX_WATCHED_FOLDERS:
+                self._start_polling()
+                break
+            try:
+                monitor = Gio.File.new_for_path(folder).monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error as e:
+                print(f"LibraryWatcher: Cannot watch {folder}: {e.message}")
+                self._start_polling()
+                continue
+            monitor.connect("changed", self._on_changed, folder)
+            self._monitors[folder] = monitor
+        return False
+
+    def _remove_monitors(self, top):
+        prefix = top + os.sep
+        for folder in [f for f in self._monitors if f == top or f.startswith(prefix)]:
+            self._monitors.pop(folder).cancel()
+
+    def _start_polling(self):
+        if self._poll_timer_id is None:
+            print(f"LibraryWatcher: Too many folders to watch, checking every {POLL_INTERVAL_SECONDS}s")
+            self._poll_timer_id = GLib.timeout_add_seconds(POLL_INTERVAL_SECONDS, self._on_poll)
+
+    def _on_poll(self):
+        self.on_poll()
+        return True
+
+    def _on_changed(self, monitor, gfile, other_file, event_type, folder):
+        if event_type not in WATCHED_EVENTS:
+            return
+        path = gfile.get_path()
+        if not path or os.path.basename(path).startswith('.'):
+            return
+
+        # The folder holding the entry always needs a fingerprint check
+        self._mark_dirty(folder, False)
+
+        if event_type in (Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_OUT,
+                          Gio.FileMonitorEvent.RENAMED):
+            # May have been a whole folder, drop everything below it
+            self._mark_dirty(path, True)
+            self._remove_monitors(path)
+
+        new_path = path
+        if event_type == Gio.FileMonitorEvent.RENAMED:
+            new_path = other_file.get_path() if other_file else None
+        if event_type in (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.MOVED_IN,
+                          Gio.FileMonitorEvent.RENAMED):
+            if new_path and os.path.isdir(new_path):
+                self._mark_dirty(new_path, True)
+                self._watch_tree(new_path)
+
+    def _mark_dirty(self, folder, recursive):
+        now = time.monotonic()
+        if not self._dirty:
+            self._first_event = now
+        self._last_event = now
+        self._dirty[folder] = self._dirty.get(folder, False) or recursive
+        if self._flush_timer_id is None:
+            self._flush_timer_id = GLib.timeout_add(500, self._on_flush_timer)
+
+    def _on_flush_timer(self):
+        now = time.monotonic()
+        quiet = now - self._last_event >= DEBOUNCE_SECONDS
+        overdue = now - self._first_event >= MAX_DELAY_SECONDS
+        if not (quiet or overdue):
+            return True
+        dirty, self._dirty = self._dirty, {}
+        if dirty and not self.on_changes(dirty):
+            # Busy (e.g. a full scan is running), keep the changes for later
+            for folder, recursive in dirty.items():
+                self._dirty[folder] = self._dirty.get(folder, False) or recursive
+            self._first_event = now
+            return True
+        self._flush_timer_id = None
+        return False
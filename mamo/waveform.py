@@ -0,0 +1,394 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GObject, GLib, Gst
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Analysis order, lowest first
+PRIORITY_CURRENT = 0
+PRIORITY_UPCOMING = 1
+PRIORITY_VISIBLE = 2
+PRIORITY_BACKLOG = 3
+
+# How often the analysis checks whether it was cancelled (ns)
+CANCEL_CHECK_INTERVAL = 100 * Gst.MSECOND
+# One waveform value per this much audio (ns)
+WAVEFORM_INTERVAL = 50 * Gst.MSECOND
+
+# The appsink engine analyzes every channel at this rate, 800 samples per value
+ANALYSIS_RATE = 16000
+SAMPLES_PER_VALUE = ANALYSIS_RATE * WAVEFORM_INTERVAL // Gst.SECOND
+# Mean square of a silent channel, -700 dB as the level element reports it
+SILENCE = 1e-70
+# Decoded audio handed to NumPy at a time (seconds)
+BLOCK_SECONDS = 4
+# Partial waveforms of the watched URI go to the main thread at most this often (seconds)
+PARTIAL_INTERVAL = 0.25
+
+
+def default_workers():
+    # One core is left to playback and the UI
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
+
+
+def appsink_available():
+    return numpy is not None and Gst.ElementFactory.find("appsink") is not None
+
+
+def analyze_waveform(uri, abort=None, progress=None):
+    """
+    Decodes uri and returns its waveform as a list of linear RMS levels
+    (0.0 - 1.0), one per 50 ms, or None. Runs in the calling thread;
+    setting the threading.Event abort stops it early. progress, if given,
+    is called with the list of values so far as it grows.
+
+    Uses the appsink engine when NumPy is installed, the level element
+    otherwise.
+    """
+    if appsink_available():
+        return analyze_with_appsink(uri, abort, progress)
+    return analyze_with_level(uri, abort, progress)
+
+
+def analyze_with_appsink(uri, abort=None, progress=None):
+    """
+    Pulls the decoded audio, resampled to a low rate, from an appsink and
+    computes the RMS of each 50 ms with NumPy, a few seconds of audio at a
+    time. The Python side sees one buffer per decoded frame (or second,
+    with audiobuffersplit) instead of a bus message per value.
+
+    Channels are measured separately and combined like the level engine
+    does (the mean of their levels in dB), so both give the same waveform.
+    """
+    split = ""
+    if Gst.ElementFactory.find("audiobuffersplit"):
+        split = "audiobuffersplit output-buffer-duration=1/1 ! "
+    pipeline_str = (f"uridecodebin uri=\"{uri}\" ! audioconvert ! audioresample quality=0 ! "
+                    f"audio/x-raw,format=F32LE,layout=interleaved,rate={ANALYSIS_RATE} ! {split}"
+                    f"appsink name=sink sync=false max-buffers=64")
+    pipeline = Gst.parse_launch(pipeline_str)
+    if not pipeline:
+        print(f"Failed to create analysis pipeline for {uri}")
+        return None
+
+    sink = pipeline.get_by_name("sink")
+    bus = pipeline.get_bus()
+    pipeline.set_state(Gst.State.PLAYING)
+
+    channels = None
+    pending = bytearray()
+    values = []
+    try:
+        while True:
+            if abort is not None and abort.is_set():
+                return None
+            sample = sink.emit("try-pull-sample", CANCEL_CHECK_INTERVAL)
+            if sample is None:
+                if sink.get_property("eos"):
+                    break
+                msg = bus.pop_filtered(Gst.MessageType.ERROR)
+                if msg:
+                    err, dbg = msg.parse_error()
+                    print(f"Waveform Analysis Error for {uri}: {err.message}")
+                    break
+                continue
+            if channels is None:
+                # The decoder's channel count, passed through by audioconvert
+                channels = sample.get_caps().get_structure(0).get_value("channels") or 1
+                block_bytes = BLOCK_SECONDS * ANALYSIS_RATE * 4 * channels
+            buf = sample.get_buffer()
+            pending += buf.extract_dup(0, buf.get_size())
+            if len(pending) >= block_bytes:
+                _rms_values(pending, values, channels, final=False)
+                if progress:
+                    progress(values)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    if channels:
+        _rms_values(pending, values, channels, final=True)
+    return values or None
+
+
+def _rms_values(pending, values, channels, final):
+    """
+    Appends the level of every whole 50 ms in pending (interleaved F32
+    frames) to values and removes those frames. With final the last,
+    partial 50 ms counts too. The level is the RMS of each channel,
+    combined as the mean of their dB values: 10^(mean(10 log10(ms)) / 20),
+    i.e. the square root of the geometric mean of their mean squares.
+    """
+    frame_bytes = 4 * channels
+    n = len(pending) // frame_bytes
+    whole = n - n % SAMPLES_PER_VALUE
+    if whole:
+        samples = numpy.frombuffer(pending, dtype='<f4', count=whole * channels).reshape(
+            -1, SAMPLES_PER_VALUE, channels)
+        values.extend(_combine(numpy.einsum('ijk,ijk->ik', samples, samples) / SAMPLES_PER_VALUE).tolist())
+        del samples # frombuffer holds on to pending's buffer
+    if final and n > whole:
+        rest = numpy.frombuffer(pending, dtype='<f4', count=n * channels)[whole * channels:].reshape(-1, channels)
+        values.append(float(_combine(numpy.einsum('jk,jk->k', rest, rest)[None, :] / len(rest))[0]))
+        del rest
+        pending.clear()
+    else:
+        del pending[:whole * frame_bytes]
+
+
+def _combine(mean_squares):
+    """Levels of rows of per-channel mean squares, averaged in dB."""
+    # In doubles, SILENCE is below what a float32 holds
+    mean_squares = numpy.maximum(mean_squares.astype(numpy.float64), SILENCE)
+    return numpy.sqrt(numpy.exp(numpy.log(mean_squares).mean(axis=1)))
+
+
+def analyze_with_level(uri, abort=None, progress=None):
+    """Reads the waveform from the level element's messages, one per 50 ms."""
+    # Use uridecodebin and level for fast scanning. 50ms interval for good detail.
+    pipeline_str = f"uridecodebin uri=\"{uri}\" ! audioconvert ! level interval=50000000 post-messages=true ! fakesink"
+    pipeline = Gst.parse_launch(pipeline_str)
+    if not pipeline:
+        print(f"Failed to create analysis pipeline for {uri}")
+        return None
+
+    bus = pipeline.get_bus()
+    pipeline.set_state(Gst.State.PLAYING)
+
+    waveform_data = []
+    try:
+        while True:
+            msg = bus.timed_pop_filtered(CANCEL_CHECK_INTERVAL,
+                                         Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.ELEMENT)
+            if abort is not None and abort.is_set():
+                return None
+            if not msg:
+                continue
+
+            t = msg.type
+            if t == Gst.MessageType.EOS:
+                break
+            elif t == Gst.MessageType.ERROR:
+                err, dbg = msg.parse_error()
+                print(f"Waveform Analysis Error for {uri}: {err.message}")
+                break
+            elif t == Gst.MessageType.ELEMENT:
+                struct = msg.get_structure()
+                if struct and struct.get_name() == "level":
+                    rms_list = struct.get_value("rms")
+                    if rms_list:
+                        avg_db = sum(rms_list) / len(rms_list)
+                        waveform_data.append(pow(10, avg_db / 20.0))
+                        if progress:
+                            progress(waveform_data)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    return waveform_data or None
+
+
+class WaveformAnalyzer(GObject.Object):
+    """
+    Analyzes waveforms in a pool of worker threads, each running its own
+    GStreamer pipeline. Decoding happens in GStreamer's threads outside
+    the GIL, so the pool scales with the cores instead of working through
+    an imported library one file at a time.
+
+    URIs wait in a priority queue: the song playing comes first, then the
+    next few in the playlist, then the rows on screen, then the backlog in
+    the order it was added. prioritize() reorders the queue when any of
+    those change. The playing song doesn't wait for a busy pool, it gets
+    a worker of its own.
+
+    While the watched URI (the playing song) is analyzed, 'partial'
+    (uri, data so far) is emitted every PARTIAL_INTERVAL, so its waveform
+    can fill in as the file is decoded.
+
+    The queue, the URIs being analyzed and the worker count are shared
+    with the workers and only touched under the lock. Emits 'analyzed'
+    (uri, data) on the main thread for every URI that wasn't cancelled.
+    """
+    __gsignals__ = {
+        'analyzed': (GObject.SignalFlags.RUN_FIRST, None, (str, object)),
+        'partial': (GObject.SignalFlags.RUN_FIRST, None, (str, object)),
+    }
+
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers or default_workers()
+        self._lock = threading.Lock()
+        self._heap = [] # (priority, rank, uri), entries not in _queued are outdated
+        self._queued = {} # uri -> its current (priority, rank)
+        self._order = {} # uri -> rank in the backlog, the order it was added in
+        self._boosted = set() # Queued URIs above the backlog
+        self._ranks = itertools.count()
+        self._running = {} # uri -> threading.Event that aborts its analysis
+        self._n_threads = 0
+        self._watched = None
+
+    def __contains__(self, uri):
+        """Whether uri is queued or being analyzed."""
+        with self._lock:
+            return uri in self._queued or uri in self._running
+
+    def add(self, uri, priority=PRIORITY_BACKLOG):
+        """
+        Queues uri unless it is already on its way, or raises its priority.
+        Returns whether it was queued.
+        """
+        with self._lock:
+            if uri in self._running:
+                return False
+            queued = self._queued.get(uri)
+            if queued is not None and queued[0] <= priority:
+                return False
+            if uri not in self._order:
+                self._order[uri] = next(self._ranks)
+            self._push(uri, priority, self._order[uri])
+            start_thread = self._want_thread()
+        if start_thread:
+            threading.Thread(target=self._worker_loop, name="mamo-waveform", daemon=True).start()
+        return queued is None
+
+    def prioritize(self, current=None, upcoming=(), visible=()):
+        """
+        Sets which queued URIs go before the backlog: the one playing, the
+        upcoming ones (in playlist order) and the visible ones. URIs raised
+        by an earlier call go back to the backlog.
+        """
+        with self._lock:
+            for uri in self._boosted:
+                if uri in self._queued:
+                    self._push(uri, PRIORITY_BACKLOG, self._order[uri])
+            self._boosted.clear()
+            for uri in visible:
+                if uri in self._queued:
+                    self._push(uri, PRIORITY_VISIBLE, self._order[uri])
+            for rank, uri in enumerate(upcoming):
+                if uri in self._queued and self._queued[uri][0] > PRIORITY_UPCOMING:
+                    self._push(uri, PRIORITY_UPCOMING, rank)
+            if current in self._queued:
+                self._push(current, PRIORITY_CURRENT, 0)
+            start_thread = self._want_thread()
+        if start_thread:
+            threading.Thread(target=self._worker_loop, name="mamo-waveform", daemon=True).start()
+
+    def watch(self, uri):
+        """Streams partial results of uri's analysis ('partial'). None stops."""
+        self._watched = uri
+
+    def cancel(self, uri):
+        """Drops uri from the queue, or stops its analysis."""
+        self.retain(lambda other: other != uri)
+
+    def retain(self, keep):
+        """Drops the queued and running URIs for which keep(uri) is false."""
+        with self._lock:
+            for uri in [uri for uri in self._queued if not keep(uri)]:
+                del self._queued[uri]
+                self._order.pop(uri, None)
+                self._boosted.discard(uri)
+            for uri, abort in self._running.items():
+                if not keep(uri):
+                    abort.set()
+            self._compact_heap()
+
+    def cancel_all(self):
+        with self._lock:
+            self._heap.clear()
+            self._queued.clear()
+            self._order.clear()
+            self._boosted.clear()
+            for abort in self._running.values():
+                abort.set()
+
+    def _push(self, uri, priority, rank):
+        """Called with the lock held. The entry it replaces stays in the heap, outdated."""
+        self._queued[uri] = (priority, rank)
+        heapq.heappush(self._heap, (priority, rank, uri))
+        if priority < PRIORITY_BACKLOG:
+            self._boosted.add(uri)
+        self._compact_heap()
+
+    def _compact_heap(self):
+        """Drops outdated entries once they outnumber the queued ones. Called with the lock held."""
+        if len(self._heap) > 2 * len(self._queued) + 64:
+            self._heap = [(priority, rank, uri) for uri, (priority, rank) in self._queued.items()]
+            heapq.heapify(self._heap)
+
+    def _peek(self):
+        """The first queued (priority, rank, uri), or None. Called with the lock held."""
+        while self._heap:
+            priority, rank, uri = self._heap[0]
+            if self._queued.get(uri) == (priority, rank):
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return None
+
+    def _want_thread(self):
+        """Whether to start a worker, counting it if so. Called with the lock held."""
+        first = self._peek()
+        if first is None:
+            return False
+        # The playing song may take one worker beyond the pool
+        limit = self.workers + 1 if first[0] == PRIORITY_CURRENT else self.workers
+        if self._n_threads >= limit:
+            return False
+        self._n_threads += 1
+        return True
+
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                first = self._peek()
+                # The extra worker leaves once the playing song is taken
+                if first is None or (self._n_threads > self.workers and first[0] != PRIORITY_CURRENT):
+                    self._n_threads -= 1
+                    return
+                heapq.heappop(self._heap)
+                uri = first[2]
+                del self._queued[uri]
+                self._order.pop(uri, None)
+                self._boosted.discard(uri)
+                abort = threading.Event()
+                self._running[uri] = abort
+            try:
+                data = analyze_waveform(uri, abort, self._partial_reporter(uri, abort))
+            except Exception as e:
+                print(f"Unexpected error in waveform analysis for {uri}: {e}")
+                data = None
+            with self._lock:
+                self._running.pop(uri, None)
+            if data:
+                GLib.idle_add(self._on_analyzed, uri, data, abort)
+
+    def _partial_reporter(self, uri, abort):
+        """A progress callback for the analysis of uri, sending copies of its data while watched."""
+        last_sent = 0.0
+
+        def report(values):
+            nonlocal last_sent
+            if uri != self._watched:
+                return
+            now = time.monotonic()
+            if now - last_sent >= PARTIAL_INTERVAL:
+                last_sent = now
+                GLib.idle_add(self._on_partial, uri, list(values), abort)
+        return report
+
+    def _on_partial(self, uri, data, abort):
+        if not abort.is_set() and uri == self._watched:
+            self.emit('partial', uri, data)
+        return False
+
+    def _on_analyzed(self, uri, data, abort):
+        # Cancelled after the worker was done with it
+        if not abort.is_set():
+            self.emit('analyzed', uri, data)
+        return False
@@ -0,0 +1,319 @@
+import os
+import json
+import mmap
+import time
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import urlparse, unquote
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS waveforms (
+    uri TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    scale REAL NOT NULL,
+    mtime INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    accessed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Columns missing from the first version of the table. mtime and size of
+# the source file are 0 when unknown, accessed is a Unix time.
+COLUMNS = ('mtime', 'size', 'accessed')
+
+# The pack is rewritten once this much of it belongs to replaced or evicted waveforms
+COMPACT_RATIO = 0.5
+
+
+def quantize(data):
+    """Returns (bytes, scale): data as uint8 steps of scale/255, scale being its maximum."""
+    scale = max(data)
+    if scale <= 0:
+        return bytes(len(data)), 0.0
+    factor = 255.0 / scale
+    # Levels are never negative and none is above scale, so every step fits a byte
+    return bytes([int(value * factor + 0.5) for value in data]), float(scale)
+
+
+def dequantize(raw, scale):
+    step = scale / 255.0
+    return [value * step for value in raw]
+
+
+def source_stat(uri):
+    """(mtime_ns, size) of a local file, or None."""
+    parsed = urlparse(uri)
+    if parsed.scheme != 'file':
+        return None
+    try:
+        st = os.stat(unquote(parsed.path))
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class WaveformCache:
+    """
+    Waveforms of played and analyzed files, quantized to a byte per value
+    and appended to a single pack file that is read through mmap. The
+    index (waveforms.db) maps URIs to their slice of the pack and is read
+    into memory once, so checking a 20k-song playlist for missing
+    waveforms opens no files.
+
+    A waveform is dropped when its file's mtime or size no longer match
+    the ones it was analyzed from. Waveforms from the old
+    one-JSON-file-per-song cache in the same folder are moved into the
+    pack as they are asked for. Safe to use from any thread; see
+    CacheManager for eviction.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.db_path = os.path.join(root, "waveforms.db")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(waveforms)")}
+            for name in COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE waveforms ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'pack'").fetchone()
+            rows = conn.execute("SELECT uri, offset, length, scale, mtime, size, accessed FROM waveforms").fetchall()
+        self.pack_path = os.path.join(root, row[0] if row else "waveforms.pack")
+        self._index = {} # uri -> (offset, length, scale, mtime, size)
+        self._accessed = {} # uri -> last get() or put(), Unix time
+        self._dirty_accessed = set() # Not written to the index yet
+        for uri, offset, length, scale, mtime, size, accessed in rows:
+            self._index[uri] = (offset, length, scale, mtime, size)
+            self._accessed[uri] = accessed
+        self._remove_stale_packs()
+        self._pack = open(self.pack_path, "ab")
+        self._map = None
+        self._map_size = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remove_stale_packs(self):
+        """Deletes packs left behind by a compaction that didn't finish."""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".pack") and path != self.pack_path:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _legacy_path(self, uri):
+        return os.path.join(self.root, f"{hashlib.sha256(uri.encode('utf-8')).hexdigest()}.json")
+
+    def __contains__(self, uri):
+        """Whether there is a waveform for uri. Doesn't check it is stale, get() does."""
+        return uri in self._index or os.path.exists(self._legacy_path(uri))
+
+    def get(self, uri):
+        """Returns the waveform of uri as a list of floats, or None."""
+        entry = self._index.get(uri)
+        if entry is None:
+            return self._migrate(uri)
+        offset, length, scale, mtime, size = entry
+        if mtime:
+            stat = source_stat(uri)
+            if stat is not None and stat != (mtime, size):
+                # Re-encoded or retagged since it was analyzed
+                self.evict([uri])
+                return None
+        with self._lock:
+            if self._index.get(uri) is not entry:
+                return None
+            if offset + length > self._map_size and not self._remap():
+                return None
+            raw = self._map[offset:offset + length]
+            self._touch(uri)
+        return dequantize(raw, scale)
+
+    def put(self, uri, data):
+        """Stores a waveform (a sequence of linear levels), replacing any earlier one."""
+        if not data:
+            return
+        raw, scale = quantize(data)
+        mtime, size = source_stat(uri) or (0, 0)
+        with self._lock:
+            try:
+                offset = self._pack.seek(0, os.SEEK_END)
+                self._pack.write(raw)
+                self._pack.flush()
+            except OSError as e:
+                print(f"WaveformCache: Error writing {uri}: {e}")
+                return
+            now = int(time.time())
+            # The data is in the pack before the index points at it
+            with self._connection() as conn:
+                conn.execute("INSERT OR REPLACE INTO waveforms VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (uri, offset, len(raw), scale, mtime, size, now))
+            self._index[uri] = (offset, len(raw), scale, mtime, size)
+            self._accessed[uri] = now
+            self._dirty_accessed.discard(uri)
+
+    def _touch(self, uri):
+        """Called with the lock held; written out by entries()."""
+        self._accessed[uri] = int(time.time())
+        self._dirty_accessed.add(uri)
+
+    def _remap(self):
+        """Maps the pack again after it grew. Called with the lock held."""
+        size = os.path.getsize(self.pack_path)
+        if not size:
+            return False
+        if self._map is not None:
+            self._map.close()
+        with open(self.pack_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        self._map_size = size
+        return True
+
+    def _migrate(self, uri):
+        legacy_path = self._legacy_path(uri)
+        if not os.path.exists(legacy_path):
+            return None
+        try:
+            with open(legacy_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading waveform cache for {uri}: {e}")
+            return None
+        self.put(uri, data)
+        try:
+            os.unlink(legacy_path)
+        except OSError:
+            pass
+        return data
+
+    # CacheManager interface
+
+    def entries(self):
+        """Returns (uri, bytes, last access) of every waveform."""
+        with self._lock:
+            dirty = [(self._accessed[uri], uri) for uri in self._dirty_accessed if uri in self._index]
+            self._dirty_accessed.clear()
+            entries = [(uri, entry[1], self._accessed.get(uri, 0)) for uri, entry in self._index.items()]
+        if dirty:
+            with self._connection() as conn:
+                conn.executemany("UPDATE waveforms SET accessed = ? WHERE uri = ?", dirty)
+        return entries
+
+    def stale(self):
+        """Returns the URIs whose files changed or went away since they were analyzed. Slow."""
+        with self._lock:
+            entries = list(self._index.items())
+        stale = []
+        for uri, (_offset, _length, _scale, mtime, size) in entries:
+            if urlparse(uri).scheme != 'file':
+                continue
+            stat = source_stat(uri)
+            if stat is None or (mtime and stat != (mtime, size)):
+                stale.append(uri)
+        return stale
+
+    def evict(self, uris):
+        """Drops waveforms. Their bytes stay in the pack until compact()."""
+        with self._lock:
+            uris = [uri for uri in uris if self._index.pop(uri, None) is not None]
+            for uri in uris:
+                self._accessed.pop(uri, None)
+                self._dirty_accessed.discard(uri)
+            if uris:
+                with self._connection() as conn:
+                    conn.executemany("DELETE FROM waveforms WHERE uri = ?", [(uri,) for uri in uris])
+
+    def usage(self):
+        """Bytes on disk."""
+        total = 0
+        for name in os.listdir(self.root):
+            try:
+                total += os.path.getsize(os.path.join(self.root, name))
+            except OSError:
+                pass
+        return total
+
+    def compact(self, force=False):
+        """
+        Rewrites the pack without the bytes of replaced and evicted
+        waveforms once they make up COMPACT_RATIO of it. The copy is made
+        without the lock; waveforms stored meanwhile are carried over at
+        the end. The new pack and the offsets pointing into it are
+        committed in one transaction, so a crash leaves the old pack in use.
+        """
+        with self._lock:
+            snapshot = dict(self._index)
+        try:
+            pack_size = os.path.getsize(self.pack_path)
+        except OSError:
+            return
+        live = sum(entry[1] for entry in snapshot.values())
+        if pack_size <= live or (not force and pack_size - live < pack_size * COMPACT_RATIO):
+            return
+
+        name = f"waveforms-{time.time_ns()}.pack"
+        new_path = os.path.join(self.root, name)
+        offsets = {}
+        try:
+            # The pack is append-only until it is swapped, so reading it unlocked is safe
+            with open(self.pack_path, "rb") as src, open(new_path, "wb") as dst:
+                for uri, entry in sorted(snapshot.items(), key=lambda item: item[1][0]):
+                    src.seek(entry[0])
+                    offsets[uri] = (dst.tell(), entry)
+                    dst.write(src.read(entry[1]))
+                # The bulk of it reaches the disk before the lock is taken,
+                # get() and put() run on the main thread
+                dst.flush()
+                os.fsync(dst.fileno())
+                with self._lock:
+                    # Stored, replaced or evicted while copying; only this tail is synced below
+                    for uri, entry in self._index.items():
+                        if offsets.get(uri, (None, None))[1] is not entry:
+                            src.seek(entry[0])
+                            offsets[uri] = (dst.tell(), entry)
+                            dst.write(src.read(entry[1]))
+                    offsets = {uri: value for uri, value in offsets.items() if self._index.get(uri) is value[1]}
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    with self._connection() as conn:
+                        conn.executemany("UPDATE waveforms SET offset = ? WHERE uri = ?",
+                                         [(offset, uri) for uri, (offset, _entry) in offsets.items()])
+                        conn.execute("INSERT OR REPLACE INTO meta VALUES ('pack', ?)", (name,))
+                    old_path = self.pack_path
+                    self.pack_path = new_path
+                    for uri, (offset, entry) in offsets.items():
+                        self._index[uri] = (offset,) + entry[1:]
+                    self._pack.close()
+                    self._pack = open(new_path, "ab")
+                    if self._map is not None:
+                        self._map.close()
+                        self._map = None
+                        self._map_size = 0
+        except OSError as e:
+            print(f"WaveformCache: Error compacting: {e}")
+            if self.pack_path != new_path:
+                try:
+                    os.unlink(new_path)
+                except OSError:
+                    pass
+            return
+        try:
+            os.unlink(old_path)
+        except OSError:
+            pass